@@ -0,0 +1,77 @@
+"""Compare stdlib json with drf_payments.codec on large PayPal order payloads
+
+    cd example && PYTHONPATH=..:. python ../benchmarks/json_codec.py
+"""
+import json
+import os
+import timeit
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "example.settings")
+django.setup()
+
+from django.core.serializers.json import DjangoJSONEncoder  # noqa: E402
+
+from drf_payments import codec  # noqa: E402
+
+
+def paypal_order(items: int) -> dict:
+    """Order with ``items`` line items, shaped like PayPal Orders v2 response"""
+    return {
+        "id": "5O190127TN364715T",
+        "status": "COMPLETED",
+        "intent": "CAPTURE",
+        "payer": {"name": {"given_name": "John", "surname": "Doe"}, "email_address": "customer@example.com"},
+        "purchase_units": [
+            {
+                "reference_id": f"unit-{unit}",
+                "amount": {"currency_code": "USD", "value": "100.00", "breakdown": {"item_total": {"value": "100.00"}}},
+                "items": [
+                    {
+                        "name": f"Item {item}",
+                        "sku": f"sku-{unit}-{item}",
+                        "quantity": "1",
+                        "unit_amount": {"currency_code": "USD", "value": "10.00"},
+                        "description": "Lorem ipsum dolor sit amet, consectetur adipiscing elit" * 2,
+                    }
+                    for item in range(items)
+                ],
+                "payments": {
+                    "captures": [
+                        {
+                            "id": f"3C679366HH90852{unit}",
+                            "status": "COMPLETED",
+                            "amount": {"currency_code": "USD", "value": "100.00"},
+                            "create_time": "2024-01-01T00:00:00Z",
+                        },
+                    ],
+                },
+            }
+            for unit in range(10)
+        ],
+        "links": [
+            {"href": f"https://api.paypal.com/v2/checkout/orders/5O190127TN364715T/{rel}", "rel": rel, "method": "GET"}
+            for rel in ("self", "approve", "update", "capture")
+        ],
+    }
+
+
+def main():
+    for items in (10, 100):
+        order = paypal_order(items)
+        body = json.dumps(order).encode()
+        number = 200
+        results = {
+            "json.loads": timeit.timeit(lambda: json.loads(body), number=number),
+            "codec.loads": timeit.timeit(lambda: codec.loads(body), number=number),
+            "json.dumps": timeit.timeit(lambda: json.dumps(order, cls=DjangoJSONEncoder), number=number),
+            "codec.dumps": timeit.timeit(lambda: json.dumps(order, cls=codec.PaymentJSONEncoder), number=number),
+        }
+        print(f"PayPal order {len(body) // 1024} KiB, orjson={codec.use_orjson()}")
+        for name, seconds in results.items():
+            print(f"  {name:<12} {seconds / number * 1e6:10.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,7 @@ import importlib
 from decimal import Decimal
 from typing import NamedTuple, Optional, Union
 
-from django.apps import apps
+from django.apps import apps as django_apps
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 
@@ -31,7 +31,7 @@ def get_payment_model():
         app_label, model_name = settings.PAYMENT_MODEL.split(".")
     except (ValueError, AttributeError) as e:
         raise ImproperlyConfigured("PAYMENT_MODEL must be of the form " '"app_label.model_name"') from e
-    payment_model = apps.get_model(app_label, model_name)
+    payment_model = django_apps.get_model(app_label, model_name)
     if payment_model is None:
         msg = f'PAYMENT_MODEL refers to model "{settings.PAYMENT_MODEL}" that has not been installed'
         raise ImproperlyConfigured(msg)
@@ -47,6 +47,9 @@ def get_payment_service(
         return getattr(importlib.import_module(module), service_name)(
             secret_key=settings.PAYMENT_VARIANTS.get(variant)[1]["secret_key"],
             public_key=settings.PAYMENT_VARIANTS.get(variant)[1]["public_key"],
+            webhook_secret=settings.PAYMENT_VARIANTS.get(variant)[1].get("webhook_secret"),
+            capture=settings.PAYMENT_VARIANTS.get(variant)[1].get("capture", True),
+            variant=variant,
         )
     elif variant == "paypal":
         module, service_name = settings.PAYMENT_VARIANTS.get(variant)[0].rsplit(".", 1)
@@ -54,6 +57,9 @@ def get_payment_service(
             client_id=settings.PAYMENT_VARIANTS.get(variant)[1]["client_id"],
             secret_key=settings.PAYMENT_VARIANTS.get(variant)[1]["secret"],
             endpoint=settings.PAYMENT_VARIANTS.get(variant)[1]["endpoint"],
+            webhook_id=settings.PAYMENT_VARIANTS.get(variant)[1].get("webhook_id"),
+            capture=settings.PAYMENT_VARIANTS.get(variant)[1].get("capture", True),
+            variant=variant,
         )
     elif variant == "braintree":
         module, service_name = settings.PAYMENT_VARIANTS.get(variant)[0].rsplit(".", 1)
@@ -62,6 +68,8 @@ def get_payment_service(
             public_key=settings.PAYMENT_VARIANTS.get(variant)[1]["public_key"],
             private_key=settings.PAYMENT_VARIANTS.get(variant)[1]["private_key"],
             sandbox=settings.PAYMENT_VARIANTS.get(variant)[1]["sandbox"],
+            capture=settings.PAYMENT_VARIANTS.get(variant)[1].get("capture", True),
+            variant=variant,
         )
     elif variant == "authorizenet":
         module, service_name = settings.PAYMENT_VARIANTS.get(variant)[0].rsplit(".", 1)
@@ -69,6 +77,8 @@ def get_payment_service(
             login_id=settings.PAYMENT_VARIANTS.get(variant)[1]["login_id"],
             transaction_key=settings.PAYMENT_VARIANTS.get(variant)[1]["transaction_key"],
             endpoint=settings.PAYMENT_VARIANTS.get(variant)[1]["endpoint"],
+            capture=settings.PAYMENT_VARIANTS.get(variant)[1].get("capture", True),
+            variant=variant,
         )
     else:
         raise ImproperlyConfigured(f"{variant} is not valid variant")
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.contrib import admin, messages
+
+from drf_payments.deadletter import replay
+from drf_payments.models import WebhookDeadLetter
+
+
+@admin.register(WebhookDeadLetter)
+class WebhookDeadLetterAdmin(admin.ModelAdmin):
+    list_display = ("event_id", "gateway", "event_type", "error_code", "failures", "created", "resolved_at")
+    list_filter = ("gateway", "event_type", "error_code", ("resolved_at", admin.EmptyFieldListFilter))
+    search_fields = ("event_id", "error")
+    readonly_fields = ("created", "modified")
+    actions = ("replay_events",)
+
+    @admin.action(description="Replay selected events")
+    def replay_events(self, request, queryset):
+        resolved, failed = replay(
+            queryset,
+            concurrency=getattr(settings, "PAYMENT_DEAD_LETTER_CONCURRENCY", 8),
+            rate=getattr(settings, "PAYMENT_DEAD_LETTER_RATE", None),
+        )
+        level = messages.WARNING if failed else messages.SUCCESS
+        self.message_user(request, f"Resolved {resolved} event(s), {failed} still failing", level)
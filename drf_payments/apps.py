@@ -0,0 +1,17 @@
+from django.apps import AppConfig
+from django.conf import settings
+
+
+class DrfPaymentsConfig(AppConfig):
+    name = "drf_payments"
+    verbose_name = "DRF payments"
+    default_auto_field = "django.db.models.BigAutoField"
+
+    def ready(self):
+        # * Register built-in job handlers and signal receivers
+        from drf_payments import capture, events, expiry, notifications, routers, status, tasks  # noqa: F401
+
+        if getattr(settings, "PAYMENT_WARMUP", False):
+            from drf_payments.warmup import warmup
+
+            warmup()
@@ -1,8 +1,9 @@
-import requests
-
 from drf_payments.constants import PaymentError, PaymentStatus
 
 from ..core import BasicProvider
+from ..http import get_session
+from ..ratelimit import rate_limited
+from ..references import remember
 
 RESPONSE_STATUS = {
     "1": PaymentStatus.CONFIRMED,
@@ -17,6 +18,7 @@ class AuthorizeNetProvider(BasicProvider):
     it handles:
 
     - Creating a payment
+    - Capturing payment authorized with ``capture=False``
     - Immediately change payment status due to missing webhook in sanbox mode
 
     Args:
@@ -26,10 +28,12 @@ class AuthorizeNetProvider(BasicProvider):
     """
 
     def __init__(self, login_id, transaction_key, endpoint="https://test.authorize.net/gateway/transact.dll", **kwargs):
+        super().__init__(**kwargs)
         self.login_id = login_id
         self.transaction_key = transaction_key
         self.endpoint = endpoint
 
+    @rate_limited("process_payment")
     def process_payment(self, payment):
         """process_payment
 
@@ -57,11 +61,11 @@ class AuthorizeNetProvider(BasicProvider):
             "x_delim_data": True,
             "x_delim_char": "|",
             "x_method": "CC",
-            "x_type": "AUTH_CAPTURE",
+            "x_type": "AUTH_CAPTURE" if self._capture else "AUTH_ONLY",
         }
         # *  Append card data to payload
         data.update(payment.extra_data["card"])
-        resp = requests.post(self.endpoint, data=data)
+        resp = get_session("authorizenet").post(self.endpoint, data=data)
         data = resp.text.split("|")
         try:
             message = data[3]
@@ -70,10 +74,52 @@ class AuthorizeNetProvider(BasicProvider):
         status = "error"
         if resp.ok and RESPONSE_STATUS.get(data[0], False):
             status = RESPONSE_STATUS.get(data[0], status)
+            if status == PaymentStatus.CONFIRMED and not self._capture:
+                status = PaymentStatus.PREAUTH
             payment.transaction_id = data[6]
             payment.status = status.name
             payment.save(update_fields=["transaction_id", "status"])
+            remember(payment, "authorizenet", transaction=data[6])
         else:
             payment.status = PaymentStatus.ERROR.name
             payment.extra_data["errors"] = [message]
             payment.save(update_fields=["status", "extra_data"])
+
+    @rate_limited("capture")
+    def capture(self, payment, amount=None):
+        """capture
+
+        Capture transaction authorized with ``capture=False`` (``PRIOR_AUTH_CAPTURE``)
+
+        Args:
+            payment (payment): Payment instance
+            amount (decimal, optional): Amount to capture. Defaults to None.
+        """
+        if payment.status != PaymentStatus.PREAUTH.name:
+            raise PaymentError("Only pre-authorized payments can be captured")
+        data = {
+            "x_login": self.login_id,
+            "x_tran_key": self.transaction_key,
+            "x_delim_data": True,
+            "x_delim_char": "|",
+            "x_type": "PRIOR_AUTH_CAPTURE",
+            "x_trans_id": payment.transaction_id,
+        }
+        if amount is not None:
+            data["x_amount"] = amount
+        resp = get_session("authorizenet").post(self.endpoint, data=data)
+        data = resp.text.split("|")
+        if len(data) < 4:
+            raise PaymentError("Wrong response")
+        if not resp.ok or data[0] != "1":
+            raise PaymentError(f"Can't capture payment: {data[3]}", code="capture_failed")
+        payment.captured_amount = amount if amount is not None else payment.total
+        payment.status = PaymentStatus.CONFIRMED.name
+        payment.save(update_fields=["captured_amount", "status"])
+
+    def warmup(self):
+        """warmup
+
+        Open pooled connection to Authorize.Net before first payment
+        """
+        get_session("authorizenet").head(self.endpoint)
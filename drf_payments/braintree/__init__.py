@@ -1,7 +1,35 @@
 import braintree
 
+from drf_payments import deadline
 from drf_payments.constants import PaymentError, PaymentStatus
 from drf_payments.core import BasicProvider
+from drf_payments.ratelimit import rate_limited
+from drf_payments.references import remember
+
+#: Searchable timestamps of transaction statuses mapped by ``drf_payments.events.BRAINTREE_STATUSES``,
+#: settlement statuses without own timestamp are found by submission
+STATUS_CHANGED_AT = (
+    "authorized_at",
+    "submitted_for_settlement_at",
+    "settled_at",
+    "voided_at",
+    "processor_declined_at",
+    "gateway_rejected_at",
+    "failed_at",
+    "authorization_expired_at",
+)
+
+
+class DeadlineConfiguration(braintree.Configuration):
+    """Braintree configuration reading timeout of every request from ``drf_payments.deadline``"""
+
+    @property
+    def timeout(self):
+        return deadline.timeout(self._timeout)
+
+    @timeout.setter
+    def timeout(self, value):
+        self._timeout = value
 
 
 class BraintreeProvider(BasicProvider):
@@ -12,6 +40,8 @@ class BraintreeProvider(BasicProvider):
 
     - Creating a Checkout Session
 
+    - Capturing payment authorized with ``capture=False``
+
     - Refunding payment
 
     - Process payment confirmation with callback
@@ -25,26 +55,28 @@ class BraintreeProvider(BasicProvider):
 
     def __init__(self, merchant_id, public_key, private_key, sandbox, **kwargs):
         super().__init__(**kwargs)
-
-        if sandbox:
-            self.service = braintree.BraintreeGateway(
-                braintree.Configuration(
-                    braintree.Environment.Sandbox,
-                    merchant_id=merchant_id,
-                    public_key=public_key,
-                    private_key=private_key,
-                ),
-            )
-        else:
-            self.service = braintree.BraintreeGateway(
-                braintree.Configuration(
-                    braintree.Environment.Production,
-                    merchant_id=merchant_id,
-                    public_key=public_key,
-                    private_key=private_key,
-                ),
-            )
-
+        self.merchant_id = merchant_id
+        self.public_key = public_key
+        self.private_key = private_key
+        self.sandbox = sandbox
+        self.service = self._build_gateway()
+
+    def _build_gateway(self):
+        return braintree.BraintreeGateway(
+            DeadlineConfiguration(
+                braintree.Environment.Sandbox if self.sandbox else braintree.Environment.Production,
+                merchant_id=self.merchant_id,
+                public_key=self.public_key,
+                private_key=self.private_key,
+                timeout=deadline.default_timeout(),
+            ),
+        )
+
+    def reset_connections(self):
+        """Gateway keeps http sessions, forked process builds its own one"""
+        self.service = self._build_gateway()
+
+    @rate_limited("process_payment")
     def process_payment(self, payment):
         """process_payment
 
@@ -54,6 +86,9 @@ class BraintreeProvider(BasicProvider):
 
         Args:
             payment (payment): Payment instance
+
+        Raises:
+            PaymentError: Braintree declined sale
         """
         payment_method = payment.transaction_id
         try:
@@ -61,17 +96,55 @@ class BraintreeProvider(BasicProvider):
                 {
                     "amount": str(float(payment.total)),
                     "payment_method_nonce": payment_method,
-                    "options": {"submit_for_settlement": True},
+                    "options": {"submit_for_settlement": self._capture},
                 },
             )
         except Exception as e:
+            deadline.check(e)
             raise PaymentError("Can't process payment") from e
+        if not result.is_success:
+            # * Declined sale is not authorized either, payment must not become PREAUTH
+            raise PaymentError(f"Can't process payment: {result.message}", code="process_failed")
 
         data = self._serialize(result.transaction.__dict__)
         payment.transaction_id = result.transaction.id
         payment.extra_data["transaction"] = data
-        payment.save(update_fields=["extra_data", "transaction_id"])
+        update_fields = ["extra_data", "transaction_id"]
+        if not self._capture:
+            # * Braintree sends no webhook for authorization, transaction is authorized by sale itself
+            payment.status = PaymentStatus.PREAUTH.name
+            update_fields.append("status")
+        payment.save(update_fields=update_fields)
+        remember(payment, "braintree", transaction=result.transaction.id)
+
+    @rate_limited("capture")
+    def capture(self, payment, amount=None):
+        """capture
 
+        Submit transaction authorized with ``capture=False`` for settlement
+
+        Args:
+            payment (payment): Payment instance
+            amount (decimal, optional): Amount to settle. Defaults to None.
+        """
+        if payment.status != PaymentStatus.PREAUTH.name:
+            raise PaymentError("Only pre-authorized payments can be captured")
+        try:
+            if amount is None:
+                result = self.service.transaction.submit_for_settlement(payment.transaction_id)
+            else:
+                result = self.service.transaction.submit_for_settlement(payment.transaction_id, str(amount))
+        except Exception as e:
+            deadline.check(e)
+            raise PaymentError("Can't capture payment") from e
+        if not result.is_success:
+            raise PaymentError(f"Can't capture payment: {result.message}", code="capture_failed")
+        payment.extra_data["transaction"] = self._serialize(result.transaction.__dict__)
+        payment.captured_amount = amount if amount is not None else payment.total
+        payment.status = PaymentStatus.CONFIRMED.name
+        payment.save(update_fields=["extra_data", "captured_amount", "status"])
+
+    @rate_limited("refund")
     def refund(self, payment, amount=None):
         """refund
 
@@ -91,11 +164,33 @@ class BraintreeProvider(BasicProvider):
                     )  # pragma no cover sdk don't provide ErrorResult mock
                 payment.status = PaymentStatus.REFUNDED.name
                 payment.save(update_fields=["status"])
+                remember(payment, "braintree", refund=getattr(getattr(result, "transaction", None), "id", None))
                 return
             except Exception as e:
+                deadline.check(e)
                 raise PaymentError("Can't process refund") from e
         raise PaymentError("Only Confirmed payments can be refunded")
 
+    def list_events(self, since):
+        """list_events
+
+        Iterate transactions which changed status since ``since``, Braintree has no event log,
+        so transactions are yielded as ``{"bt_transaction": ...}`` payloads. Search criteria can't be OR-ed,
+        so each status timestamp is searched separately and transactions found twice are yielded once.
+        Search results are loaded lazily.
+
+        Args:
+            since (datetime): Oldest status change time
+        """
+        seen = set()
+        for field in STATUS_CHANGED_AT:
+            collection = self.service.transaction.search(getattr(braintree.TransactionSearch, field) >= since)
+            for transaction in collection.items:
+                if transaction.id in seen:
+                    continue
+                seen.add(transaction.id)
+                yield {"bt_transaction": self._serialize(transaction.__dict__)}
+
     @staticmethod
     def _serialize(data) -> dict:
         """_serialize
@@ -0,0 +1,78 @@
+import logging
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+
+from drf_payments import get_payment_model, get_payment_service, jobs
+from drf_payments.constants import PaymentStatus
+from drf_payments.utils import map_concurrently
+
+logger = logging.getLogger(__name__)
+
+
+def capture_payments(
+    ids: Iterable,
+    amounts: Optional[Dict[str, Decimal]] = None,
+    concurrency: Optional[int] = None,
+) -> List[Tuple[object, Optional[Exception]]]:
+    """capture_payments
+
+    Capture many payments authorized with ``capture=False`` concurrently, e.g. when order is shipped.
+    Payments that are not ``PREAUTH`` anymore are skipped, one failed capture doesn't stop the others.
+
+    Args:
+        ids (list): Primary keys of payments to capture
+        amounts (dict, optional): Partial amount by payment pk, whole total is captured for missing ones
+        concurrency (int, optional): Simultaneous gateway calls, ``PAYMENT_CAPTURE_CONCURRENCY`` by default
+
+    Returns:
+        list: ``(payment, error)`` tuples of captured payments, ``error`` is ``None`` on success
+    """
+    if concurrency is None:
+        concurrency = getattr(settings, "PAYMENT_CAPTURE_CONCURRENCY", 8)
+    amounts = {str(pk): Decimal(str(amount)) for pk, amount in (amounts or {}).items()}
+    payments = get_payment_model().objects.filter(pk__in=list(ids), status=PaymentStatus.PREAUTH.name)
+    services = {}
+
+    def capture(payment):
+        if payment.variant not in services:
+            services[payment.variant] = get_payment_service(payment.variant)
+        services[payment.variant].capture(payment, amounts.get(str(payment.pk)))
+
+    results = []
+    for payment, _, error in map_concurrently(capture, payments, concurrency):
+        if error is not None:
+            logger.warning("Can't capture payment %s: %s", payment.pk, error)
+        results.append((payment, error))
+    return results
+
+
+@jobs.register("drf_payments.capture_batch")
+def capture_payments_job(job):
+    """Job handler capturing ``ids`` from job payload, attempt fails (and is retried) when any capture failed"""
+    results = capture_payments(job.payload["ids"], job.payload.get("amounts"), job.payload.get("concurrency"))
+    if failed := [payment.pk for payment, error in results if error is not None]:
+        # * Captured payments are not PREAUTH anymore, retry captures only the failed ones
+        raise RuntimeError(f"Capture failed for payments: {', '.join(str(pk) for pk in failed)}")
+
+
+def schedule_capture(ids: Iterable, amounts: Optional[Dict[str, Decimal]] = None, run_after=None):
+    """schedule_capture
+
+    Enqueue batch capture job, any job worker captures payments once ``run_after`` is due
+
+    Args:
+        ids (list): Primary keys of payments to capture
+        amounts (dict, optional): Partial amount by payment pk
+        run_after (datetime, optional): Do not capture before this moment
+    """
+    return jobs.enqueue(
+        "drf_payments.capture_batch",
+        payload={
+            "ids": [str(pk) for pk in ids],
+            "amounts": {str(pk): str(amount) for pk, amount in (amounts or {}).items()},
+        },
+        run_after=run_after,
+        max_attempts=getattr(settings, "PAYMENT_CAPTURE_MAX_ATTEMPTS", 10),
+    )
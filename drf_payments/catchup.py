@@ -0,0 +1,113 @@
+import logging
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from drf_payments import get_payment_service
+from drf_payments.constants import PaymentError
+from drf_payments.deadletter import describe, store
+from drf_payments.events import ShardedProcessor, apply_events, parse_event
+from drf_payments.models import WebhookCheckpoint
+
+logger = logging.getLogger(__name__)
+
+
+class CatchUpResult(NamedTuple):
+    applied: int
+    duplicates: int
+    failed: int
+
+
+class SeenEvents:
+    """Bounded set of recently seen event ids, the oldest ids are forgotten first"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._ids = OrderedDict()
+
+    def add(self, event_id: str) -> bool:
+        """Remember event id, ``False`` when it was seen already"""
+        if event_id in self._ids:
+            self._ids.move_to_end(event_id)
+            return False
+        self._ids[event_id] = None
+        if len(self._ids) > self.size:
+            self._ids.popitem(last=False)
+        return True
+
+
+def catch_up(
+    variant: str,
+    since: Optional[datetime] = None,
+    concurrency: int = 8,
+    max_pending: Optional[int] = None,
+) -> CatchUpResult:
+    """catch_up
+
+    Fetch events gateway sent since the last run (``WebhookCheckpoint``) and apply them with webhook handlers.
+    Events are streamed from gateway, deduplicated by id and applied by ``ShardedProcessor``
+    with at most ``max_pending`` events in flight, so memory doesn't grow with backlog.
+    Failed events are stored as dead letters, checkpoint moves to the start of the run once stream is consumed.
+    Single worker applies events inline in the calling thread (and its transaction).
+
+    Args:
+        variant (str): Payment variant
+        since (datetime, optional): Oldest event time, checkpoint minus ``PAYMENT_CATCH_UP_OVERLAP`` seconds
+            or ``PAYMENT_CATCH_UP_LOOKBACK`` seconds ago on the first run by default
+        concurrency (int, optional): Events applied simultaneously. Defaults to 8.
+        max_pending (int, optional): Events in flight, ``concurrency * 100`` by default
+    """
+    checkpoint, _ = WebhookCheckpoint.objects.get_or_create(variant=variant)
+    started = timezone.now()
+    if since is None:
+        if checkpoint.synced_until is not None:
+            # * Events become visible in gateway lists with a delay, window overlaps previous run
+            since = checkpoint.synced_until - timedelta(seconds=getattr(settings, "PAYMENT_CATCH_UP_OVERLAP", 300))
+        else:
+            since = started - timedelta(seconds=getattr(settings, "PAYMENT_CATCH_UP_LOOKBACK", 24 * 60 * 60))
+    max_pending = max_pending or concurrency * 100
+    seen = SeenEvents(getattr(settings, "PAYMENT_CATCH_UP_DEDUPE_SIZE", 100_000))
+    processor = ShardedProcessor(shards=concurrency) if concurrency > 1 else None
+    pending = deque()
+    applied = duplicates = failed = 0
+
+    def finish(payload, error):
+        nonlocal applied, failed
+        if error is None:
+            applied += 1
+        else:
+            failed += 1
+            store(payload, error)
+
+    try:
+        for payload in get_payment_service(variant).list_events(since):
+            if not seen.add(describe(payload)[2]):
+                duplicates += 1
+                continue
+            try:
+                event = parse_event(payload)
+            except PaymentError as e:
+                finish(payload, e)
+                continue
+            if event is None:
+                continue
+            if processor is None:
+                finish(payload, apply_events([event])[0])
+                continue
+            pending.append((payload, processor.submit(event)))
+            while len(pending) >= max_pending:
+                payload, future = pending.popleft()
+                finish(payload, future.exception())
+        while pending:
+            payload, future = pending.popleft()
+            finish(payload, future.exception())
+    finally:
+        if processor is not None:
+            processor.shutdown()
+    checkpoint.synced_until = started
+    checkpoint.save(update_fields=["synced_until", "modified"])
+    logger.info("Caught up %s: %s applied, %s duplicates, %s failed", variant, applied, duplicates, failed)
+    return CatchUpResult(applied, duplicates, failed)
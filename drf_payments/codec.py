@@ -0,0 +1,79 @@
+import json
+from typing import Union
+
+import stripe
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+try:
+    import orjson
+except ImportError:  # pragma no cover
+    orjson = None
+
+
+def use_orjson() -> bool:
+    """orjson is used when installed unless ``PAYMENT_JSON_CODEC`` is ``"json"``"""
+    return orjson is not None and getattr(settings, "PAYMENT_JSON_CODEC", "auto") != "json"
+
+
+def default(obj):
+    """default
+
+    Serialize values JSON can't, gateway SDK objects are serialized from their own storage without copying
+
+    Args:
+        obj: Value to serialize
+    """
+    # * StripeObject is dict in older SDK versions and keeps values in ``_data`` dict in newer ones
+    if isinstance(obj, stripe.StripeObject):
+        return obj._data
+    return DjangoJSONEncoder().default(obj)
+
+
+def dumps(obj) -> bytes:
+    """Serialize to UTF-8 JSON with orjson when available"""
+    if use_orjson():
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=default, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: Union[bytes, str]):
+    """Parse JSON with orjson when available"""
+    if use_orjson():
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class PaymentJSONEncoder(DjangoJSONEncoder):
+    """Encoder of ``JSONField`` using fast codec, stdlib encoder is used when orjson is not installed"""
+
+    def default(self, o):
+        return default(o)
+
+    def encode(self, o):
+        if use_orjson():
+            return orjson.dumps(o, default=default, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        return super().encode(o)
+
+
+class PaymentJSONDecoder(json.JSONDecoder):
+    """Decoder of ``JSONField`` using fast codec"""
+
+    def decode(self, s, *args, **kwargs):
+        if use_orjson():
+            return orjson.loads(s)
+        return super().decode(s, *args, **kwargs)
+
+
+class FastJSONParser(JSONParser):
+    """JSON parser of webhook bodies using fast codec"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if stream is None:
+            return None
+        try:
+            return loads(stream.read())
+        except ValueError as e:
+            raise ParseError(f"JSON parse error - {e}") from e
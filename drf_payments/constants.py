@@ -2,11 +2,18 @@ from enum import Enum
 
 
 class PaymentError(Exception):
+    #: Codes of errors gateway may not answer the same way later, operation is worth retrying
+    RETRYABLE_CODES = ("gateway_unavailable", "deadline_exceeded", "rate_limited")
+
     def __init__(self, message, code=None, gateway_message=None):
         super().__init__(message)
         self.code = code
         self.gateway_message = gateway_message
 
+    @property
+    def retryable(self) -> bool:
+        return self.code in self.RETRYABLE_CODES
+
 
 class PaymentStatus(Enum):
     WAITING = "waiting"
@@ -16,6 +23,14 @@ class PaymentStatus(Enum):
     REFUNDED = "refunded"
     ERROR = "error"
     INPUT = "input"
+    EXPIRED = "expired"
+
+
+class JobStatus(Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
 
 
 class FraudStatus(Enum):
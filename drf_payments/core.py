@@ -1,3 +1,5 @@
+import os
+import weakref
 from typing import Dict, Tuple
 
 from django.conf import settings
@@ -5,6 +7,9 @@ from django.utils.module_loading import import_string
 
 PAYMENT_VARIANTS: Dict[str, Tuple[str, Dict]] = {"default": ("drf_payments.stripe.StripeProvider", {})}
 
+#: Live provider instances, their connections are rebuilt in forked child process
+_PROVIDERS = weakref.WeakSet()
+
 
 class BasicProvider:
     """Defined a base provider API.
@@ -14,13 +19,19 @@ class BasicProvider:
     ``BasicProvider`` should not be instantiated directly. Use factory instead.
     """
 
-    def __init__(self, capture=True, **kwargs):
+    def __init__(self, capture=True, variant=None, **kwargs):
         """Create a new provider instance.
 
         This method should not be called directly; use :func:`provider_factory`
         instead.
         """
         self._capture = capture
+        #: Name of the variant provider was created for, defaults to provider class name
+        self.variant = variant or type(self).__name__
+        _PROVIDERS.add(self)
+
+    def reset_connections(self):
+        """Drop connection state inherited from parent process, immutable configuration is kept"""
 
     def process_payment(self, payment):
         raise NotImplementedError()
@@ -28,6 +39,20 @@ class BasicProvider:
     def refund(self, payment, amount=None):
         raise NotImplementedError()
 
+    def capture(self, payment, amount=None):
+        """Capture funds of payment authorized with ``capture=False``, ``amount`` smaller than total is partial"""
+        raise NotImplementedError()
+
+    def warmup(self):
+        """Prepare SDK, connections and credentials before first payment, called by ``drf_payments.warmup``"""
+
+    def expire(self, payment):
+        """Invalidate pending payment on gateway side, by default gateway expires it on its own"""
+
+    def list_events(self, since):
+        """Iterate events gateway sent (or would send) since ``since`` as webhook payloads, used by catch-up"""
+        raise NotImplementedError()
+
 
 PROVIDER_CACHE = {}
 
@@ -45,7 +70,7 @@ def _default_provider_factory(variant: str, payment=None):
         module_path, class_name = handler.rsplit(".", 1)
         module = __import__(str(module_path), globals(), locals(), [str(class_name)])
         class_ = getattr(module, class_name)
-        PROVIDER_CACHE[variant] = class_(**config)
+        PROVIDER_CACHE[variant] = class_(variant=variant, **config)
     return PROVIDER_CACHE[variant]
 
 
@@ -53,3 +78,13 @@ if PAYMENT_VARIANT_FACTORY := getattr(settings, "PAYMENT_VARIANT_FACTORY", None)
     provider_factory = import_string(PAYMENT_VARIANT_FACTORY)
 else:
     provider_factory = _default_provider_factory
+
+
+def _reset_providers():
+    for provider in list(_PROVIDERS):
+        provider.reset_connections()
+
+
+# * Servers preloading application (gunicorn --preload) fork after providers were created
+if hasattr(os, "register_at_fork"):  # pragma no branch
+    os.register_at_fork(after_in_child=_reset_providers)
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import logging
+import time
+from concurrent.futures import Future
+from typing import Optional, Tuple
+
+from django.db.models import F
+from django.utils import timezone
+
+from drf_payments.constants import PaymentError
+from drf_payments.events import ShardedProcessor, apply_events, parse_event
+from drf_payments.models import WebhookDeadLetter
+
+logger = logging.getLogger(__name__)
+
+
+def describe(payload: dict) -> Tuple[str, str, str]:
+    """describe
+
+    Gateway, event type and event id of webhook payload, payload hash is used as id
+    when gateway doesn't send one
+
+    Args:
+        payload (dict): Webhook payload
+    """
+    if "bt_signature" in payload:
+        gateway, event_type, event_id = "braintree", "", None
+    elif "bt_transaction" in payload:
+        transaction = payload["bt_transaction"]
+        gateway, event_type, event_id = (
+            "braintree",
+            "transaction",
+            f"{transaction.get('id')}:{transaction.get('status')}",
+        )
+    elif "event_type" in payload:
+        gateway, event_type, event_id = "paypal", payload["event_type"], payload.get("id")
+    else:
+        gateway, event_type, event_id = "stripe", payload.get("type", ""), payload.get("id")
+    if not event_id:
+        event_id = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return gateway, event_type, f"{gateway}:{event_id}"
+
+
+def store(payload: dict, error: Exception) -> WebhookDeadLetter:
+    """store
+
+    Persist failed webhook event, redelivery of the same event increments ``failures``
+
+    Args:
+        payload (dict): Webhook payload
+        error (Exception): Error event failed with
+    """
+    gateway, event_type, event_id = describe(payload)
+    letter, created = WebhookDeadLetter.objects.get_or_create(
+        event_id=event_id,
+        defaults={
+            "gateway": gateway,
+            "event_type": event_type,
+            "payload": payload,
+            "error": str(error),
+            "error_code": getattr(error, "code", None) or "",
+        },
+    )
+    if not created:
+        WebhookDeadLetter.objects.filter(pk=letter.pk).update(
+            failures=F("failures") + 1,
+            error=str(error),
+            error_code=getattr(error, "code", None) or "",
+            resolved_at=None,
+            modified=timezone.now(),
+        )
+    logger.warning("Webhook event %s failed: %s", event_id, error)
+    return letter
+
+
+def replay(queryset=None, concurrency: int = 8, rate: Optional[float] = None, chunk_size: int = 500) -> Tuple[int, int]:
+    """replay
+
+    Reprocess unresolved dead letters oldest first through normal webhook handlers.
+    Events are applied by ``ShardedProcessor``, so events of one payment keep their order.
+    Single worker applies events inline in the calling thread (and its transaction).
+
+    Args:
+        queryset (QuerySet, optional): Dead letters to replay, all unresolved by default
+        concurrency (int, optional): Events applied simultaneously. Defaults to 8.
+        rate (float, optional): Maximum events replayed per second
+        chunk_size (int, optional): Dead letters loaded at once. Defaults to 500.
+
+    Returns:
+        tuple: Number of resolved and still failing events
+    """
+    queryset = (queryset if queryset is not None else WebhookDeadLetter.objects.all()).filter(resolved_at=None)
+    processor = ShardedProcessor(shards=concurrency) if concurrency > 1 else None
+    resolved = failed = 0
+    last_pk = None
+    started = time.monotonic()
+    try:
+        while True:
+            chunk = queryset.order_by("pk") if last_pk is None else queryset.filter(pk__gt=last_pk).order_by("pk")
+            letters = list(chunk[:chunk_size])
+            if not letters:
+                return resolved, failed
+            last_pk = letters[-1].pk
+            results = []
+            for letter in letters:
+                if rate:
+                    # * Paced by start time, so slow chunks don't accumulate extra delay
+                    time.sleep(max(0.0, started + (resolved + failed + len(results)) / rate - time.monotonic()))
+                results.append((letter, _submit(letter, processor)))
+            done, errors = [], []
+            for letter, result in results:
+                error = result.exception() if isinstance(result, Future) else result
+                if error is None:
+                    done.append(letter.pk)
+                else:
+                    errors.append((letter, error))
+            WebhookDeadLetter.objects.filter(pk__in=done).update(resolved_at=timezone.now(), modified=timezone.now())
+            for letter, error in errors:
+                letter.failures += 1
+                letter.error = str(error)
+                letter.error_code = getattr(error, "code", None) or ""
+            WebhookDeadLetter.objects.bulk_update([letter for letter, _ in errors], ["failures", "error", "error_code"])
+            resolved += len(done)
+            failed += len(errors)
+    finally:
+        if processor is not None:
+            processor.shutdown()
+
+
+def _submit(letter: WebhookDeadLetter, processor: Optional[ShardedProcessor]):
+    try:
+        event = parse_event(letter.payload)
+    except PaymentError as e:
+        return e
+    if event is None:
+        return None
+    if processor is None:
+        return apply_events([event])[0]
+    return processor.submit(event)
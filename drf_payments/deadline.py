@@ -0,0 +1,103 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Tuple, Union
+
+from django.conf import settings
+
+from drf_payments.constants import PaymentError
+
+#: Seconds, or ``(connect, read)`` seconds as accepted by ``requests``
+Timeout = Union[float, Tuple[float, float]]
+
+#: Monotonic time by which current request must finish its gateway calls
+_deadline: ContextVar[Optional[float]] = ContextVar("drf_payments_deadline", default=None)
+
+
+def default_timeout() -> Timeout:
+    """Timeout of gateway calls made without deadline, ``PAYMENT_HTTP_TIMEOUT``"""
+    return getattr(settings, "PAYMENT_HTTP_TIMEOUT", (5, 30))
+
+
+@contextmanager
+def within(seconds: float):
+    """within
+
+    Gateway calls made inside the block must finish in ``seconds``, nested block can only shorten the deadline
+
+    ```python
+    with deadline.within(2.5):
+        get_payment_service(payment.variant).refund(payment)
+    ```
+
+    Args:
+        seconds (float): Time budget of the block
+    """
+    at = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(current, at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left until deadline, ``None`` outside of ``within`` block"""
+    if (at := _deadline.get()) is None:
+        return None
+    return at - time.monotonic()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def check(error: Optional[Exception] = None):
+    """check
+
+    Raise ``PaymentError`` with ``deadline_exceeded`` code once deadline passed,
+    gateway error caught after the deadline is reported as exceeded deadline
+
+    Args:
+        error (Exception, optional): Gateway error being handled
+    """
+    if expired():
+        raise PaymentError("Deadline exceeded", code="deadline_exceeded") from error
+
+
+def timeout(requested: Optional[Timeout] = None) -> Timeout:
+    """timeout
+
+    Timeout of the next gateway call capped by time left until deadline
+
+    Args:
+        requested (float | tuple, optional): Timeout asked by caller, ``PAYMENT_HTTP_TIMEOUT`` by default
+
+    Raises:
+        PaymentError: Deadline passed, call is not made
+    """
+    check()
+    if requested is None:
+        requested = default_timeout()
+    if (left := remaining()) is None:
+        return requested
+    if isinstance(requested, (tuple, list)):
+        return tuple(min(value, left) for value in requested)
+    return min(requested, left)
+
+
+class PaymentDeadlineMiddleware:
+    """PaymentDeadlineMiddleware
+
+    Gives every request ``PAYMENT_REQUEST_DEADLINE`` seconds for its gateway calls,
+    calls are aborted early with ``deadline_exceeded`` error instead of holding the request
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with within(getattr(settings, "PAYMENT_REQUEST_DEADLINE", 10)):
+            return self.get_response(request)
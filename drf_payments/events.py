@@ -0,0 +1,510 @@
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from decimal import Decimal
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connections, router, transaction
+
+from drf_payments import get_payment_model, get_payment_service, jobs, references
+from drf_payments.constants import JobStatus, PaymentError, PaymentStatus
+from drf_payments.models import PaymentJob
+from drf_payments.references import CHARGE, INTENT, ORDER, SESSION, TRANSACTION
+from drf_payments.signals import status_changed
+from drf_payments.status import invalidate
+
+logger = logging.getLogger(__name__)
+
+#: Payment status only moves to higher rank (or stays), events requesting lower rank are stale
+STATUS_RANK = {
+    PaymentStatus.WAITING.name: 0,
+    PaymentStatus.INPUT.name: 0,
+    PaymentStatus.ERROR.name: 0,
+    PaymentStatus.EXPIRED.name: 0,
+    PaymentStatus.PREAUTH.name: 1,
+    PaymentStatus.CONFIRMED.name: 2,
+    PaymentStatus.REJECTED.name: 2,
+    PaymentStatus.REFUNDED.name: 3,
+}
+
+
+#: Payment status of Braintree transaction status, transactions in other statuses don't change payment
+BRAINTREE_STATUSES = {
+    "authorized": PaymentStatus.PREAUTH.name,
+    "submitted_for_settlement": PaymentStatus.CONFIRMED.name,
+    "settlement_pending": PaymentStatus.CONFIRMED.name,
+    "settling": PaymentStatus.CONFIRMED.name,
+    "settled": PaymentStatus.CONFIRMED.name,
+    "settlement_confirmed": PaymentStatus.CONFIRMED.name,
+    "voided": PaymentStatus.REJECTED.name,
+    "settlement_declined": PaymentStatus.REJECTED.name,
+    "processor_declined": PaymentStatus.REJECTED.name,
+    "gateway_rejected": PaymentStatus.REJECTED.name,
+    "failed": PaymentStatus.REJECTED.name,
+    "authorization_expired": PaymentStatus.EXPIRED.name,
+}
+
+
+class PaymentEvent(NamedTuple):
+    """Change of payment requested by gateway event"""
+
+    #: Payment field event references payment by, ``pk`` or ``transaction_id``
+    field: str
+    value: object
+    status: str
+    #: ``extra_data`` key event data is stored under
+    key: str
+    data: dict
+    #: Job scheduled for payment once event is applied, e.g. ``drf_payments.capture``
+    job: str = ""
+    #: Gateway identifiers in event ``(gateway, kind, reference)``, indexed ones resolve payment before ``field``
+    references: Tuple[Tuple[str, str, Optional[str]], ...] = ()
+
+
+def parse_event(event: dict, notification=None) -> Optional[PaymentEvent]:
+    """parse_event
+
+    Translate webhook payload to payment change, ``None`` for events not changing payment
+
+    Args:
+        event (dict): Webhook payload
+        notification (WebhookNotification, optional): Braintree notification parsed by callback view
+
+    Raises:
+        PaymentError: Braintree notification can't be parsed or its transaction found
+    """
+    # * Stripe checkout session hook
+    if event.get("type") == "checkout.session.completed":
+        data = event["data"]["object"]
+        if data["payment_status"] == "paid":
+            return PaymentEvent(
+                "pk",
+                data.get("client_reference_id"),
+                PaymentStatus.CONFIRMED.name,
+                "session",
+                data,
+                references=(("stripe", SESSION, data.get("id")), ("stripe", INTENT, data.get("payment_intent"))),
+            )
+    # * Stripe payment hook
+    elif event.get("type") == "payment_intent.succeeded":
+        data = event["data"]["object"]
+        if data["status"] == "succeeded":
+            order_no = data.get("metadata", {}).get("order_no", None)
+            return PaymentEvent(
+                "pk",
+                order_no,
+                PaymentStatus.CONFIRMED.name,
+                "payment_intend",
+                data,
+                references=_intent_references(data),
+            )
+    # * Stripe payment authorized with manual capture method
+    elif event.get("type") == "payment_intent.amount_capturable_updated":
+        data = event["data"]["object"]
+        if data["status"] == "requires_capture":
+            order_no = data.get("metadata", {}).get("order_no", None)
+            return PaymentEvent(
+                "pk",
+                order_no,
+                PaymentStatus.PREAUTH.name,
+                "payment_intend",
+                data,
+                references=_intent_references(data),
+            )
+    # * Paypal hook, upon checkout approval we change status and schedule capture (or authorization)
+    elif event.get("event_type") == "CHECKOUT.ORDER.APPROVED":
+        data = event.get("resource", {})
+        if data.get("status") == "APPROVED":
+            if get_payment_service("paypal")._capture:
+                status, job = PaymentStatus.CONFIRMED.name, "drf_payments.capture"
+            else:
+                # * Payment becomes PREAUTH once authorization job succeeds
+                status, job = PaymentStatus.WAITING.name, "drf_payments.authorize"
+            return PaymentEvent(
+                "transaction_id",
+                data.get("id"),
+                status,
+                "order",
+                data,
+                job=job,
+                references=(("paypal", ORDER, data.get("id")),),
+            )
+    # * Braintree webhook
+    elif "bt_signature" in event:
+        bt = get_payment_service("braintree")
+        if notification is None:
+            try:
+                notification = bt.service.webhook_notification.parse(event["bt_signature"], event["bt_payload"])
+            except Exception as e:
+                raise PaymentError(f"Can't parse event {e}", code="invalid_event") from e
+        transaction_id = notification.transaction.id
+        try:
+            data = bt._serialize(bt.service.transaction.find(transaction_id).__dict__)
+        except Exception as e:
+            raise PaymentError(f"Can't find payment {transaction_id}", code="not_found") from e
+        return PaymentEvent(
+            "transaction_id",
+            transaction_id,
+            PaymentStatus.CONFIRMED.name,
+            "transaction",
+            data,
+            references=(("braintree", TRANSACTION, transaction_id),),
+        )
+    # * Braintree transaction fetched by catch-up ingestion
+    elif "bt_transaction" in event:
+        data = event["bt_transaction"]
+        if (status := BRAINTREE_STATUSES.get(data.get("status"))) is None:
+            return None
+        return PaymentEvent(
+            "transaction_id",
+            data.get("id"),
+            status,
+            "transaction",
+            data,
+            references=(("braintree", TRANSACTION, data.get("id")),),
+        )
+    return None
+
+
+def _intent_references(data: dict) -> Tuple[Tuple[str, str, Optional[str]], ...]:
+    # * Intents created by checkout carry no ``order_no``, they are known from session event
+    return (("stripe", INTENT, data.get("id")), ("stripe", CHARGE, data.get("latest_charge")))
+
+
+def is_stale(current: str, status: str) -> bool:
+    """Transition from ``current`` to ``status`` would move payment back, e.g. approval arriving after refund"""
+    if current == status:
+        return False
+    return STATUS_RANK.get(status, 0) <= STATUS_RANK.get(current, 0)
+
+
+#: Gateway references shared by every event of one payment, checkout intent events have no ``order_no``
+SHARD_REFERENCES = (INTENT, ORDER, TRANSACTION)
+
+
+def is_duplicate(current: str, status: str) -> bool:
+    """Event keeps payment in its status, e.g. redelivered approval, its data and jobs were applied by the first one.
+    Payment stays ``WAITING`` until PayPal authorization job succeeds, events of initial statuses are applied"""
+    return current == status and STATUS_RANK.get(status, 0) > 0
+
+
+def shard_key(event: PaymentEvent) -> str:
+    """Events of one payment must share key to be applied in order by one shard worker"""
+    for kind in SHARD_REFERENCES:
+        for provider, reference_kind, value in event.references:
+            if reference_kind == kind and value:
+                return f"{provider}:{kind}:{value}"
+    return f"{event.field}:{event.value}"
+
+
+def apply_events(events: Sequence[PaymentEvent]) -> List[Optional[Exception]]:
+    """apply_events
+
+    Apply events of many payments with one ``SELECT`` of indexed gateway identifiers (``PaymentReference``),
+    one ``SELECT`` per reference field and one ``bulk_update``,
+    events of the same payment are merged in order. Stale and duplicate events (see ``is_stale``
+    and ``is_duplicate``) are skipped without error,
+    so gateway doesn't redeliver them. ``status_changed`` is sent for changed payments
+    and cached status projections are invalidated.
+
+    Args:
+        events (list): Payment events
+
+    Returns:
+        list: Error of every event, ``None`` when it was applied
+    """
+    model = get_payment_model()
+    errors: List[Optional[Exception]] = [None] * len(events)
+    with transaction.atomic(using=router.db_for_write(model)):
+        # * Indexed gateway identifiers resolve payment without JSON traversal, reference field is the fallback
+        # * for identifiers seen for the first time
+        resolved = references.resolve(
+            (gateway, reference) for event in events for gateway, _, reference in event.references
+        )
+        lookups, values = [], {}
+        for index, event in enumerate(events):
+            pk = next((resolved[(g, str(r))] for g, _, r in event.references if (g, str(r)) in resolved), None)
+            field, value = ("pk", pk) if pk is not None else (event.field, event.value)
+            try:
+                # * Malformed identifier fails its own event, not the query of the whole batch
+                value = (model._meta.pk if field == "pk" else model._meta.get_field(field)).to_python(value)
+            except (TypeError, ValueError, ValidationError):
+                errors[index] = PaymentError(f"Payment with id {event.value} not found", code="not_found")
+                lookups.append(None)
+                continue
+            lookups.append((field, str(value)))
+            values.setdefault(field, set()).add(value)
+        payments, by_lookup = {}, {}
+        for field, field_values in values.items():
+            for payment in model.objects.select_for_update().filter(**{f"{field}__in": field_values}):
+                payment = payments.setdefault(payment.pk, payment)
+                by_lookup[(field, str(getattr(payment, field)))] = payment
+        previous = {pk: payment.status for pk, payment in payments.items()}
+        changed, applied, found = {}, set(), []
+        for index, event in enumerate(events):
+            if lookups[index] is None:
+                continue
+            payment = by_lookup.get(lookups[index])
+            if payment is None:
+                errors[index] = PaymentError(f"Payment with id {event.value} not found", code="not_found")
+                continue
+            found.extend((payment.pk, gateway, kind, reference) for gateway, kind, reference in event.references)
+            if is_stale(payment.status, event.status):
+                logger.info(
+                    "Skipped stale %s event of payment %s in %s status",
+                    event.status,
+                    payment.pk,
+                    payment.status,
+                )
+                continue
+            if is_duplicate(payment.status, event.status):
+                # * Redelivered approval must not schedule capture again nor overwrite captured order,
+                # * data of other events of the payment (e.g. intent after checkout session) is still merged
+                if event.key not in payment.extra_data:
+                    payment.extra_data[event.key] = event.data
+                    changed[payment.pk] = payment
+                logger.info("Skipped duplicate %s event of payment %s", event.status, payment.pk)
+                continue
+            applied.add(index)
+            payment.status = event.status
+            payment.extra_data[event.key] = event.data
+            changed[payment.pk] = payment
+        if changed:
+            model.objects.bulk_update(changed.values(), ["status", "extra_data"])
+            invalidate(pks=changed.keys(), tokens=[payment.token for payment in changed.values()])
+        references.save(found)
+        # * Gateway calls are scheduled in the same transaction and retried by job workers,
+        # * webhook is acknowledged at once
+        scheduled = {}
+        for index in applied:
+            if events[index].job:
+                scheduled.setdefault(events[index].job, set()).add(by_lookup[lookups[index]])
+        for name, scheduled_payments in scheduled.items():
+            schedule_jobs(name, scheduled_payments)
+    for payment in changed.values():
+        if previous[payment.pk] != payment.status:
+            payment._loaded_status = payment.status
+            status_changed.send(sender=model, payment=payment, previous=previous[payment.pk])
+    return errors
+
+
+def schedule_jobs(name: str, payments):
+    """schedule_jobs
+
+    Enqueue job of every payment without pending one of the same name, job survives restarts and failed attempts
+    are retried with exponential backoff and jitter (``PAYMENT_JOB_RETRY_DELAY``)
+
+    Args:
+        name (str): Job name, ``drf_payments.capture`` or ``drf_payments.authorize``
+        payments (list): Payments
+    """
+    payments = {str(payment.pk): payment for payment in payments}
+    if not payments:
+        return
+    pending = set(
+        PaymentJob.objects.filter(
+            name=name,
+            payment_id__in=payments,
+            status__in=[JobStatus.PENDING.name, JobStatus.RUNNING.name],
+        ).values_list("payment_id", flat=True),
+    )
+    for pk, payment in payments.items():
+        if pk not in pending:
+            jobs.enqueue(name, payment=payment, max_attempts=getattr(settings, "PAYMENT_CAPTURE_MAX_ATTEMPTS", 10))
+
+
+@jobs.register("drf_payments.capture")
+def capture_job(job):
+    """capture_job
+
+    Capture payment, optionally ``amount`` of payload. Gateway deduplicates retried capture by idempotency key.
+    Payment approved as ``CONFIRMED`` becomes ``ERROR`` once the last attempt fails, so it isn't treated as paid
+    """
+    payment = get_payment_model().objects.get(pk=job.payment_id)
+    amount = job.payload.get("amount")
+    try:
+        get_payment_service(payment.variant).capture(payment, Decimal(amount) if amount is not None else None)
+    except Exception as e:
+        if job.attempts >= job.max_attempts:
+            payment.status = PaymentStatus.ERROR.name
+            payment.message = f"Capture failed: {e}"
+            payment.save(update_fields=["status", "message"])
+        raise
+
+
+@jobs.register("drf_payments.authorize")
+def authorize_job(job):
+    """Authorize approved PayPal order of provider configured with ``capture=False``"""
+    payment = get_payment_model().objects.get(pk=job.payment_id)
+    get_payment_service(payment.variant).authorize(payment)
+
+
+def _apply_batch(apply: Callable, batch: List[Tuple[PaymentEvent, Future]]):
+    try:
+        errors = apply([event for event, _ in batch])
+    except Exception as e:
+        errors = [e] * len(batch)
+    for (_, future), error in zip(batch, errors):
+        if error is None:
+            future.set_result(None)
+        else:
+            future.set_exception(error)
+
+
+class Coalescer:
+    """Coalescer
+
+    Group commit of webhook events. The first event submitted becomes leader, waits ``window`` seconds
+    for events arriving meanwhile (Stripe sends up to 4 events of a payment within milliseconds)
+    and applies all of them with a single ``apply`` call, submitters wait for result of their event.
+
+    Args:
+        apply (callable, optional): Applies list of events, returns error of every event. Defaults to apply_events.
+        window (float, optional): Seconds to collect events, ``PAYMENT_WEBHOOK_COALESCE_WINDOW`` (``0``) by default
+    """
+
+    def __init__(self, apply: Callable = apply_events, window: Optional[float] = None):
+        self.apply = apply
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[PaymentEvent, Future]] = []
+        self._leading = False
+
+    def get_window(self) -> float:
+        if self.window is not None:
+            return self.window
+        # * Opt-in, sync single-threaded worker would only sleep without anything to coalesce
+        return getattr(settings, "PAYMENT_WEBHOOK_COALESCE_WINDOW", 0)
+
+    def submit(self, event: PaymentEvent) -> Future:
+        """Apply event together with events submitted in the same window, returns resolved future"""
+        future = Future()
+        window = self.get_window()
+        if window <= 0:
+            self.flush([(event, future)])
+            return future
+        with self._lock:
+            self._pending.append((event, future))
+            leader = not self._leading
+            self._leading = True
+        if leader:
+            time.sleep(window)
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._leading = False
+            self.flush(batch)
+        future.exception()
+        return future
+
+    def flush(self, batch: List[Tuple[PaymentEvent, Future]]):
+        _apply_batch(self.apply, batch)
+
+
+class ShardedProcessor:
+    """ShardedProcessor
+
+    Apply events in parallel across ``shards`` worker threads, events are routed by CRC32 of payment reference,
+    so events of one payment are applied in order of submission by the same worker while different payments
+    proceed in parallel. Worker applies everything queued on its shard at once (up to ``batch_size`` events).
+    Workers are started lazily and restarted after fork.
+
+    Args:
+        shards (int, optional): Number of workers, ``PAYMENT_WEBHOOK_SHARDS`` by default
+        apply (callable, optional): Applies list of events, returns error of every event. Defaults to apply_events.
+        batch_size (int, optional): Maximum events applied at once. Defaults to 100.
+    """
+
+    def __init__(self, shards: Optional[int] = None, apply: Callable = apply_events, batch_size: int = 100):
+        self.shards = shards or getattr(settings, "PAYMENT_WEBHOOK_SHARDS", 0) or 8
+        self.apply = apply
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._queues: List[queue.SimpleQueue] = []
+        self._pid = None
+
+    def shard(self, event: PaymentEvent) -> int:
+        return zlib.crc32(shard_key(event).encode("utf-8")) % self.shards
+
+    def get_queues(self) -> List[queue.SimpleQueue]:
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queues = [queue.SimpleQueue() for _ in range(self.shards)]
+                for index, shard in enumerate(self._queues):
+                    threading.Thread(
+                        target=self.run,
+                        args=(shard,),
+                        name=f"drf_payments_shard_{index}",
+                        daemon=True,
+                    ).start()
+                self._pid = os.getpid()
+        return self._queues
+
+    def submit(self, event: PaymentEvent) -> Future:
+        """Queue event on its shard, returns future resolved once event is applied"""
+        future = Future()
+        self.get_queues()[self.shard(event)].put((event, future))
+        return future
+
+    def run(self, shard: queue.SimpleQueue):
+        while True:
+            item = shard.get()
+            if item is None:
+                return
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = shard.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    shard.put(None)
+                    break
+                batch.append(item)
+            try:
+                _apply_batch(self.apply, batch)
+            finally:
+                connections.close_all()
+
+    def shutdown(self):
+        """Stop workers once queued events are applied"""
+        with self._lock:
+            queues, self._queues, self._pid = self._queues, [], None
+        for shard in queues:
+            shard.put(None)
+
+
+_coalescer = Coalescer()
+_processor = None
+
+
+def get_processor():
+    """Process-wide processor of webhook events, ``ShardedProcessor`` when ``PAYMENT_WEBHOOK_SHARDS`` is set"""
+    global _processor
+    if getattr(settings, "PAYMENT_WEBHOOK_SHARDS", 0):
+        if _processor is None:
+            _processor = ShardedProcessor()
+        return _processor
+    return _coalescer
+
+
+def submit(event: PaymentEvent):
+    """submit
+
+    Apply event with process-wide processor and wait for it, raises error of the event.
+    Events submitted inside transaction are applied inline, other connection can't see or commit its changes.
+
+    Args:
+        event (PaymentEvent): Payment event
+    """
+    if connections[router.db_for_write(get_payment_model())].in_atomic_block:
+        error = apply_events([event])[0]
+    else:
+        error = get_processor().submit(event).exception()
+    if error is not None:
+        raise error
@@ -0,0 +1,104 @@
+import logging
+import time
+from datetime import timedelta
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from drf_payments import get_payment_model, get_payment_service, jobs
+from drf_payments.constants import PaymentStatus
+from drf_payments.notifications import notify
+from drf_payments.status import invalidate
+from drf_payments.utils import map_concurrently
+
+logger = logging.getLogger(__name__)
+
+
+def _expire_at_gateway(ids: List, concurrency: int) -> List:
+    """Expire payments on gateway side, returns ids of payments gateway agreed to expire"""
+    payments = get_payment_model().objects.filter(pk__in=ids).only("pk", "variant", "transaction_id", "status")
+    services = {}
+
+    def expire(payment):
+        if payment.variant not in services:
+            services[payment.variant] = get_payment_service(payment.variant)
+        services[payment.variant].expire(payment)
+
+    expired = []
+    for payment, _, error in map_concurrently(expire, payments, concurrency):
+        if error is None:
+            expired.append(payment.pk)
+        else:
+            # * Usually session was completed meanwhile, webhook will confirm payment
+            logger.warning("Can't expire payment %s on gateway: %s", payment.pk, error)
+    return expired
+
+
+def expire_payments(
+    older_than: Optional[timedelta] = None,
+    chunk_size: int = 1000,
+    variants: Optional[Iterable[str]] = None,
+    gateway: bool = False,
+    concurrency: int = 4,
+    pause: float = 0,
+) -> int:
+    """expire_payments
+
+    Move ``WAITING`` payments created before cutoff to ``EXPIRED``.
+    Table is walked in primary key order, every chunk is a single short ``UPDATE`` in its own transaction
+    so rows are never locked for long and the job can run continuously on large tables.
+
+    Args:
+        older_than (timedelta, optional): Payment age to expire, ``PAYMENT_EXPIRE_AFTER`` seconds by default
+        chunk_size (int, optional): Rows per ``UPDATE``. Defaults to 1000.
+        variants (list, optional): Expire only payments of these variants
+        gateway (bool, optional): Expire checkout on gateway side first. Defaults to False.
+        concurrency (int, optional): Simultaneous gateway calls. Defaults to 4.
+        pause (float, optional): Sleep between chunks in seconds to spare replicas. Defaults to 0.
+
+    Returns:
+        int: Number of expired payments
+    """
+    if older_than is None:
+        older_than = timedelta(seconds=getattr(settings, "PAYMENT_EXPIRE_AFTER", 24 * 60 * 60))
+    model = get_payment_model()
+    cutoff = timezone.now() - older_than
+    queryset = model.objects.filter(status=PaymentStatus.WAITING.name, created__lt=cutoff)
+    if variants:
+        queryset = queryset.filter(variant__in=list(variants))
+    total = 0
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        ids = list(chunk.order_by("pk").values_list("pk", flat=True)[:chunk_size])
+        if not ids:
+            break
+        last_pk = ids[-1]
+        if gateway:
+            ids = _expire_at_gateway(ids, concurrency)
+        # * Status is checked again, payment confirmed since selection must stay confirmed
+        with transaction.atomic():
+            total += model.objects.filter(pk__in=ids, status=PaymentStatus.WAITING.name).update(
+                status=PaymentStatus.EXPIRED.name,
+                modified=timezone.now(),
+            )
+            # * Bulk update does not send ``status_changed`` nor ``post_save``
+            expired = list(
+                model.objects.filter(pk__in=ids, status=PaymentStatus.EXPIRED.name).values_list("pk", "token"),
+            )
+            invalidate(pks=[pk for pk, _ in expired], tokens=[token for _, token in expired])
+            notify([token for _, token in expired])
+        if pause:
+            time.sleep(pause)
+    return total
+
+
+@jobs.register("drf_payments.expire")
+def expire_payments_job(job):
+    """Job handler running ``expire_payments`` with keyword arguments from job payload"""
+    payload = dict(job.payload)
+    if "older_than" in payload:
+        payload["older_than"] = timedelta(seconds=payload["older_than"])
+    expire_payments(**payload)
@@ -0,0 +1,235 @@
+import json
+import zlib
+from collections import Counter
+from functools import lru_cache
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models, router, transaction
+from django.db.models import ExpressionWrapper, F
+
+from drf_payments.codec import PaymentJSONEncoder, loads
+
+try:
+    import zstandard
+except ImportError:  # pragma no cover
+    zstandard = None
+
+#: First byte of stored value, plain JSON (not recompressed yet) starts with ``{`` or ``[``
+ZLIB = 1
+ZSTD = 2
+CODECS = {"zlib": ZLIB, "zstd": ZSTD}
+
+
+@lru_cache(maxsize=None)
+def _dictionary(dictionary_id: int) -> bytes:
+    path = getattr(settings, "PAYMENT_COMPRESSION_DICTIONARIES", {}).get(dictionary_id)
+    if path is None:
+        raise ImproperlyConfigured(f"Compression dictionary {dictionary_id} is not configured")
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImproperlyConfigured("zstd compression requires zstandard to be installed")
+
+
+def compress(data: bytes, codec: str = "zlib", dictionary_id: int = 0, level: Optional[int] = None) -> bytes:
+    """compress
+
+    Compress serialized JSON, result is prefixed with codec and dictionary id so it's readable
+    after defaults change
+
+    Args:
+        data (bytes): Serialized JSON
+        codec (str, optional): ``zlib`` or ``zstd``. Defaults to "zlib".
+        dictionary_id (int, optional): Id in ``PAYMENT_COMPRESSION_DICTIONARIES``, ``0`` for none. Defaults to 0.
+        level (int, optional): Compression level, codec default when not given
+    """
+    dictionary = _dictionary(dictionary_id) if dictionary_id else None
+    if codec == "zstd":
+        _require_zstandard()
+        compressor = zstandard.ZstdCompressor(
+            level=3 if level is None else level,
+            dict_data=zstandard.ZstdCompressionDict(dictionary) if dictionary else None,
+        )
+        body = compressor.compress(data)
+    elif codec == "zlib":
+        level = -1 if level is None else level
+        compressor = zlib.compressobj(level, zdict=dictionary) if dictionary else zlib.compressobj(level)
+        body = compressor.compress(data) + compressor.flush()
+    else:
+        raise ImproperlyConfigured(f"Unknown compression codec {codec}")
+    return bytes([CODECS[codec], dictionary_id]) + body
+
+
+def decompress(value: bytes) -> bytes:
+    """Serialized JSON of stored value, plain JSON stored before compression is returned as is"""
+    codec, dictionary_id = value[0], value[1] if len(value) > 1 else 0
+    if codec == ZLIB:
+        if not dictionary_id:
+            return zlib.decompress(value[2:])
+        decompressor = zlib.decompressobj(zdict=_dictionary(dictionary_id))
+        return decompressor.decompress(value[2:]) + decompressor.flush()
+    if codec == ZSTD:
+        _require_zstandard()
+        dictionary = zstandard.ZstdCompressionDict(_dictionary(dictionary_id)) if dictionary_id else None
+        return zstandard.ZstdDecompressor(dict_data=dictionary).decompress(value[2:])
+    return value
+
+
+def is_compressed(value: bytes, codec: Optional[str] = None, dictionary_id: Optional[int] = None) -> bool:
+    """Value is compressed (with given codec and dictionary when set)"""
+    if not value or value[0] not in CODECS.values():
+        return False
+    if codec is not None and value[0] != CODECS[codec]:
+        return False
+    return dictionary_id is None or value[1] == dictionary_id
+
+
+def train_dictionary(samples: Iterable[bytes], size: int = 16 * 1024) -> bytes:
+    """train_dictionary
+
+    Build dictionary from typical serialized payloads. ``zstandard`` trainer is used when installed,
+    otherwise the most frequent JSON tokens are concatenated, which works as zlib preset dictionary.
+
+    Args:
+        samples (list): Serialized JSON payloads
+        size (int, optional): Dictionary size in bytes. Defaults to 16 KiB.
+    """
+    samples = list(samples)
+    if zstandard is not None:
+        return zstandard.train_dictionary(size, samples).as_bytes()
+    counter = Counter()
+    for sample in samples:
+        for token in sample.replace(b"{", b",").replace(b"}", b",").split(b","):
+            if token.strip():
+                counter[token.strip()] += 1
+    dictionary = b""
+    # * zlib prefers matches close to the data, most frequent tokens go to the end
+    for token, _ in counter.most_common():
+        if len(dictionary) + len(token) + 1 > size:
+            break
+        dictionary = token + b"," + dictionary
+    return dictionary
+
+
+class CompressedJSONField(models.BinaryField):
+    """CompressedJSONField
+
+    JSON stored compressed (zlib or zstd, optionally with trained dictionary), decoded transparently.
+    Database can't look into the value, JSON lookups are not supported.
+
+    ```python
+    class Payment(BasePayment):
+        extra_data = CompressedJSONField(default=dict)
+    ```
+
+    Args:
+        codec (str, optional): ``zlib`` or ``zstd``, ``PAYMENT_COMPRESSION`` by default
+        dictionary_id (int, optional): Dictionary used for new values, ``PAYMENT_COMPRESSION_DICTIONARY`` by default
+        encoder (JSONEncoder, optional): Encoder of values. Defaults to PaymentJSONEncoder.
+    """
+
+    def __init__(self, *args, codec=None, dictionary_id=None, encoder=PaymentJSONEncoder, **kwargs):
+        self.codec = codec
+        self.dictionary_id = dictionary_id
+        self.encoder = encoder
+        kwargs.setdefault("editable", True)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.codec is not None:
+            kwargs["codec"] = self.codec
+        if self.dictionary_id is not None:
+            kwargs["dictionary_id"] = self.dictionary_id
+        if self.encoder is not PaymentJSONEncoder:
+            kwargs["encoder"] = self.encoder
+        if kwargs.get("editable") is True:
+            del kwargs["editable"]
+        return name, path, args, kwargs
+
+    def get_codec(self) -> str:
+        return self.codec or getattr(settings, "PAYMENT_COMPRESSION", "zlib")
+
+    def get_dictionary_id(self) -> int:
+        if self.dictionary_id is not None:
+            return self.dictionary_id
+        return getattr(settings, "PAYMENT_COMPRESSION_DICTIONARY", 0)
+
+    def encode(self, value) -> bytes:
+        data = json.dumps(value, cls=self.encoder, separators=(",", ":")).encode("utf-8")
+        return compress(data, self.get_codec(), self.get_dictionary_id())
+
+    def decode(self, value):
+        # * Column converted from text type may still be returned as string
+        return loads(decompress(value.encode("utf-8") if isinstance(value, str) else bytes(value)))
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return self.decode(value)
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, memoryview)):
+            return self.decode(value)
+        if isinstance(value, str):
+            return json.loads(value)
+        return value
+
+    def get_prep_value(self, value):
+        if value is None:
+            return value
+        return self.encode(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        return connection.Database.Binary(value) if value is not None else None
+
+    def value_to_string(self, obj):
+        return json.dumps(self.value_from_object(obj), cls=self.encoder)
+
+    def formfield(self, **kwargs):
+        return models.JSONField(encoder=self.encoder).formfield(**kwargs)
+
+
+def recompress(model, field_name: str = "extra_data", chunk_size: int = 500) -> int:
+    """recompress
+
+    Rewrite values not stored with current codec and dictionary of the field (plain JSON included),
+    rows are walked in primary key order and updated in chunks
+
+    Args:
+        model (Model): Model with ``CompressedJSONField``
+        field_name (str, optional): Field to recompress. Defaults to "extra_data".
+        chunk_size (int, optional): Rows per update. Defaults to 500.
+
+    Returns:
+        int: Number of rewritten rows
+    """
+    field = model._meta.get_field(field_name)
+    codec, dictionary_id = field.get_codec(), field.get_dictionary_id()
+    # * Raw stored bytes, field converters are bypassed
+    queryset = model._base_manager.annotate(
+        raw=ExpressionWrapper(F(field_name), output_field=models.BinaryField()),
+    ).order_by("pk")
+    total = 0
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        rows = list(chunk.values_list("pk", "raw")[:chunk_size])
+        if not rows:
+            return total
+        last_pk = rows[-1][0]
+        instances = []
+        for pk, raw in rows:
+            raw = raw.encode("utf-8") if isinstance(raw, str) else raw
+            if raw is not None and not is_compressed(bytes(raw), codec, dictionary_id):
+                instances.append(model(pk=pk, **{field_name: field.decode(raw)}))
+        with transaction.atomic(using=router.db_for_write(model)):
+            model._base_manager.bulk_update(instances, [field_name])
+        total += len(instances)
@@ -0,0 +1,102 @@
+import os
+import threading
+from typing import Dict
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from drf_payments import deadline
+from drf_payments.idempotency import max_network_retries
+
+_SESSIONS: Dict[str, requests.Session] = {}
+_lock = threading.Lock()
+_pid = os.getpid()
+
+
+class DeadlineRetry(Retry):
+    """Retry policy giving up once the next attempt can't start before deadline"""
+
+    def is_exhausted(self) -> bool:
+        left = deadline.remaining()
+        if left is not None and left <= self.get_backoff_time():
+            return True
+        return super().is_exhausted()
+
+
+class DeadlineSession(requests.Session):
+    """DeadlineSession
+
+    Session capping timeout of every request by time left until deadline (see ``drf_payments.deadline``),
+    requests without timeout get ``PAYMENT_HTTP_TIMEOUT``. Failure after deadline passed is raised
+    as ``PaymentError`` with ``deadline_exceeded`` code.
+    """
+
+    def request(self, method, url, *args, **kwargs):
+        kwargs["timeout"] = deadline.timeout(kwargs.get("timeout"))
+        try:
+            return super().request(method, url, *args, **kwargs)
+        except requests.RequestException as e:
+            deadline.check(e)
+            raise
+
+
+def _build_session(retry_post: bool) -> requests.Session:
+    size = getattr(settings, "PAYMENT_HTTP_POOL_SIZE", 10)
+    # * Connection errors are always retried, request did not reach gateway.
+    # * Read errors and 5xx are retried for every method only where requests carry idempotency keys
+    retries = DeadlineRetry(
+        total=max_network_retries(),
+        backoff_factor=0.5,
+        status_forcelist=(500, 502, 503, 504) if retry_post else (),
+        allowed_methods=None if retry_post else Retry.DEFAULT_ALLOWED_METHODS,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=size, pool_maxsize=size, max_retries=retries)
+    session = DeadlineSession()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(name: str = "default", retry_post: bool = False) -> requests.Session:
+    """get_session
+
+    Shared ``requests.Session`` keeping keep-alive connections to gateways between payments
+
+    Args:
+        name (str, optional): Pool name, providers use their own pools. Defaults to "default".
+        retry_post (bool, optional): Retry non idempotent methods, only for gateways deduplicating requests
+            by idempotency key. Applied when pool is created. Defaults to False.
+    """
+    if _pid != os.getpid():
+        _forget()
+    session = _SESSIONS.get(name)
+    if session is None:
+        with _lock:
+            session = _SESSIONS.get(name)
+            if session is None:
+                session = _SESSIONS[name] = _build_session(retry_post)
+    return session
+
+
+def reset():
+    """Close pooled connections, next ``get_session`` call opens new ones"""
+    with _lock:
+        sessions = list(_SESSIONS.values())
+        _SESSIONS.clear()
+    for session in sessions:
+        session.close()
+
+
+def _forget():
+    """Drop sessions inherited from parent process without closing sockets parent still uses"""
+    global _lock, _pid
+    _SESSIONS.clear()
+    _lock = threading.Lock()
+    _pid = os.getpid()
+
+
+if hasattr(os, "register_at_fork"):  # pragma no branch
+    os.register_at_fork(after_in_child=_forget)
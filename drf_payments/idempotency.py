@@ -0,0 +1,151 @@
+import hashlib
+import json
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.response import Response
+
+#: Namespace of deterministic gateway idempotency keys
+IDEMPOTENCY_NAMESPACE = uuid.UUID("5f8c2f4e-7f0b-4a53-9d6b-2b8d0f4c6a11")
+
+
+def max_network_retries() -> int:
+    """Retries of failed gateway calls, safe because mutations carry idempotency keys"""
+    return getattr(settings, "PAYMENT_MAX_NETWORK_RETRIES", 2)
+
+
+def idempotency_key(payment, operation: str) -> str:
+    """idempotency_key
+
+    Deterministic idempotency key of gateway mutation derived from payment pk, operation and attempt.
+    Same key is returned until attempt is rotated, key is recorded in ``payment.extra_data["idempotency"]``
+    and persisted with the next save of ``extra_data``.
+
+    Args:
+        payment (payment): Your payment instance
+        operation (str): Gateway operation, e.g. ``process_payment``, ``refund``, ``capture``
+    """
+    record = payment.extra_data.setdefault("idempotency", {}).setdefault(operation, {"attempt": 0})
+    key = str(
+        uuid.uuid5(IDEMPOTENCY_NAMESPACE, f"{payment._meta.label_lower}:{payment.pk}:{operation}:{record['attempt']}"),
+    )
+    record["key"] = key
+    return key
+
+
+def rotate_idempotency_key(payment, operation: str):
+    """rotate_idempotency_key
+
+    Start new attempt of operation after gateway definitively rejected previous one,
+    otherwise gateway would replay the rejection for every following attempt.
+
+    Args:
+        payment (payment): Your payment instance
+        operation (str): Gateway operation
+    """
+    record = payment.extra_data.setdefault("idempotency", {}).setdefault(operation, {"attempt": 0})
+    record["attempt"] += 1
+    record.pop("key", None)
+    if payment.pk:
+        payment.save(update_fields=["extra_data"])
+
+
+def is_rejection(status) -> bool:
+    """is_rejection
+
+    Gateway answered with definite rejection of the request, so idempotency key can be rotated.
+    Server errors, conflicts and rate limits are ambiguous, operation may still be applied with the same key.
+
+    Args:
+        status (int): HTTP status of gateway response, ``None`` when no response was received
+    """
+    return status is not None and 400 <= status < 500 and status not in (409, 429)
+
+
+def request_fingerprint(request) -> str:
+    """Hash of request method, path and body identifying request repeated with the same key"""
+    data = dict(request.data.lists()) if hasattr(request.data, "lists") else request.data
+    body = json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(f"{request.method}:{request.path}:{body}".encode("utf-8")).hexdigest()
+
+
+def _scope(request) -> str:
+    user = getattr(request, "user", None)
+    owner = user.pk if user is not None and user.is_authenticated else "anonymous"
+    return f"{owner}:{request.path}"[:255]
+
+
+def idempotent_response(request, key: str, handler):
+    """idempotent_response
+
+    Run ``handler`` once per client supplied idempotency key.
+    Repeated request gets stored response, concurrent duplicate gets ``409`` while original is processed
+    and key reused with different body gets ``422``, key longer than 255 characters gets ``400``.
+    Server errors are not stored so client may retry.
+
+    Args:
+        request (Request): DRF request
+        key (str): Value of ``Idempotency-Key`` header
+        handler (callable): Produces response of the original request
+    """
+    # * Imported here, providers import this module before models are ready
+    from drf_payments.models import IdempotencyRecord
+
+    if len(key) > IdempotencyRecord._meta.get_field("key").max_length:
+        return Response({"error": "Idempotency-Key is too long"}, status=400)
+    now = timezone.now()
+    scope = _scope(request)
+    fingerprint = request_fingerprint(request)
+    locked_until = now + timedelta(seconds=getattr(settings, "PAYMENT_IDEMPOTENCY_LOCK", 30))
+    expired = now - timedelta(seconds=getattr(settings, "PAYMENT_IDEMPOTENCY_TTL", 24 * 60 * 60))
+    IdempotencyRecord.objects.filter(scope=scope, key=key, created__lt=expired).delete()
+    try:
+        with transaction.atomic():
+            record = IdempotencyRecord.objects.create(
+                scope=scope,
+                key=key,
+                request_hash=fingerprint,
+                locked_until=locked_until,
+            )
+    except IntegrityError:
+        record = IdempotencyRecord.objects.get(scope=scope, key=key)
+        if record.request_hash != fingerprint:
+            return Response({"error": "Idempotency-Key was used with different request"}, status=422)
+        if record.response_status is not None:
+            return Response(
+                record.response_body,
+                status=record.response_status,
+                headers={"Idempotent-Replayed": "true"},
+            )
+        # * Lock of crashed request expires, the first retry takes the key over
+        if record.locked_until > now or not IdempotencyRecord.objects.filter(
+            pk=record.pk,
+            response_status__isnull=True,
+            locked_until=record.locked_until,
+        ).update(locked_until=locked_until):
+            return Response({"error": "Request with this Idempotency-Key is in progress"}, status=409)
+    try:
+        response = handler()
+    except Exception:
+        record.delete()
+        raise
+    if response.status_code >= 500:
+        record.delete()
+    else:
+        record.response_status = response.status_code
+        record.response_body = response.data
+        record.save(update_fields=["response_status", "response_body"])
+    return response
+
+
+def purge_idempotency_records() -> int:
+    """Delete stored responses older than ``PAYMENT_IDEMPOTENCY_TTL``, returns number of deleted records"""
+    from drf_payments.models import IdempotencyRecord
+
+    expired = timezone.now() - timedelta(seconds=getattr(settings, "PAYMENT_IDEMPOTENCY_TTL", 24 * 60 * 60))
+    deleted, _ = IdempotencyRecord.objects.filter(created__lt=expired).delete()
+    return deleted
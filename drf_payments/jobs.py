@@ -0,0 +1,242 @@
+import logging
+import os
+import random
+import socket
+import threading
+import uuid
+from datetime import timedelta
+from typing import Callable, Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from drf_payments.constants import JobStatus
+from drf_payments.models import PaymentJob
+from drf_payments.utils import map_concurrently
+
+logger = logging.getLogger(__name__)
+
+JOB_HANDLERS: Dict[str, Callable] = {}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def register(name: str):
+    """register
+
+    Decorator registering a job handler under ``name``.
+    Handler receives claimed ``PaymentJob`` instance, raising any exception marks attempt as failed.
+
+    Args:
+        name (str): Job name used in ``enqueue``
+    """
+
+    def decorator(func):
+        JOB_HANDLERS[name] = func
+        return func
+
+    return decorator
+
+
+def get_handler(name: str) -> Callable:
+    """Returns handler registered with decorator or configured in ``PAYMENT_JOB_HANDLERS`` setting"""
+    if name in JOB_HANDLERS:
+        return JOB_HANDLERS[name]
+    if path := _setting("PAYMENT_JOB_HANDLERS", {}).get(name):
+        return import_string(path)
+    raise LookupError(f"Job handler does not exist: {name}")
+
+
+def enqueue(name: str, payment=None, payload: Optional[dict] = None, run_after=None, max_attempts=None) -> PaymentJob:
+    """enqueue
+
+    Persist new job so any worker node can claim it
+
+    Args:
+        name (str): Registered handler name
+        payment (payment, optional): Payment instance job works on
+        payload (dict, optional): Handler arguments, must be json serializable
+        run_after (datetime, optional): Do not run job before this moment
+        max_attempts (int, optional): Attempts before job is marked as failed
+    """
+    return PaymentJob.objects.create(
+        name=name,
+        payment_id=str(payment.pk) if payment is not None else "",
+        payload=payload or {},
+        run_after=run_after or timezone.now(),
+        max_attempts=max_attempts or _setting("PAYMENT_JOB_MAX_ATTEMPTS", 5),
+    )
+
+
+def claim(worker_id: str, batch_size: int, lease: int, names: Optional[Iterable[str]] = None) -> List[PaymentJob]:
+    """claim
+
+    Lease up to ``batch_size`` due jobs to ``worker_id``.
+    Rows locked by other workers are skipped (``SKIP LOCKED``), jobs with expired lease
+    (worker crashed or hang) are claimable again.
+
+    Args:
+        worker_id (str): Unique worker identifier
+        batch_size (int): Maximum number of jobs to claim
+        lease (int): Lease duration in seconds
+        names (list, optional): Restrict claiming to these job names
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        queryset = PaymentJob.objects.select_for_update(skip_locked=True).filter(
+            Q(status=JobStatus.PENDING.name, run_after__lte=now)
+            | Q(status=JobStatus.RUNNING.name, locked_until__lt=now),
+        )
+        if names:
+            queryset = queryset.filter(name__in=list(names))
+        ids = list(queryset.order_by("run_after").values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            return []
+        PaymentJob.objects.filter(pk__in=ids).update(
+            status=JobStatus.RUNNING.name,
+            locked_by=worker_id,
+            locked_until=now + timedelta(seconds=lease),
+            attempts=F("attempts") + 1,
+            modified=now,
+        )
+    return list(PaymentJob.objects.filter(pk__in=ids, locked_by=worker_id).order_by("run_after"))
+
+
+def heartbeat(worker_id: str, job_ids: Iterable[int], lease: int) -> int:
+    """Extend lease of jobs still held by ``worker_id``, returns number of extended leases"""
+    return PaymentJob.objects.filter(
+        pk__in=list(job_ids),
+        locked_by=worker_id,
+        status=JobStatus.RUNNING.name,
+    ).update(locked_until=timezone.now() + timedelta(seconds=lease))
+
+
+def retry_delay(attempt: int) -> float:
+    """Exponential backoff with jitter for given attempt number, in seconds"""
+    base = _setting("PAYMENT_JOB_RETRY_DELAY", 5)
+    cap = _setting("PAYMENT_JOB_MAX_RETRY_DELAY", 3600)
+    delay = min(cap, base * 2 ** max(attempt - 1, 0))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def complete(job: PaymentJob) -> bool:
+    """Mark job as done, lost lease (another worker reclaimed job) is reported with ``False``"""
+    return bool(
+        PaymentJob.objects.filter(pk=job.pk, locked_by=job.locked_by, status=JobStatus.RUNNING.name).update(
+            status=JobStatus.DONE.name,
+            locked_until=None,
+            modified=timezone.now(),
+        ),
+    )
+
+
+def fail(job: PaymentJob, error) -> bool:
+    """Record failed attempt, reschedule job with backoff or mark it failed when attempts are exhausted"""
+    now = timezone.now()
+    fields = {"last_error": str(error), "locked_until": None, "modified": now}
+    if job.attempts >= job.max_attempts:
+        fields["status"] = JobStatus.FAILED.name
+    else:
+        fields["status"] = JobStatus.PENDING.name
+        fields["run_after"] = now + timedelta(seconds=retry_delay(job.attempts))
+    return bool(
+        PaymentJob.objects.filter(pk=job.pk, locked_by=job.locked_by, status=JobStatus.RUNNING.name).update(
+            **fields,
+        ),
+    )
+
+
+def release(worker_id: str, job_ids: Iterable[int]) -> int:
+    """Return unfinished jobs to the queue without consuming an attempt"""
+    return PaymentJob.objects.filter(
+        pk__in=list(job_ids),
+        locked_by=worker_id,
+        status=JobStatus.RUNNING.name,
+    ).update(
+        status=JobStatus.PENDING.name,
+        locked_by="",
+        locked_until=None,
+        attempts=F("attempts") - 1,
+    )
+
+
+class JobWorker:
+    """JobWorker
+
+    Claims batches of jobs and runs them with bounded parallelism.
+    Any number of workers on any number of nodes may run against the same table.
+
+    Args:
+        names (list, optional): Job names this worker handles, all by default
+        batch_size (int, optional): Jobs claimed per round, ``PAYMENT_JOB_BATCH_SIZE`` by default
+        parallelism (int, optional): Jobs executed simultaneously, ``PAYMENT_JOB_PARALLELISM`` by default
+        lease (int, optional): Lease duration in seconds, ``PAYMENT_JOB_LEASE`` by default
+    """
+
+    def __init__(self, names=None, batch_size=None, parallelism=None, lease=None, worker_id=None):
+        self.names = list(names or [])
+        self.batch_size = batch_size or _setting("PAYMENT_JOB_BATCH_SIZE", 10)
+        self.parallelism = parallelism or _setting("PAYMENT_JOB_PARALLELISM", 1)
+        self.lease = lease or _setting("PAYMENT_JOB_LEASE", 60)
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._active = set()
+        self._lock = threading.Lock()
+
+    def execute(self, job: PaymentJob) -> bool:
+        """Run single claimed job, returns ``True`` when job succeeded"""
+        try:
+            if job.attempts > job.max_attempts:
+                raise RuntimeError("Lease expired more times than allowed attempts")
+            get_handler(job.name)(job)
+        except Exception as e:
+            logger.exception("Job %s failed on attempt %s", job, job.attempts)
+            fail(job, e)
+            return False
+        else:
+            complete(job)
+            return True
+        finally:
+            with self._lock:
+                self._active.discard(job.pk)
+
+    def _heartbeat(self, stop: threading.Event):
+        try:
+            while not stop.wait(self.lease / 3):
+                with self._lock:
+                    active = list(self._active)
+                if active:
+                    heartbeat(self.worker_id, active, self.lease)
+        finally:
+            connections.close_all()
+
+    def run_once(self) -> int:
+        """Claim and process single batch, returns number of claimed jobs"""
+        jobs = claim(self.worker_id, self.batch_size, self.lease, self.names)
+        if not jobs:
+            return 0
+        self._active = {job.pk for job in jobs}
+        stop = threading.Event()
+        beat = threading.Thread(target=self._heartbeat, args=(stop,), daemon=True)
+        beat.start()
+        try:
+            map_concurrently(self.execute, jobs, self.parallelism)
+        except BaseException:
+            # * Interrupted worker hands unfinished jobs back instead of waiting for lease expiry
+            release(self.worker_id, self._active)
+            raise
+        finally:
+            stop.set()
+            beat.join()
+        return len(jobs)
+
+    def run(self, poll_interval: float = 1, stop: Optional[threading.Event] = None):
+        """Process batches until ``stop`` is set, sleeping ``poll_interval`` seconds when queue is empty"""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            if not self.run_once():
+                stop.wait(poll_interval)
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from drf_payments import get_payment_model
+from drf_payments.capture import capture_payments
+from drf_payments.constants import PaymentStatus
+
+
+class Command(BaseCommand):
+    help = "Capture pre-authorized payments concurrently"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--id", action="append", dest="ids", help="Payment to capture, may be repeated")
+        parser.add_argument(
+            "--variant",
+            action="append",
+            dest="variants",
+            help="Capture all of variant, may be repeated",
+        )
+        parser.add_argument("--chunk-size", type=int, default=500, help="Payments loaded at once")
+        parser.add_argument("--concurrency", type=int, help="Simultaneous gateway calls")
+
+    def handle(self, *args, **options):
+        if not options["ids"] and not options["variants"]:
+            raise CommandError("Pass --id or --variant")
+        queryset = get_payment_model().objects.filter(status=PaymentStatus.PREAUTH.name)
+        if options["ids"]:
+            queryset = queryset.filter(pk__in=options["ids"])
+        if options["variants"]:
+            queryset = queryset.filter(variant__in=options["variants"])
+        captured = failed = 0
+        last_pk = None
+        while True:
+            chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            ids = list(chunk.order_by("pk").values_list("pk", flat=True)[: options["chunk_size"]])
+            if not ids:
+                break
+            last_pk = ids[-1]
+            for payment, error in capture_payments(ids, concurrency=options["concurrency"]):
+                if error is None:
+                    captured += 1
+                else:
+                    failed += 1
+                    self.stderr.write(f"Payment {payment.pk}: {error}")
+        self.stdout.write(f"Captured {captured} payment(s), {failed} failed")
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from drf_payments.catchup import catch_up
+
+
+class Command(BaseCommand):
+    help = "Fetch gateway events missed since the last run and apply them with webhook handlers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--variant", action="append", dest="variants", help="Variant to catch up, may be repeated")
+        parser.add_argument("--since", help="Fetch events from ISO datetime instead of checkpoint")
+        parser.add_argument("--concurrency", type=int, default=8, help="Events applied simultaneously")
+        parser.add_argument("--max-pending", type=int, help="Events in flight, concurrency * 100 by default")
+
+    def handle(self, *args, **options):
+        since = None
+        if options["since"] and (since := parse_datetime(options["since"])) is None:
+            raise CommandError("--since must be ISO datetime")
+        for variant in options["variants"] or getattr(settings, "PAYMENT_VARIANTS", {}):
+            try:
+                result = catch_up(
+                    variant,
+                    since=since,
+                    concurrency=options["concurrency"],
+                    max_pending=options["max_pending"],
+                )
+            except NotImplementedError:
+                self.stdout.write(f"{variant}: gateway events can't be listed, skipped")
+                continue
+            self.stdout.write(
+                f"{variant}: applied {result.applied} event(s), {result.duplicates} duplicate(s), "
+                f"{result.failed} failed",
+            )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from drf_payments.partitioning import create_partitions
+
+
+class Command(BaseCommand):
+    help = "Create monthly partitions of payment table ahead of time"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--months-ahead", type=int, default=3, help="Months after current to prepare")
+
+    def handle(self, *args, **options):
+        created = create_partitions(months_ahead=options["months_ahead"])
+        self.stdout.write(f"Created {len(created)} partition(s) {', '.join(created)}".rstrip())
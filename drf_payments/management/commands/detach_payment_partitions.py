@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from drf_payments.partitioning import detach_partitions
+
+
+class Command(BaseCommand):
+    help = "Detach old monthly partitions of payment table, optionally archiving or dropping them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--keep-months", type=int, required=True, help="Months of payments to keep")
+        parser.add_argument("--archive-schema", help="Move detached partitions to this schema")
+        parser.add_argument("--drop", action="store_true", help="Drop detached partitions")
+
+    def handle(self, *args, **options):
+        if options["keep_months"] < 1:
+            raise CommandError("--keep-months must be at least 1")
+        if options["drop"] and options["archive_schema"]:
+            raise CommandError("--drop and --archive-schema are exclusive")
+        detached = detach_partitions(
+            older_than_months=options["keep_months"],
+            archive_schema=options["archive_schema"],
+            drop=options["drop"],
+        )
+        self.stdout.write(f"Detached {len(detached)} partition(s) {', '.join(detached)}".rstrip())
@@ -0,0 +1,35 @@
+import threading
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from drf_payments.expiry import expire_payments
+
+
+class Command(BaseCommand):
+    help = "Move abandoned WAITING payments to EXPIRED in small chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than", type=int, help="Payment age in seconds, PAYMENT_EXPIRE_AFTER by default")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Rows updated per statement")
+        parser.add_argument("--variant", action="append", dest="variants", help="Variant to expire, may be repeated")
+        parser.add_argument("--gateway", action="store_true", help="Expire checkout on gateway side as well")
+        parser.add_argument("--concurrency", type=int, default=4, help="Simultaneous gateway calls")
+        parser.add_argument("--pause", type=float, default=0, help="Sleep between chunks in seconds")
+        parser.add_argument("--loop", type=float, help="Run continuously, sleeping given seconds between passes")
+
+    def handle(self, *args, **options):
+        kwargs = {
+            "older_than": timedelta(seconds=options["older_than"]) if options["older_than"] else None,
+            "chunk_size": options["chunk_size"],
+            "variants": options["variants"],
+            "gateway": options["gateway"],
+            "concurrency": options["concurrency"],
+            "pause": options["pause"],
+        }
+        stop = threading.Event()
+        while True:
+            expired = expire_payments(**kwargs)
+            self.stdout.write(f"Expired {expired} payment(s)")
+            if not options["loop"] or stop.wait(options["loop"]):
+                return
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from drf_payments.idempotency import purge_idempotency_records
+
+
+class Command(BaseCommand):
+    help = "Delete responses stored for Idempotency-Key headers older than PAYMENT_IDEMPOTENCY_TTL"
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Deleted {purge_idempotency_records()} record(s)")
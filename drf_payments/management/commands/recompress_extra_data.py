@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from drf_payments import get_payment_model
+from drf_payments.fields import CompressedJSONField, recompress
+
+
+class Command(BaseCommand):
+    help = "Compress extra_data of existing payments with current codec and dictionary"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500, help="Rows updated per transaction")
+
+    def handle(self, *args, **options):
+        model = get_payment_model()
+        if not isinstance(model._meta.get_field("extra_data"), CompressedJSONField):
+            raise CommandError(f"{model._meta.label}.extra_data is not CompressedJSONField")
+        total = recompress(model, "extra_data", chunk_size=options["chunk_size"])
+        self.stdout.write(f"Recompressed {total} payment(s)")
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from drf_payments.deadletter import replay
+from drf_payments.models import WebhookDeadLetter
+
+
+class Command(BaseCommand):
+    help = "Reprocess failed webhook events from dead-letter store in parallel"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--gateway", action="append", dest="gateways", help="Gateway to replay, may be repeated")
+        parser.add_argument("--event-type", action="append", dest="event_types", help="Event type, may be repeated")
+        parser.add_argument("--error-code", action="append", dest="error_codes", help="Error code, may be repeated")
+        parser.add_argument("--since", help="Replay events failed first at or after ISO datetime")
+        parser.add_argument("--max-failures", type=int, help="Skip events failed more times")
+        parser.add_argument("--concurrency", type=int, default=8, help="Events applied simultaneously")
+        parser.add_argument("--rate", type=float, help="Maximum events replayed per second")
+
+    def handle(self, *args, **options):
+        queryset = WebhookDeadLetter.objects.all()
+        if options["gateways"]:
+            queryset = queryset.filter(gateway__in=options["gateways"])
+        if options["event_types"]:
+            queryset = queryset.filter(event_type__in=options["event_types"])
+        if options["error_codes"]:
+            queryset = queryset.filter(error_code__in=options["error_codes"])
+        if options["since"]:
+            if (since := parse_datetime(options["since"])) is None:
+                raise CommandError("--since must be ISO datetime")
+            queryset = queryset.filter(created__gte=since)
+        if options["max_failures"]:
+            queryset = queryset.filter(failures__lte=options["max_failures"])
+        resolved, failed = replay(queryset, concurrency=options["concurrency"], rate=options["rate"])
+        self.stdout.write(f"Resolved {resolved} event(s), {failed} still failing")
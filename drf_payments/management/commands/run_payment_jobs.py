@@ -0,0 +1,35 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from drf_payments.jobs import JobWorker
+
+
+class Command(BaseCommand):
+    help = "Claim and run background payment jobs, safe to run on many nodes at once"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--name", action="append", dest="names", help="Job name to handle, may be repeated")
+        parser.add_argument("--batch-size", type=int, help="Jobs claimed per round")
+        parser.add_argument("--parallelism", type=int, help="Jobs executed simultaneously")
+        parser.add_argument("--lease", type=int, help="Lease duration in seconds")
+        parser.add_argument("--poll-interval", type=float, default=1, help="Sleep between empty rounds in seconds")
+        parser.add_argument("--once", action="store_true", help="Process single batch and exit")
+
+    def handle(self, *args, **options):
+        worker = JobWorker(
+            names=options["names"],
+            batch_size=options["batch_size"],
+            parallelism=options["parallelism"],
+            lease=options["lease"],
+        )
+        if options["once"]:
+            processed = worker.run_once()
+            self.stdout.write(f"Processed {processed} job(s)")
+            return
+        stop = threading.Event()
+        # * Finish current batch on SIGTERM, unfinished jobs are released on hard interrupt
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        self.stdout.write(f"Worker {worker.worker_id} started")
+        worker.run(poll_interval=options["poll_interval"], stop=stop)
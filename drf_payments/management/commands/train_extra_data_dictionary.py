@@ -0,0 +1,31 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+
+from drf_payments import get_payment_model
+from drf_payments.fields import train_dictionary
+
+
+class Command(BaseCommand):
+    help = "Train compression dictionary on extra_data of recent payments"
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Dictionary file path")
+        parser.add_argument("--samples", type=int, default=1000, help="Recent payments used as samples")
+        parser.add_argument("--size", type=int, default=16 * 1024, help="Dictionary size in bytes")
+
+    def handle(self, *args, **options):
+        values = get_payment_model().objects.order_by("-pk").values_list("extra_data", flat=True)
+        samples = [
+            json.dumps(value, cls=DjangoJSONEncoder, separators=(",", ":")).encode("utf-8")
+            for value in values[: options["samples"]]
+            if value
+        ]
+        dictionary = train_dictionary(samples, size=options["size"])
+        with open(options["output"], "wb") as f:
+            f.write(dictionary)
+        self.stdout.write(
+            f"Trained {len(dictionary)} bytes dictionary on {len(samples)} payment(s), "
+            "add it to PAYMENT_COMPRESSION_DICTIONARIES under new id and set PAYMENT_COMPRESSION_DICTIONARY",
+        )
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-19 07:46
+
+from django.db import migrations, models
+import drf_payments.codec
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("drf_payments", "0002_idempotencyrecord"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WebhookDeadLetter",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("event_id", models.CharField(max_length=255, unique=True)),
+                ("gateway", models.CharField(blank=True, db_index=True, default="", max_length=32)),
+                ("event_type", models.CharField(blank=True, default="", max_length=255)),
+                (
+                    "payload",
+                    models.JSONField(
+                        decoder=drf_payments.codec.PaymentJSONDecoder, encoder=drf_payments.codec.PaymentJSONEncoder
+                    ),
+                ),
+                ("error", models.TextField(blank=True, default="")),
+                ("error_code", models.CharField(blank=True, default="", max_length=255)),
+                ("failures", models.PositiveIntegerField(default=1)),
+                ("resolved_at", models.DateTimeField(blank=True, db_index=True, null=True)),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("modified", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-19 07:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("drf_payments", "0003_webhookdeadletter"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WebhookCheckpoint",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("variant", models.CharField(max_length=255, unique=True)),
+                ("synced_until", models.DateTimeField(blank=True, null=True)),
+                ("modified", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
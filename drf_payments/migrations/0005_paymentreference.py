@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-19 07:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("drf_payments", "0004_webhookcheckpoint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PaymentReference",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("gateway", models.CharField(max_length=32)),
+                ("kind", models.CharField(max_length=32)),
+                ("reference", models.CharField(max_length=255)),
+                ("payment_id", models.CharField(db_index=True, max_length=255)),
+                ("created", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="paymentreference",
+            constraint=models.UniqueConstraint(fields=("gateway", "reference"), name="drf_payments_reference_unique"),
+        ),
+    ]
@@ -1,13 +1,50 @@
+import json
+import time
+from typing import ClassVar
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from rest_framework import generics, serializers, views
+from django.utils.decorators import method_decorator
+from rest_framework import generics, parsers, renderers, serializers, views
 from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.viewsets import ModelViewSet
 
 import drf_payments
-from drf_payments import get_payment_model, get_payment_service
-from drf_payments.constants import PaymentStatus
+from drf_payments import deadletter, events, get_payment_model, get_payment_service, tasks
+from drf_payments.codec import FastJSONParser
+from drf_payments.constants import PaymentError, PaymentStatus
+from drf_payments.fields import CompressedJSONField
+from drf_payments.idempotency import idempotent_response
+from drf_payments.notifications import get_notifier
+from drf_payments.partitioning import filter_created
+from drf_payments.routers import replica_reads
+from drf_payments.status import get_status
+from drf_payments.utils import map_concurrently
+from drf_payments.verification import verify_webhook
+
+
+class PaymentListSerializer(serializers.ListSerializer):
+    """Creates batch of payments with single ``bulk_create``, gateway calls are left to the caller"""
+
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        # * Token is generated by field default, bulk_create doesn't call save
+        instances = [model(**self.child.prepare_data(attrs)) for attrs in validated_data]
+        if not connections[router.db_for_write(model)].features.can_return_rows_from_bulk_insert:
+            # * Gateways need primary keys, databases not returning them get one insert per payment
+            for instance in instances:
+                instance.save()
+            return instances
+        return model.objects.bulk_create(instances)
 
 
 class PaymentSerializerMixin(serializers.ModelSerializer):
@@ -17,6 +54,10 @@ class PaymentSerializerMixin(serializers.ModelSerializer):
 
     """
 
+    serializer_field_mapping: ClassVar[dict] = {
+        **serializers.ModelSerializer.serializer_field_mapping,
+        CompressedJSONField: serializers.JSONField,
+    }
     card = serializers.CharField(required=False, write_only=True)
     card_expiration = serializers.CharField(required=False, write_only=True)
     card_cvv = serializers.CharField(required=False, write_only=True)
@@ -24,17 +65,18 @@ class PaymentSerializerMixin(serializers.ModelSerializer):
     class Meta:
         model = get_payment_model()
         fields = "__all__"
-        read_only_fields = ["status", "extra_data"]
+        read_only_fields = ["status", "extra_data", "token"]
+        list_serializer_class = PaymentListSerializer
 
     def validate(self, attrs):
         # * In case of authorizenet provider we must provide card data
-        if self.initial_data.get("variant") == "authorizenet" and all(
+        if attrs.get("variant") == "authorizenet" and all(
             key not in attrs for key in ["card", "card_cvv", "card_expiration"]
         ):
             raise serializers.ValidationError("Card, card_expiration, card_cvv are required when using authorizenet")
         return super().validate(attrs)
 
-    def create(self, validated_data):
+    def prepare_data(self, validated_data):
         # * Move card data to extra data field in case of authorizenet provider
         if validated_data["variant"] == "authorizenet":
             validated_data["extra_data"] = {
@@ -44,7 +86,14 @@ class PaymentSerializerMixin(serializers.ModelSerializer):
                     "x_exp_date": validated_data.pop("card_expiration"),
                 },
             }
-        instance = super().create(validated_data)
+        return validated_data
+
+    def create(self, validated_data):
+        instance = super().create(self.prepare_data(validated_data))
+        # * Gateway is called outside of request, client polls payment until checkout url is ready
+        if self.context.get("process_async", False):
+            tasks.enqueue("drf_payments.tasks.process_payment", instance.pk)
+            return instance
         service = get_payment_service(instance.variant)
         service.process_payment(instance)
         return instance
@@ -52,27 +101,170 @@ class PaymentSerializerMixin(serializers.ModelSerializer):
     # ? Adding payment url from extra_data
     def to_representation(self, instance):
         """
-        Override the default representation of the instance object to include the payment urls
+        Override the default representation of the instance object to include the payment urls,
+        url is ``None`` until asynchronously processed payment reaches gateway
         """
         data = super().to_representation(instance)
         if instance.variant == "stripe" and isinstance(
             get_payment_service(instance.variant),
             drf_payments.stripe.StripeCheckoutProvider,
         ):
-            data["url"] = instance.extra_data["session"]["url"]
+            data["url"] = instance.extra_data["session"]["url"] if "session" in instance.extra_data else None
         # * In case of paypal we return url for checkout form
         if instance.variant == "paypal" and isinstance(
             get_payment_service(instance.variant),
             drf_payments.paypal.PaypalProvider,
         ):
-            data["url"] = instance.extra_data["order"]["links"][1]["href"]
+            data["url"] = instance.extra_data["order"]["links"][1]["href"] if "order" in instance.extra_data else None
         return data
 
 
+class BatchStatusSerializer(serializers.Serializer):
+    """Identifiers of payments to look up, ``after`` is cursor returned as ``next`` by previous page"""
+
+    ids = serializers.ListField(child=serializers.CharField(), required=False, default=list)
+    tokens = serializers.ListField(child=serializers.CharField(), required=False, default=list)
+    transaction_ids = serializers.ListField(child=serializers.CharField(), required=False, default=list)
+    after = serializers.CharField(required=False, allow_null=True, default=None)
+
+    def validate_ids(self, value):
+        pk = get_payment_model()._meta.pk
+        try:
+            return [pk.to_python(item) for item in value]
+        except DjangoValidationError as e:
+            raise serializers.ValidationError(e.messages) from e
+
+    def validate_after(self, value):
+        return self.validate_ids([value])[0] if value is not None else None
+
+    def validate(self, attrs):
+        size = len(attrs["ids"]) + len(attrs["tokens"]) + len(attrs["transaction_ids"])
+        if not size:
+            raise serializers.ValidationError("At least one of ids, tokens, transaction_ids is required")
+        if size > getattr(settings, "PAYMENT_BATCH_STATUS_MAX_SIZE", 1000):
+            raise serializers.ValidationError("Too many identifiers")
+        return attrs
+
+
 class PaymentViewMixin(ModelViewSet):
     "Add custom method for payment instance based on variant"
     serializer_class = PaymentSerializerMixin
     queryset = get_payment_model().objects.all()
+    #: Process payments with task backend and respond ``202 Accepted``, ``PAYMENT_ASYNC_CREATE`` by default
+    process_async = None
+    #: Actions reading payments from replicas, see ``drf_payments.routers.PaymentReplicaRouter``
+    replica_actions = ("list",)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action == "list":
+            # * Range of ``created`` lets PostgreSQL prune partitions of payment table
+            queryset = filter_created(queryset, self.request.query_params)
+        return queryset
+
+    def initial(self, request, *args, **kwargs):
+        if self.action in self.replica_actions:
+            self._replica_reads = replica_reads()
+            self._replica_reads.__enter__()
+        super().initial(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if replica := self.__dict__.pop("_replica_reads", None):
+            replica.__exit__(None, None, None)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def get_process_async(self) -> bool:
+        if self.process_async is None:
+            return getattr(settings, "PAYMENT_ASYNC_CREATE", False)
+        return self.process_async
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["process_async"] = self.action == "create" and self.get_process_async()
+        return context
+
+    def create(self, request, *args, **kwargs):
+        """Payment is created once per ``Idempotency-Key`` header, retried request gets the original response"""
+        if key := request.headers.get("Idempotency-Key"):
+            return idempotent_response(request, key, lambda: self._create(request, *args, **kwargs))
+        return self._create(request, *args, **kwargs)
+
+    def _create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        if self.get_process_async() and response.status_code == 201:
+            # * Payment is not processed yet, Location points to payment client polls for status and url
+            response.status_code = 202
+            response["Location"] = self.reverse_action(
+                "detail",
+                args=[response.data[self.queryset.model._meta.pk.name]],
+            )
+        return response
+
+    @action(detail=False, methods=["POST"], url_path="batch")
+    def batch_create(self, request):
+        """batch_create
+
+        Create list of payments with one insert, gateway calls are made concurrently
+        unless request runs in transaction.
+        Every item gets its payment and error, response is ``207 Multi-Status`` when some gateway call failed.
+        """
+        serializer = self.get_serializer(
+            data=request.data,
+            many=True,
+            allow_empty=False,
+            max_length=getattr(settings, "PAYMENT_BATCH_MAX_SIZE", 100),
+        )
+        serializer.is_valid(raise_exception=True)
+        payments = serializer.save()
+        if self.get_process_async():
+            for payment in payments:
+                tasks.enqueue("drf_payments.tasks.process_payment", payment.pk)
+            errors = [None] * len(payments)
+            status = 202
+        else:
+            concurrency = getattr(settings, "PAYMENT_BATCH_CONCURRENCY", 8)
+            if connections[router.db_for_write(self.queryset.model)].in_atomic_block:
+                # * Payments are not committed yet (e.g. ATOMIC_REQUESTS), worker threads can't see them
+                concurrency = 1
+            results = map_concurrently(tasks.process, payments, concurrency)
+            errors = [error or failure for _, error, failure in results]
+            status = 207 if any(errors) else 201
+        data = self.get_serializer(payments, many=True).data
+        return Response(
+            data=[{"payment": item, "error": str(error) if error else None} for item, error in zip(data, errors)],
+            status=status,
+        )
+
+    @action(detail=False, methods=["POST"], url_path="batch-status", serializer_class=BatchStatusSerializer)
+    def batch_status(self, request):
+        """batch_status
+
+        Status of many payments by ids, tokens or transaction ids resolved with one indexed query
+        reading status columns only. Response maps payment pk to its status, ``next`` is passed as ``after``
+        to get the next page.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        page_size = getattr(settings, "PAYMENT_BATCH_STATUS_PAGE_SIZE", 500)
+        lookup = Q(pk__in=data["ids"]) | Q(token__in=data["tokens"]) | Q(transaction_id__in=data["transaction_ids"])
+        queryset = self.filter_queryset(self.get_queryset()).filter(lookup)
+        if data["after"] is not None:
+            queryset = queryset.filter(pk__gt=data["after"])
+        rows = list(
+            queryset.order_by("pk").values(
+                "pk",
+                "token",
+                "transaction_id",
+                "status",
+                "fraud_status",
+                "captured_amount",
+                "modified",
+            )[: page_size + 1],
+        )
+        rows, more = rows[:page_size], len(rows) > page_size
+        next_page = str(rows[-1]["pk"]) if more else None
+        return Response(data={"results": {str(row.pop("pk")): row for row in rows}, "next": next_page}, status=200)
 
     @action(detail=True, methods=["POST"])
     def refund(self, request, pk):
@@ -83,6 +275,32 @@ class PaymentViewMixin(ModelViewSet):
             return Response(data={"error": str(e)}, status=400)
         return Response(data=self.serializer_class(payment).data, status=200)
 
+    @action(detail=True, methods=["POST"])
+    def capture(self, request, pk):
+        """capture
+
+        Capture payment authorized with ``capture=False``, optional ``amount`` captures part of the total
+        """
+        payment = self.get_object()
+        amount = request.data.get("amount")
+        try:
+            amount = (
+                serializers.DecimalField(max_digits=9, decimal_places=2).to_internal_value(amount) if amount else None
+            )
+            get_payment_service(payment.variant).capture(payment, amount)
+        except Exception as e:
+            return Response(data={"error": str(e)}, status=400)
+        return Response(data=self.serializer_class(payment).data, status=200)
+
+    @action(detail=True, methods=["GET"], url_path="status")
+    def payment_status(self, request, pk):
+        """Cached status projection, only existence of payment in view queryset is checked"""
+        # * Cache is shared by all views, payment must be visible to this one like in ``batch_status``
+        generics.get_object_or_404(self.filter_queryset(self.get_queryset()).values_list("pk", flat=True), pk=pk)
+        if (data := get_status(pk=pk)) is None:
+            raise Http404()
+        return Response(data=data, status=200)
+
 
 class PaymentCallbackSerializerMixin(serializers.Serializer):
     """
@@ -120,73 +338,127 @@ class PaymentCallbackSerializerMixin(serializers.Serializer):
 
     """
 
+    def validate(self, attrs):
+        # * Braintree transactions listed by catch-up ingestion are not webhooks and carry no signature
+        if "bt_transaction" in self.initial_data:
+            raise serializers.ValidationError("Unsupported event")
+        return attrs
+
     def create(self, validated_data):
-        event = self.context.get("request", None).data
-        # * Stripe checkout session hook
-        if event.get("type") == "checkout.session.completed":
-            payment_id = event["data"]["object"].get("client_reference_id")
-            status = event["data"]["object"]["payment_status"]
-            if status == "paid":
-                try:
-                    self._change_payment_status(payment_id, event, "session")
-                except Exception as e:
-                    raise serializers.ValidationError(f"Payment with id {payment_id} not found") from e
-        # * Stripe payment  hook
-        if event.get("type") == "payment_intent.succeeded":
-            payment_id = event["data"]["object"].get("metadata", {}).get("order_no", None)
-            status = event["data"]["object"]["status"]
-            if status == "succeeded":
-                try:
-                    self._change_payment_status(payment_id, event, "payment_intend")
-                except Exception as e:
-                    raise serializers.ValidationError(f"Payment with id {payment_id} not found") from e
-        # * Paypal hook
-        if event.get("event_type") == "CHECKOUT.ORDER.APPROVED":
-            payment_id = event.get("resource", {}).get("id")
-            status = event.get("resource", {}).get("status")
-            # * Upon checkout approval we change status and capture payment
-            if status == "APPROVED":
-                try:
-                    payment = get_payment_model().objects.get(transaction_id=payment_id)
-                    payment.status = PaymentStatus.CONFIRMED.name
-                    payment.extra_data["order"] = event.get("resource", {})
-                    payment.save(update_fields=["status", "extra_data"])
-                    get_payment_service("paypal").capture(payment)
-                except Exception as e:
-                    raise serializers.ValidationError(f"Payment with id {payment_id} not found") from e
-        # * Braintree webhook
-        if "bt_signature" in event:
-            bt = get_payment_service("braintree")
-            try:
-                result = bt.service.webhook_notification.parse(event["bt_signature"], event["bt_payload"])
-            except Exception as e:
-                raise serializers.ValidationError(f"Can't parse event {e}") from e
-            try:
-                payment = get_payment_model().objects.get(transaction_id=result.transaction.id)
-                data = bt._serialize(bt.service.transaction.find(result.transaction.id).__dict__)
-                payment.extra_data["transaction"] = data
-                payment.status = PaymentStatus.CONFIRMED.name
-                payment.save(update_fields=["status", "extra_data"])
-            except Exception as e:
-                raise serializers.ValidationError(f"Can't find payment {result.transaction.id}") from e
+        request = self.context.get("request", None)
+        try:
+            # * Notification is parsed and verified by callback view
+            event = events.parse_event(request.data, getattr(request, "webhook_notification", None))
+            if event is not None:
+                # * Events of the same payment arriving together are written at once
+                events.submit(event)
+        except Exception as e:
+            # * Failed events are kept for replay instead of waiting for gateway retry schedule
+            if getattr(e, "code", None) != "invalid_event":
+                deadletter.store(request.data.dict() if hasattr(request.data, "dict") else request.data, e)
+            raise serializers.ValidationError(str(e)) from e
         return validated_data
 
-    @staticmethod
-    def _change_payment_status(payment_id, event, data):
-        payment = get_payment_model().objects.get(pk=payment_id)
-        payment.status = PaymentStatus.CONFIRMED.name
-        payment.extra_data[data] = event["data"]["object"]
-        payment.save(update_fields=["status", "extra_data"])
-
     def to_representation(self, instance):
         return {"message": "Your payment was successful"}
 
 
+# * Failed event responds 400, ATOMIC_REQUESTS would roll back its dead letter together with the request
+@method_decorator(transaction.non_atomic_requests, name="dispatch")
 class PaymentCallbackView(generics.CreateAPIView):
-    """Override your serializer_class"""
+    """Override your serializer_class, events are verified with ``drf_payments.verification.verify_webhook``"""
 
     serializer_class = PaymentCallbackSerializerMixin
     permission_classes = (AllowAny,)
+    parser_classes = (FastJSONParser, parsers.FormParser, parsers.MultiPartParser)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # * Forged events are rejected before any database work
+        try:
+            verify_webhook(request)
+        except PaymentError as e:
+            raise PermissionDenied(str(e)) from e
+
+
+class EventStreamRenderer(renderers.BaseRenderer):
+    """Renders data as single Server-Sent Event"""
+
+    media_type = "text/event-stream"
+    format = "sse"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return f"data: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+class PaymentStatusView(views.APIView):
+    """PaymentStatusView
+
+    Status of payment by its ``token``, cached projection of status fields is returned.
+
+    Long-polling: ``?status=WAITING&wait=25`` responds once status differs from ``status``
+    or after ``wait`` seconds. With ``Accept: text/event-stream`` every status change is sent
+    as Server-Sent Event until payment reaches one of ``final_statuses``.
+    """
+
+    permission_classes = (AllowAny,)
+    renderer_classes = (*api_settings.DEFAULT_RENDERER_CLASSES, EventStreamRenderer)
+    final_statuses = (
+        PaymentStatus.CONFIRMED.name,
+        PaymentStatus.REJECTED.name,
+        PaymentStatus.REFUNDED.name,
+        PaymentStatus.ERROR.name,
+        PaymentStatus.EXPIRED.name,
+    )
+
+    def get_status(self, token):
+        data = get_status(token=token)
+        if data is None:
+            raise Http404()
+        return data
+
+    def get_wait(self, request) -> float:
+        try:
+            wait = float(request.query_params.get("wait", 0))
+        except ValueError:
+            return 0
+        return min(max(wait, 0), getattr(settings, "PAYMENT_STATUS_MAX_WAIT", 30))
+
+    def wait_for_change(self, token, data, timeout):
+        """Returns status once it differs from ``data`` or ``timeout`` passes"""
+        notifier = get_notifier()
+        # * Subscribed before status is read again, change committed in between is not missed
+        event = notifier.subscribe(token)
+        try:
+            current = self.get_status(token)
+            if current["status"] == data["status"]:
+                event.wait(timeout)
+                current = self.get_status(token)
+        finally:
+            notifier.unsubscribe(token, event)
+        return current
+
+    def get(self, request, token):
+        data = self.get_status(token)
+        if request.accepted_renderer.format == EventStreamRenderer.format:
+            response = StreamingHttpResponse(self.stream(token, data), content_type=EventStreamRenderer.media_type)
+            response["Cache-Control"] = "no-cache"
+            return response
+        known = request.query_params.get("status")
+        if (wait := self.get_wait(request)) and data["status"] == known:
+            data = self.wait_for_change(token, data, wait)
+        return Response(data)
+
+    def stream(self, token, data):
+        renderer = EventStreamRenderer()
+        deadline = time.monotonic() + getattr(settings, "PAYMENT_STATUS_STREAM_TIMEOUT", 300)
+        yield renderer.render(data)
+        while data["status"] not in self.final_statuses and (remaining := deadline - time.monotonic()) > 0:
+            current = self.wait_for_change(token, data, min(remaining, 15))
+            # * Comment line keeps proxies from closing idle stream
+            yield renderer.render(current) if current["status"] != data["status"] else ": keep-alive\n\n"
+            data = current
 
 
 class PaymentSettingsView(views.APIView):
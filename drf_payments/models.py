@@ -1,9 +1,20 @@
+import uuid
+
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from phonenumber_field.modelfields import PhoneNumberField
 
-from .constants import FraudStatus, PaymentCurrency, PaymentStatus
+from .codec import PaymentJSONDecoder, PaymentJSONEncoder
+from .constants import FraudStatus, JobStatus, PaymentCurrency, PaymentStatus
+from .signals import status_changed
+
+
+def generate_token() -> str:
+    """Random payment token, unlike pk it can't be guessed"""
+    return str(uuid.uuid4())
 
 
 class BasePayment(models.Model):
@@ -18,6 +29,7 @@ class BasePayment(models.Model):
         choices=[(v.name, v.value) for v in PaymentStatus],
         blank=True,
         default=PaymentStatus.WAITING.name,
+        db_index=True,
     )
     fraud_status = models.CharField(
         _("fraud check"),
@@ -31,7 +43,7 @@ class BasePayment(models.Model):
     #: Date and time of last modification
     modified = models.DateTimeField(auto_now=True)
     #: Transaction ID (if applicable)
-    transaction_id = models.CharField(max_length=255, blank=True)
+    transaction_id = models.CharField(max_length=255, blank=True, db_index=True)
     #: Currency code (may be provider-specific)
     currency = models.CharField(
         _("Currency"),
@@ -55,9 +67,10 @@ class BasePayment(models.Model):
     billing_email = models.EmailField(blank=True)
     billing_phone = PhoneNumberField(blank=True)
     customer_ip_address = models.GenericIPAddressField(blank=True, null=True)
-    extra_data = models.JSONField(default=dict)
+    extra_data = models.JSONField(default=dict, encoder=PaymentJSONEncoder, decoder=PaymentJSONDecoder)
     message = models.TextField(blank=True, default="")
-    token = models.CharField(max_length=36, blank=True, default="")
+    #: Only credential of public status endpoints, generated on creation
+    token = models.CharField(max_length=36, blank=True, default=generate_token, unique=True)
     captured_amount = models.DecimalField(max_digits=9, decimal_places=2, default=0.00)
 
     class Meta:
@@ -66,6 +79,23 @@ class BasePayment(models.Model):
     def __str__(self):
         return f"{self.variant}-{self.total}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_status = instance.__dict__.get("status")
+        return instance
+
+    def save(self, *args, **kwargs):
+        # * Token identifies payment on public status endpoint, unlike pk it can't be guessed
+        if self._state.adding and not self.token:
+            self.token = generate_token()
+        previous = getattr(self, "_loaded_status", None)
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get("update_fields")
+        if previous != self.status and (update_fields is None or "status" in update_fields):
+            self._loaded_status = self.status
+            status_changed.send(sender=type(self), payment=self, previous=previous)
+
     @property
     def failure_url(self) -> str:
         return f"{settings.PAYMENT_FAILURE_URL}"
@@ -73,3 +103,119 @@ class BasePayment(models.Model):
     @property
     def success_url(self) -> str:
         return f"{settings.PAYMENT_SUCCESS_URL}"
+
+
+class PaymentJob(models.Model):
+    """
+    Background unit of work claimed by workers with a time limited lease
+    """
+
+    #: Name of the registered handler, see `drf_payments.jobs.register`
+    name = models.CharField(max_length=255)
+    #: Primary key of the payment this job works on (if applicable)
+    payment_id = models.CharField(max_length=255, blank=True, default="", db_index=True)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(
+        max_length=255,
+        choices=[(v.name, v.value) for v in JobStatus],
+        default=JobStatus.PENDING.name,
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    #: Job is not claimed before this moment, used for retries backoff
+    run_after = models.DateTimeField(default=timezone.now)
+    #: Worker currently holding the lease
+    locked_by = models.CharField(max_length=255, blank=True, default="")
+    #: Lease expiration, job is claimable again once it passes
+    locked_until = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default="")
+    created = models.DateTimeField(auto_now_add=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = (models.Index(fields=["status", "run_after"], name="drf_payments_job_claim_idx"),)
+
+    def __str__(self):
+        return f"{self.name}-{self.pk}"
+
+
+class IdempotencyRecord(models.Model):
+    """
+    Response stored for client supplied ``Idempotency-Key`` header
+    """
+
+    #: Requester and endpoint the key belongs to
+    scope = models.CharField(max_length=255)
+    key = models.CharField(max_length=255)
+    #: Fingerprint of request body, key can't be reused for different request
+    request_hash = models.CharField(max_length=64)
+    #: Empty while original request is processed
+    response_status = models.PositiveSmallIntegerField(blank=True, null=True)
+    response_body = models.JSONField(blank=True, null=True, encoder=DjangoJSONEncoder)
+    #: Concurrent duplicates are rejected until this moment
+    locked_until = models.DateTimeField()
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = (models.UniqueConstraint(fields=["scope", "key"], name="drf_payments_idempotency_key_unique"),)
+
+    def __str__(self):
+        return f"{self.scope}-{self.key}"
+
+
+class WebhookDeadLetter(models.Model):
+    """
+    Webhook event which failed to apply, kept until it's replayed successfully
+    """
+
+    #: Gateway event id, hash of payload when gateway doesn't send one
+    event_id = models.CharField(max_length=255, unique=True)
+    gateway = models.CharField(max_length=32, blank=True, default="", db_index=True)
+    event_type = models.CharField(max_length=255, blank=True, default="")
+    payload = models.JSONField(encoder=PaymentJSONEncoder, decoder=PaymentJSONDecoder)
+    #: Error of the last failed attempt
+    error = models.TextField(blank=True, default="")
+    error_code = models.CharField(max_length=255, blank=True, default="")
+    #: Failed deliveries and replays
+    failures = models.PositiveIntegerField(default=1)
+    #: Set once event is applied by replay
+    resolved_at = models.DateTimeField(blank=True, null=True, db_index=True)
+    created = models.DateTimeField(auto_now_add=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.gateway}-{self.event_id}"
+
+
+class WebhookCheckpoint(models.Model):
+    """
+    Progress of catch-up ingestion of gateway events per variant
+    """
+
+    variant = models.CharField(max_length=255, unique=True)
+    #: Events created before this moment were ingested
+    synced_until = models.DateTimeField(blank=True, null=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.variant}-{self.synced_until}"
+
+
+class PaymentReference(models.Model):
+    """
+    Gateway identifier (session, intent, order, capture, ...) of a payment, resolves events with one indexed lookup
+    """
+
+    gateway = models.CharField(max_length=32)
+    #: Kind of identifier, e.g. ``session``, ``intent``, ``charge``, ``order``, ``capture``, ``refund``
+    kind = models.CharField(max_length=32)
+    reference = models.CharField(max_length=255)
+    #: Primary key of the payment, payment model is swappable
+    payment_id = models.CharField(max_length=255, db_index=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = (models.UniqueConstraint(fields=["gateway", "reference"], name="drf_payments_reference_unique"),)
+
+    def __str__(self):
+        return f"{self.gateway}-{self.kind}-{self.reference}"
@@ -0,0 +1,140 @@
+import logging
+import os
+import select
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from drf_payments.signals import status_changed
+
+logger = logging.getLogger(__name__)
+
+
+class LocalNotifier:
+    """LocalNotifier
+
+    In-process pub/sub, wakes requests waiting in the same process only.
+    Fallback for single process deployments and tests.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters: Dict[str, List[threading.Event]] = defaultdict(list)
+
+    def publish(self, token: str):
+        with self._lock:
+            waiters = self._waiters.pop(token, [])
+        for event in waiters:
+            event.set()
+
+    def subscribe(self, token: str) -> threading.Event:
+        """Returns event set on the next ``publish`` of token, subscribe before reading status to not miss it"""
+        event = threading.Event()
+        with self._lock:
+            self._waiters[token].append(event)
+        return event
+
+    def unsubscribe(self, token: str, event: threading.Event):
+        with self._lock:
+            waiters = self._waiters.get(token, [])
+            if event in waiters:
+                waiters.remove(event)
+            if not waiters:
+                self._waiters.pop(token, None)
+
+
+class PostgresNotifier(LocalNotifier):
+    """PostgresNotifier
+
+    Status changes are sent with ``NOTIFY`` and delivered on commit to every process,
+    each process keeps one listening connection dispatching notifications to its local waiters.
+
+    Args:
+        channel (str, optional): Notification channel. Defaults to "drf_payments_status".
+        using (str, optional): Database alias. Defaults to "default".
+    """
+
+    def __init__(self, channel: str = "drf_payments_status", using: str = "default"):
+        super().__init__()
+        self.channel = channel
+        self.using = using
+        self._listener = None
+        self._pid = None
+
+    def publish(self, token: str):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [self.channel, token])
+
+    def subscribe(self, token: str) -> threading.Event:
+        self._ensure_listener()
+        return super().subscribe(token)
+
+    def _ensure_listener(self):
+        with self._lock:
+            if self._listener is not None and self._listener.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._listener = threading.Thread(target=self._listen, name="drf_payments_notify", daemon=True)
+            self._listener.start()
+
+    def _listen(self):
+        wrapper = connections[self.using]
+        connection = wrapper.get_new_connection(wrapper.get_connection_params())
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute(f'LISTEN "{self.channel}"')
+            while True:
+                select.select([connection], [], [], 60)
+                # * psycopg2 collects notifications on poll, psycopg 3 yields them from generator
+                if hasattr(connection, "poll"):
+                    connection.poll()
+                    notifies, connection.notifies[:] = list(connection.notifies), []
+                else:
+                    notifies = list(connection.notifies(timeout=0))
+                for notify in notifies:
+                    LocalNotifier.publish(self, notify.payload)
+        except Exception:
+            logger.exception("Payment status listener stopped")
+        finally:
+            connection.close()
+
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+
+def get_notifier() -> LocalNotifier:
+    """Returns process wide notifier configured in ``PAYMENT_STATUS_NOTIFIER``, ``LocalNotifier`` by default"""
+    global _notifier
+    if _notifier is None:
+        with _notifier_lock:
+            if _notifier is None:
+                _notifier = import_string(
+                    getattr(settings, "PAYMENT_STATUS_NOTIFIER", "drf_payments.notifications.LocalNotifier"),
+                )()
+    return _notifier
+
+
+def notify(tokens: Iterable[str]):
+    """notify
+
+    Wake requests waiting for status of payments once current transaction commits,
+    status changed with ``QuerySet.update`` does not send ``status_changed`` and must be notified explicitly
+
+    Args:
+        tokens (list): Payment tokens
+    """
+    tokens = [token for token in tokens if token]
+    if tokens:
+        transaction.on_commit(lambda: [get_notifier().publish(token) for token in tokens])
+
+
+@receiver(status_changed)
+def publish_status_change(sender, payment, **kwargs):
+    notify([payment.token])
@@ -0,0 +1,246 @@
+import re
+from datetime import date, datetime, timedelta
+from datetime import timezone as dt_timezone
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, router
+from django.db.migrations.operations.base import Operation
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from drf_payments import get_payment_model
+
+_PARTITION_SUFFIX = re.compile(r"_p(\d{4})(\d{2})$")
+
+
+def add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def month_range(day: date) -> Tuple[date, date]:
+    """First day of month of ``day`` and first day of the next month, bounds of monthly partition"""
+    start = date(day.year, day.month, 1)
+    return start, add_months(start, 1)
+
+
+def partition_name(table: str, start: date) -> str:
+    return f"{table}_p{start:%Y%m}"
+
+
+def _connection(model):
+    connection = connections[router.db_for_write(model)]
+    if connection.vendor != "postgresql":
+        raise ImproperlyConfigured("Payment partitioning requires PostgreSQL")
+    return connection
+
+
+class PartitionByCreated(Operation):
+    """PartitionByCreated
+
+    Convert payment table to table partitioned by monthly ranges of ``created``.
+    Existing table becomes partition of the current month holding all older rows as well,
+    the following months are added by ``create_payment_partitions``.
+    Primary key becomes ``(id, created)``, foreign keys to payment table must be dropped before.
+    Does nothing on other databases than PostgreSQL.
+
+    ```python
+    operations = [PartitionByCreated("payment")]
+    ```
+
+    Args:
+        model_name (str): Payment model name
+    """
+
+    reversible = False
+    reduces_to_sql = True
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+
+    def deconstruct(self):
+        return self.__class__.__name__, [self.model_name], {}
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != "postgresql":
+            return
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        quote = schema_editor.quote_name
+        table = model._meta.db_table
+        pk = model._meta.pk.column
+        created = model._meta.get_field("created").column
+        current, upper = month_range(timezone.now().date())
+        legacy = partition_name(table, current)
+        schema_editor.execute(f"ALTER TABLE {quote(table)} RENAME TO {quote(legacy)}")
+        schema_editor.execute(
+            f"CREATE TABLE {quote(table)} (LIKE {quote(legacy)} INCLUDING DEFAULTS INCLUDING IDENTITY"
+            f" INCLUDING CONSTRAINTS INCLUDING STORAGE INCLUDING COMMENTS) PARTITION BY RANGE ({quote(created)})",
+        )
+        schema_editor.execute(f"ALTER TABLE {quote(table)} ADD PRIMARY KEY ({quote(pk)}, {quote(created)})")
+        # * New identity sequence continues after existing rows
+        schema_editor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, %s), (SELECT COALESCE(MAX({quote(pk)}), 0) + 1"
+            f" FROM {quote(legacy)}), false)",
+            [table, pk],
+        )
+        schema_editor.execute(
+            f"ALTER TABLE {quote(table)} ATTACH PARTITION {quote(legacy)} FOR VALUES FROM (MINVALUE) TO (%s)",
+            [_bound(upper)],
+        )
+        # * Indexes of partitioned table are created on every partition, equal indexes of old table are reused
+        for field in model._meta.local_fields:
+            if field.db_index and not field.unique and not field.primary_key:
+                column = field.column
+                schema_editor.execute(
+                    f"CREATE INDEX {quote(f'{table}_{column}_part_idx')} ON {quote(table)} ({quote(column)})",
+                )
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        raise NotImplementedError("Partitioned payment table can't be converted back")
+
+    def describe(self):
+        return f"Partition {self.model_name} by range of created"
+
+    @property
+    def migration_name_fragment(self):
+        return f"partition_{self.model_name.lower()}"
+
+
+def list_partitions(model=None) -> List[Tuple[str, date]]:
+    """Monthly partitions of payment table as ``(name, first day)`` ordered by month"""
+    model = model or get_payment_model()
+    with _connection(model).cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s",
+            [model._meta.db_table],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = []
+    for name in names:
+        if match := _PARTITION_SUFFIX.search(name):
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def create_partitions(months_ahead: int = 3, start: Optional[date] = None, model=None) -> List[str]:
+    """create_partitions
+
+    Create monthly partitions from month of ``start`` up to ``months_ahead`` following months, existing are kept
+
+    Args:
+        months_ahead (int, optional): Months after current to prepare. Defaults to 3.
+        start (date, optional): First month, current month by default
+        model (Model, optional): Partitioned model, payment model by default
+
+    Returns:
+        list: Names of created partitions
+    """
+    model = model or get_payment_model()
+    connection = _connection(model)
+    quote = connection.ops.quote_name
+    table = model._meta.db_table
+    first, _ = month_range(start or timezone.now().date())
+    existing = {name for name, _ in list_partitions(model)}
+    created = []
+    with connection.cursor() as cursor:
+        for offset in range(months_ahead + 1):
+            lower = add_months(first, offset)
+            name = partition_name(table, lower)
+            if name in existing:
+                continue
+            cursor.execute(
+                f"CREATE TABLE {quote(name)} PARTITION OF {quote(table)} FOR VALUES FROM (%s) TO (%s)",
+                [_bound(lower), _bound(add_months(lower, 1))],
+            )
+            created.append(name)
+    return created
+
+
+def detach_partitions(
+    older_than_months: int,
+    archive_schema: Optional[str] = None,
+    drop: bool = False,
+    model=None,
+) -> List[str]:
+    """detach_partitions
+
+    Detach monthly partitions ending ``older_than_months`` months ago or earlier, retention without ``DELETE``.
+    Detached table is kept as is, moved to ``archive_schema`` or dropped.
+
+    Args:
+        older_than_months (int): Months of data to keep including current
+        archive_schema (str, optional): Schema detached tables are moved to
+        drop (bool, optional): Drop detached tables. Defaults to False.
+        model (Model, optional): Partitioned model, payment model by default
+
+    Returns:
+        list: Names of detached partitions
+    """
+    model = model or get_payment_model()
+    connection = _connection(model)
+    quote = connection.ops.quote_name
+    table = model._meta.db_table
+    cutoff = add_months(month_range(timezone.now().date())[0], -older_than_months + 1)
+    detached = []
+    with connection.cursor() as cursor:
+        for name, lower in list_partitions(model):
+            if add_months(lower, 1) > cutoff:
+                break
+            cursor.execute(f"ALTER TABLE {quote(table)} DETACH PARTITION {quote(name)}")
+            if drop:
+                cursor.execute(f"DROP TABLE {quote(name)}")
+            elif archive_schema:
+                cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {quote(archive_schema)}")
+                cursor.execute(f"ALTER TABLE {quote(name)} SET SCHEMA {quote(archive_schema)}")
+            detached.append(name)
+    return detached
+
+
+def _bound(day: date) -> datetime:
+    # * Bounds are UTC midnights, the same as ``created`` stored with ``USE_TZ``
+    return datetime(day.year, day.month, day.day, tzinfo=dt_timezone.utc if settings.USE_TZ else None)
+
+
+def filter_created(queryset, params):
+    """filter_created
+
+    Bound queryset by ``created_after``/``created_before`` parameters (ISO date or datetime),
+    so PostgreSQL scans only partitions of the range. Without ``created_after``
+    the last ``PAYMENT_LIST_WINDOW_DAYS`` are returned when set.
+
+    Args:
+        queryset (QuerySet): Payments queryset
+        params (dict): Request query parameters
+    """
+    after, before = params.get("created_after"), params.get("created_before")
+    if after:
+        queryset = queryset.filter(created__gte=_parse_moment(after, "created_after"))
+    elif (window := getattr(settings, "PAYMENT_LIST_WINDOW_DAYS", None)) is not None:
+        queryset = queryset.filter(created__gte=timezone.now() - timedelta(days=window))
+    if before:
+        queryset = queryset.filter(created__lt=_parse_moment(before, "created_before"))
+    return queryset
+
+
+def _parse_moment(value: str, name: str) -> datetime:
+    try:
+        moment = parse_datetime(value)
+        if moment is None and (day := parse_date(value)) is not None:
+            moment = datetime(day.year, day.month, day.day)
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise ValidationError({name: "Enter a valid date or datetime"})
+    if settings.USE_TZ and timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
@@ -1,10 +1,35 @@
 import base64
+import time
+from datetime import timezone as dt_timezone
+from typing import Dict, Tuple
 
 import requests
 from django.conf import settings
 
 from drf_payments.constants import PaymentError, PaymentStatus
 from drf_payments.core import BasicProvider
+from drf_payments.http import get_session
+from drf_payments.idempotency import idempotency_key, is_rejection, rotate_idempotency_key
+from drf_payments.ratelimit import rate_limited
+from drf_payments.references import AUTHORIZATION, CAPTURE, lookup, remember
+
+#: Access tokens by ``(endpoint, client_id)`` with monotonic expiration time.
+#: Tokens are plain data, forked workers keep using tokens fetched by parent process
+TOKEN_CACHE: Dict[Tuple[str, str], Tuple[str, float]] = {}
+#: Token is refreshed this many seconds before PayPal expires it
+TOKEN_EXPIRY_MARGIN = 60
+
+
+def _has_issue(resp: dict, issue: str) -> bool:
+    return any(detail.get("issue") == issue for detail in resp.get("details", []))
+
+
+def _first_id(order: dict, kind: str):
+    """Id of the first ``captures`` or ``authorizations`` item of order"""
+    for unit in order.get("purchase_units", []):
+        for item in unit.get("payments", {}).get(kind, []):
+            return item.get("id")
+    return None
 
 
 class PaypalProvider(BasicProvider):
@@ -23,14 +48,17 @@ class PaypalProvider(BasicProvider):
         client_id (string): Your paypal client_id
         secret_key (string): Your paypal secret_key
         endpoint (url): Paypal endpoint sanbox or production
+        webhook_id (string, optional): Id of webhook, events are verified when set
     """
 
-    def __init__(self, client_id, secret_key, endpoint, **kwargs):
+    def __init__(self, client_id, secret_key, endpoint, webhook_id=None, **kwargs):
         super().__init__(**kwargs)
         self.client_id = client_id
         self.secret_key = secret_key
         self.endpoint = endpoint
+        self.webhook_id = webhook_id
 
+    @rate_limited("process_payment")
     def process_payment(self, payment):
         """process_payment
 
@@ -44,7 +72,7 @@ class PaypalProvider(BasicProvider):
             raise PaymentError("This payment has already been processed.")
         token = self._create_token()
         payload = {
-            "intent": "CAPTURE",
+            "intent": "CAPTURE" if self._capture else "AUTHORIZE",
             "application_context": {
                 "return_url": settings.PAYMENT_SUCCESS_URL,
                 "cancel_url": settings.PAYMENT_FAILURE_URL,
@@ -58,17 +86,85 @@ class PaypalProvider(BasicProvider):
                 },
             ],
         }
-        try:
-            resp = requests.post(
-                f"{self.endpoint}/v2/checkout/orders",
-                headers={"Authorization": f"Bearer {token}"},
-                json=payload,
-            ).json()
-        except requests.exceptions.RequestException as e:
-            raise PaymentError(e) from e
+        resp = self._mutate(
+            payment,
+            "process_payment",
+            "/v2/checkout/orders",
+            token,
+            payload,
+            "Can't process payment",
+            "process_failed",
+            key="id",
+        )
         payment.transaction_id = resp.get("id")
         payment.extra_data["order"] = resp
         payment.save(update_fields=["extra_data", "transaction_id"])
+        remember(payment, "paypal", order=resp.get("id"))
+
+    def _mutate(self, payment, operation, path, token, payload, message, code, key="status", issue=None):
+        """_mutate
+
+        Send payment mutation with its idempotency key and return decoded response.
+        Definite rejection gets new idempotency key for the next attempt, PayPal replays it for the same request id.
+        Connection errors, server errors and undecodable responses keep the key, operation may have reached PayPal,
+        and are retryable.
+
+        Args:
+            payment (payment): Your payment instance
+            operation (str): Idempotency key operation
+            path (str): API path
+            token (str): Access token
+            payload (dict): Request body
+            message (str): Error message
+            code (str): Error code of rejection
+            key (str, optional): Field of successful response. Defaults to "status".
+            issue (str, optional): Issue meaning operation was done by previous attempt, ``None`` is returned for it
+
+        Raises:
+            PaymentError: PayPal rejected operation or is unavailable
+        """
+        try:
+            response = self._send(path, token, payload, idempotency_key(payment, operation))
+            # * Edge proxies answer 5xx with html, undecodable body is as ambiguous as connection error
+            resp = response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            raise PaymentError(e, code="gateway_unavailable") from e
+        if resp.get(key):
+            return resp
+        if issue and _has_issue(resp, issue):
+            return None
+        if not is_rejection(response.status_code):
+            raise PaymentError(message, code="gateway_unavailable", gateway_message=resp.get("message"))
+        rotate_idempotency_key(payment, operation)
+        raise PaymentError(message, code=code, gateway_message=resp.get("message"))
+
+    def _send(self, path, token, payload, request_id=None) -> requests.Response:
+        """_send
+
+        Send authorized request to PayPal API, mutations are sent with ``PayPal-Request-Id``
+        so they are retried without being applied twice
+
+        Args:
+            path (str): API path
+            token (str): Access token
+            payload (dict): Request body
+            request_id (str, optional): Idempotency key of the mutation
+        """
+        headers = {"Authorization": f"Bearer {token}"}
+        if request_id:
+            headers["PayPal-Request-Id"] = request_id
+        return get_session("paypal", retry_post=True).post(f"{self.endpoint}{path}", headers=headers, json=payload)
+
+    def _get_order(self, payment, token) -> dict:
+        """Current state of payment order"""
+        return (
+            get_session("paypal", retry_post=True)
+            .get(
+                f"{self.endpoint}/v2/checkout/orders/{payment.transaction_id}",
+                headers={"Authorization": f"Bearer {token}"},
+            )
+            .json()
+        )
 
     def _create_token(self) -> str:
         """_create_token
@@ -78,21 +174,58 @@ class PaypalProvider(BasicProvider):
         Returns:
             str: _description_
         """
+        key = (self.endpoint, self.client_id)
+        cached = TOKEN_CACHE.get(key)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
         token = base64.b64encode(f"{self.client_id}:{self.secret_key}".encode("utf-8")).decode("utf-8")
-
-        if access_token := (
-            requests.post(
+        resp = (
+            get_session("paypal", retry_post=True)
+            .post(
                 f"{self.endpoint}/v1/oauth2/token",
                 data={"grant_type": "client_credentials"},
                 headers={"Authorization": f"Basic {token}"},
             )
             .json()
-            .get("access_token")
-        ):
+        )
+        if access_token := resp.get("access_token"):
+            # * Token is reused until it expires, response without expiration is not cached
+            if expires_in := resp.get("expires_in"):
+                TOKEN_CACHE[key] = (access_token, time.monotonic() + expires_in - TOKEN_EXPIRY_MARGIN)
             return access_token
         else:
             raise PaymentError("Can't create token")
 
+    def warmup(self):
+        """warmup
+
+        Open pooled connection to PayPal and fetch access token before first payment
+        """
+        self._create_token()
+
+    def list_events(self, since):
+        """list_events
+
+        Iterate ``CHECKOUT.ORDER.APPROVED`` events sent since ``since`` following ``next`` links
+
+        Args:
+            since (datetime): Oldest event creation time
+        """
+        url = f"{self.endpoint}/v1/notifications/webhooks-events"
+        params = {
+            "start_time": since.astimezone(dt_timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "event_type": "CHECKOUT.ORDER.APPROVED",
+            "page_size": 300,
+        }
+        while url:
+            headers = {"Authorization": f"Bearer {self._create_token()}"}
+            resp = get_session("paypal", retry_post=True).get(url, headers=headers, params=params).json()
+            yield from resp.get("events", [])
+            url = next((link["href"] for link in resp.get("links", []) if link.get("rel") == "next"), None)
+            # * Next link carries query of the following page
+            params = None
+
+    @rate_limited("refund")
     def refund(self, payment, amount=None):
         """refund
 
@@ -104,34 +237,122 @@ class PaypalProvider(BasicProvider):
 
         """
         if payment.status == PaymentStatus.CONFIRMED.name:
-            try:
-                capture = payment.extra_data["order"]["purchase_units"][0]["payments"]["captures"][0]["id"]
-            except (IndexError, KeyError) as e:
-                raise PaymentError("Can't Refund, payment has not been captured yet") from e
+            # * Payments captured before identifiers were indexed keep capture in extra_data only,
+            # * capture of authorization is kept apart from order
+            capture = (
+                lookup(payment, "paypal", CAPTURE)
+                or payment.extra_data.get("capture", {}).get("id")
+                or _first_id(payment.extra_data.get("order", {}), "captures")
+            )
+            if not capture:
+                raise PaymentError("Can't Refund, payment has not been captured yet")
             token = self._create_token()
-            resp = requests.post(
-                f"{self.endpoint}/v2/payments/captures/{capture}/refund",
-                headers={"Authorization": f"Bearer {token}"},
-                json={},
-            ).json()
+            resp = self._mutate(
+                payment,
+                "refund",
+                f"/v2/payments/captures/{capture}/refund",
+                token,
+                {},
+                "Can't refund payment",
+                "refund_failed",
+                key="id",
+            )
             payment.extra_data["order"] = resp
             payment.save(update_fields=["extra_data"])
+            remember(payment, "paypal", refund=resp.get("id"))
             return
         raise PaymentError("Only Confirmed payments can be refunded")
 
-    def capture(self, payment):
+    @rate_limited("capture")
+    def capture(self, payment, amount=None):
         """capture
 
-        Upon successful checkout we will capture funds to finalize payment and have ability to refund
+        Upon successful checkout we will capture funds to finalize payment and have ability to refund.
+        Order created with ``capture=False`` is captured from its authorization, ``amount`` can be partial.
 
         Args:
             payment (payment): Your payment
+            amount (decimal, optional): Amount to capture from authorization. Defaults to None.
+
+        Raises:
+            PaymentError: PayPal rejected capture
+        """
+        if not self._capture:
+            return self._capture_authorization(payment, amount)
+        token = self._create_token()
+        resp = self._mutate(
+            payment,
+            "capture",
+            f"/v2/checkout/orders/{payment.transaction_id}/capture",
+            token,
+            {},
+            "Can't capture payment",
+            "capture_failed",
+            issue="ORDER_ALREADY_CAPTURED",
+        )
+        if resp is None:
+            # * Order captured by previous attempt which response was lost, capture is read from order
+            resp = self._get_order(payment, token)
+        payment.extra_data["order"] = resp
+        payment.captured_amount = payment.total
+        payment.save(update_fields=["extra_data", "captured_amount"])
+        remember(payment, "paypal", capture=_first_id(resp, "captures"))
+
+    @rate_limited("authorize")
+    def authorize(self, payment):
+        """authorize
+
+        Authorize order approved by buyer when provider is configured with ``capture=False``
+
+        Args:
+            payment (payment): Your payment
+
+        Raises:
+            PaymentError: PayPal rejected authorization
         """
         token = self._create_token()
-        resp = requests.post(
-            f"{self.endpoint}/v2/checkout/orders/{payment.transaction_id}/capture",
-            headers={"Authorization": f"Bearer {token}"},
-            json={},
-        ).json()
+        resp = self._mutate(
+            payment,
+            "authorize",
+            f"/v2/checkout/orders/{payment.transaction_id}/authorize",
+            token,
+            {},
+            "Can't authorize payment",
+            "authorize_failed",
+            issue="ORDER_ALREADY_AUTHORIZED",
+        )
+        if resp is None:
+            # * Order authorized by previous attempt which response was lost, authorization is read from order
+            resp = self._get_order(payment, token)
         payment.extra_data["order"] = resp
-        payment.save(update_fields=["extra_data"])
+        payment.status = PaymentStatus.PREAUTH.name
+        payment.save(update_fields=["extra_data", "status"])
+        remember(payment, "paypal", authorization=_first_id(resp, "authorizations"))
+
+    def _capture_authorization(self, payment, amount=None):
+        if payment.status != PaymentStatus.PREAUTH.name:
+            raise PaymentError("Only pre-authorized payments can be captured")
+        authorization = lookup(payment, "paypal", AUTHORIZATION) or _first_id(
+            payment.extra_data.get("order", {}),
+            "authorizations",
+        )
+        if not authorization:
+            raise PaymentError("Can't capture, payment has not been authorized yet")
+        payload = {"final_capture": True}
+        if amount is not None:
+            payload["amount"] = {"currency_code": payment.currency, "value": str(amount)}
+        token = self._create_token()
+        resp = self._mutate(
+            payment,
+            "capture",
+            f"/v2/payments/authorizations/{authorization}/capture",
+            token,
+            payload,
+            "Can't capture payment",
+            "capture_failed",
+        )
+        payment.extra_data["capture"] = resp
+        payment.captured_amount = amount if amount is not None else payment.total
+        payment.status = PaymentStatus.CONFIRMED.name
+        payment.save(update_fields=["extra_data", "captured_amount", "status"])
+        remember(payment, "paypal", capture=resp.get("id"))
@@ -0,0 +1,92 @@
+import functools
+import logging
+import math
+import time
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+
+from drf_payments.constants import PaymentError
+from drf_payments.signals import rate_limit_waited
+
+logger = logging.getLogger(__name__)
+
+
+def get_limit(variant: str, operation: str) -> Tuple[Optional[str], Optional[float]]:
+    """get_limit
+
+    Returns bucket name and allowed calls per second for gateway operation.
+    ``PAYMENT_RATE_LIMITS`` is looked up by ``"<variant>.<operation>"`` first, then by ``"<variant>"``.
+
+    Args:
+        variant (str): Payment variant
+        operation (str): Provider operation
+    """
+    limits = getattr(settings, "PAYMENT_RATE_LIMITS", {})
+    for bucket in (f"{variant}.{operation}", variant):
+        if bucket in limits:
+            return bucket, limits[bucket]
+    return None, None
+
+
+def acquire(variant: str, operation: str) -> float:
+    """acquire
+
+    Wait for a free slot of the gateway limit shared by all processes using the same cache.
+    Time is split into windows allowing ``rate * window`` calls, every caller atomically reserves a slot
+    (``cache.incr``) in the first window with free capacity and sleeps until the window starts.
+    When no slot is free within ``PAYMENT_RATE_LIMIT_MAX_WAIT`` seconds ``PaymentError`` is raised.
+
+    Args:
+        variant (str): Payment variant
+        operation (str): Provider operation
+
+    Returns:
+        float: Seconds waited
+    """
+    bucket, rate = get_limit(variant, operation)
+    if not rate:
+        return 0
+    cache = caches[getattr(settings, "PAYMENT_RATE_LIMIT_CACHE", "default")]
+    window = getattr(settings, "PAYMENT_RATE_LIMIT_WINDOW", 1)
+    max_wait = getattr(settings, "PAYMENT_RATE_LIMIT_MAX_WAIT", 10)
+    allowed = max(1, int(rate * window))
+    now = time.time()
+    for slot in range(int(now // window), int((now + max_wait) // window) + 1):
+        key = f"drf_payments:ratelimit:{bucket}:{slot}"
+        cache.add(key, 0, timeout=math.ceil(max_wait + 2 * window))
+        try:
+            reserved = cache.incr(key)
+        except ValueError:
+            # * Key was evicted between add and incr
+            cache.add(key, 1, timeout=math.ceil(max_wait + 2 * window))
+            reserved = 1
+        if reserved <= allowed:
+            waited = max(0.0, slot * window - now)
+            if waited:
+                time.sleep(waited)
+                logger.debug("Rate limited %s.%s for %.3fs", variant, operation, waited)
+            rate_limit_waited.send(sender=None, variant=variant, operation=operation, waited=waited)
+            return waited
+    raise PaymentError(f"Rate limit of {bucket} exceeded", code="rate_limited")
+
+
+def rate_limited(operation: str):
+    """rate_limited
+
+    Decorator pacing provider method with limit configured for provider variant
+
+    Args:
+        operation (str): Operation name used in ``PAYMENT_RATE_LIMITS``
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            acquire(self.variant, operation)
+            return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,92 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.db.models import Q
+
+#: Identifier kinds recorded by providers
+SESSION = "session"
+INTENT = "intent"
+CHARGE = "charge"
+ORDER = "order"
+AUTHORIZATION = "authorization"
+CAPTURE = "capture"
+REFUND = "refund"
+TRANSACTION = "transaction"
+
+
+def remember(payment, gateway: str, **identifiers):
+    """remember
+
+    Index gateway identifiers of payment, empty identifiers are skipped and known ones are kept
+
+    ```python
+    remember(payment, "stripe", session=session["id"], intent=session["payment_intent"])
+    ```
+
+    Args:
+        payment (payment): Payment instance
+        gateway (str): Gateway identifiers belong to, e.g. ``stripe``
+        identifiers: Identifier by kind
+    """
+    save((payment.pk, gateway, kind, reference) for kind, reference in identifiers.items())
+
+
+def save(rows: Iterable[Tuple[object, str, str, Optional[str]]]):
+    """save
+
+    Index many identifiers with one insert
+
+    Args:
+        rows (list): ``(payment_pk, gateway, kind, reference)`` tuples, empty references are skipped
+    """
+    from drf_payments.models import PaymentReference
+
+    references = {}
+    for payment_pk, gateway, kind, reference in rows:
+        if reference:
+            references[(gateway, str(reference))] = PaymentReference(
+                gateway=gateway,
+                kind=kind,
+                reference=str(reference),
+                payment_id=str(payment_pk),
+            )
+    # * Identifier belongs to one payment forever, conflicts are repeated deliveries
+    PaymentReference.objects.bulk_create(references.values(), ignore_conflicts=True)
+
+
+def resolve(references: Iterable[Tuple[str, Optional[str]]]) -> Dict[Tuple[str, str], str]:
+    """resolve
+
+    Payment primary keys of gateway identifiers with one indexed lookup
+
+    Args:
+        references (list): ``(gateway, reference)`` tuples
+
+    Returns:
+        dict: Payment pk by ``(gateway, reference)``, unknown identifiers are missing
+    """
+    from drf_payments.models import PaymentReference
+
+    by_gateway = {}
+    for gateway, reference in references:
+        if reference:
+            by_gateway.setdefault(gateway, set()).add(str(reference))
+    if not by_gateway:
+        return {}
+    # * ``(gateway, reference)`` unique index serves every branch
+    lookup = Q()
+    for gateway, gateway_references in by_gateway.items():
+        lookup |= Q(gateway=gateway, reference__in=gateway_references)
+    rows = PaymentReference.objects.filter(lookup).values_list("gateway", "reference", "payment_id")
+    return {(gateway, reference): pk for gateway, reference, pk in rows}
+
+
+def lookup(payment, gateway: str, kind: str) -> Optional[str]:
+    """Latest identifier of ``kind`` recorded for payment"""
+    from drf_payments.models import PaymentReference
+
+    return (
+        PaymentReference.objects.filter(payment_id=str(payment.pk), gateway=gateway, kind=kind)
+        .order_by("-pk")
+        .values_list("reference", flat=True)
+        .first()
+    )
@@ -0,0 +1,120 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from drf_payments import get_payment_model
+
+#: Cookie holding time until which client reads from primary
+PIN_COOKIE = "drf_payments_pin"
+
+_replica_reads: ContextVar[bool] = ContextVar("drf_payments_replica_reads", default=False)
+# * Mutable request state, writes made in threads running with copied context are still seen by middleware
+_request: ContextVar[Optional[dict]] = ContextVar("drf_payments_request", default=None)
+
+
+def _replicas():
+    return getattr(settings, "PAYMENT_READ_REPLICAS", [])
+
+
+@contextmanager
+def replica_reads():
+    """replica_reads
+
+    Payment reads inside the block go to ``PAYMENT_READ_REPLICAS`` unless current request is pinned to primary.
+    Use for lists, exports and reports tolerating replication lag.
+
+    ```python
+    with replica_reads():
+        rows = list(Payment.objects.filter(created__gte=since).values("status", "total"))
+    ```
+    """
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def pin():
+    """Send payment reads of current request to primary and pin client for the next requests"""
+    if (state := _request.get()) is not None:
+        state["pinned"] = state["wrote"] = True
+
+
+def is_pinned() -> bool:
+    return bool((state := _request.get()) and state["pinned"])
+
+
+class PaymentReplicaRouter:
+    """PaymentReplicaRouter
+
+    Routes payment reads inside ``replica_reads`` to random replica,
+    reads of request which wrote payment (or whose client did recently) stay on primary
+
+    ```python
+    DATABASE_ROUTERS = ["drf_payments.routers.PaymentReplicaRouter"]
+    PAYMENT_READ_REPLICAS = ["replica"]
+    ```
+    """
+
+    def db_for_read(self, model, **hints):
+        if model is not get_payment_model() or not _replica_reads.get() or is_pinned():
+            return None
+        if replicas := _replicas():
+            return random.choice(replicas)
+        return None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # * Replicas hold the same data as primary
+        databases = {"default", *_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in _replicas():
+            return False
+        return None
+
+
+class PaymentReplicaMiddleware:
+    """PaymentReplicaMiddleware
+
+    Keeps read-your-writes across requests, client which wrote payment reads from primary
+    for ``PAYMENT_REPLICA_PIN_SECONDS`` (remembered in cookie)
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            pinned_until = float(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        state = {"pinned": pinned_until > time.time(), "wrote": False}
+        token = _request.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request.reset(token)
+        if state["wrote"]:
+            window = getattr(settings, "PAYMENT_REPLICA_PIN_SECONDS", 5)
+            response.set_cookie(PIN_COOKIE, str(time.time() + window), max_age=window, httponly=True)
+        return response
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def pin_on_write(sender, **kwargs):
+    if sender is get_payment_model():
+        pin()
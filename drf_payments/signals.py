@@ -0,0 +1,7 @@
+from django.dispatch import Signal
+
+#: Gateway call waited for rate limiter, sent with ``variant``, ``operation`` and ``waited`` seconds
+rate_limit_waited = Signal()
+
+#: Payment status was saved with new value, sent with ``payment`` and ``previous`` status (``None`` for new payment)
+status_changed = Signal()
@@ -0,0 +1,100 @@
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from drf_payments import get_payment_model
+from drf_payments.fields import CompressedJSONField
+from drf_payments.models import BasePayment
+
+#: Payment fields projection is built from, saving any of them invalidates cached projection
+SOURCE_FIELDS = ("token", "status", "fraud_status", "captured_amount", "extra_data")
+
+# * Checkout urls are read with json key transforms, the rest of ``extra_data`` is not loaded
+_URL_LOOKUPS = ("extra_data__session__url", "extra_data__order__links__1__href")
+
+
+def _urls(extra_data: dict) -> dict:
+    links = extra_data.get("order", {}).get("links", [])
+    return {
+        "extra_data__session__url": extra_data.get("session", {}).get("url"),
+        "extra_data__order__links__1__href": links[1].get("href") if len(links) > 1 else None,
+    }
+
+
+def _cache():
+    return caches[getattr(settings, "PAYMENT_STATUS_CACHE", "default")]
+
+
+def _key(kind: str, value) -> str:
+    return f"drf_payments:status:{kind}:{value}"
+
+
+def get_status(token: Optional[str] = None, pk=None) -> Optional[dict]:
+    """get_status
+
+    Compact status projection of payment (token, status, fraud_status, captured_amount, url, modified)
+    read through cache, ``None`` if payment does not exist
+
+    Args:
+        token (str, optional): Payment token
+        pk (optional): Payment primary key, used when token is not given
+    """
+    key = _key("token", token) if token is not None else _key("pk", pk)
+    data = _cache().get(key)
+    if data is not None:
+        return data
+    lookup = {"token": token} if token is not None else {"pk": pk}
+    model = get_payment_model()
+    # * Cached projection is read from primary, replica may lag behind the invalidating transition
+    # * Compressed extra_data can't be looked into by database, it's loaded and read here
+    compressed = isinstance(model._meta.get_field("extra_data"), CompressedJSONField)
+    url_lookups = ("extra_data",) if compressed else _URL_LOOKUPS
+    row = (
+        model.objects.db_manager(router.db_for_write(model))
+        .filter(**lookup)
+        .values("pk", "token", "status", "fraud_status", "captured_amount", "modified", *url_lookups)
+        .first()
+    )
+    if row is None:
+        return None
+    if compressed:
+        row.update(_urls(row.pop("extra_data")))
+    data = {
+        "token": row["token"],
+        "status": row["status"],
+        "fraud_status": row["fraud_status"],
+        "captured_amount": row["captured_amount"],
+        "url": next((row[lookup] for lookup in _URL_LOOKUPS if row.get(lookup)), None),
+        "modified": row["modified"],
+    }
+    _cache().set(key, data, getattr(settings, "PAYMENT_STATUS_CACHE_TIMEOUT", 300))
+    return data
+
+
+def invalidate(pks: Iterable = (), tokens: Iterable[str] = ()):
+    """invalidate
+
+    Drop cached projections now and once current transaction commits,
+    so reader can't cache status of not yet committed transaction for long.
+    ``QuerySet.update`` of source fields must be followed by explicit call.
+
+    Args:
+        pks (list, optional): Payment primary keys
+        tokens (list, optional): Payment tokens
+    """
+    keys = [_key("pk", pk) for pk in pks] + [_key("token", token) for token in tokens if token]
+    if keys:
+        _cache().delete_many(keys)
+        transaction.on_commit(lambda: _cache().delete_many(keys))
+
+
+@receiver(post_save)
+def invalidate_saved_payment(sender, instance, update_fields=None, **kwargs):
+    if not isinstance(instance, BasePayment):
+        return
+    if update_fields is None or set(update_fields) & set(SOURCE_FIELDS):
+        invalidate(pks=[instance.pk], tokens=[instance.token])
@@ -1,10 +1,18 @@
+import importlib
+import os
 from dataclasses import asdict, dataclass, field
 from typing import Optional
 
 import stripe
 
+from .. import deadline
+from ..codec import dumps, loads
 from ..constants import PaymentError, PaymentStatus
 from ..core import BasicProvider
+from ..http import DeadlineSession
+from ..idempotency import idempotency_key, is_rejection, max_network_retries, rotate_idempotency_key
+from ..ratelimit import rate_limited
+from ..references import INTENT, lookup, remember
 
 
 def convert_amount(currency, amount) -> int:
@@ -23,6 +31,135 @@ def convert_amount(currency, amount) -> int:
     return int(amount * factor)
 
 
+_http_client = None
+
+
+def default_http_client():
+    """default_http_client
+
+    Returns http client shared by all stripe requests of the process, creating it if needed
+    """
+    global _http_client
+    if stripe.default_http_client is None:
+        # * Module was made private in newer SDK versions
+        module = getattr(stripe, "http_client", None) or importlib.import_module("stripe._http_client")
+        # * SDK retries on its own, deadline session only caps timeout of every attempt
+        stripe.default_http_client = _http_client = module.RequestsClient(
+            timeout=deadline.default_timeout(),
+            session=DeadlineSession(),
+        )
+    return stripe.default_http_client
+
+
+def _reset_http_client():
+    """Drop http client created by this module in forked child, client configured by project is kept"""
+    global _http_client
+    if _http_client is not None and stripe.default_http_client is _http_client:
+        stripe.default_http_client = None
+    _http_client = None
+
+
+if hasattr(os, "register_at_fork"):  # pragma no branch
+    os.register_at_fork(after_in_child=_reset_http_client)
+
+
+def configure(secret_key):
+    """configure
+
+    Configure SDK for the next request, failed requests are retried by SDK with the same idempotency key.
+    Requests are made by deadline aware http client unless project set its own ``stripe.default_http_client``.
+
+    Args:
+        secret_key (string): Your stripe secret_key
+    """
+    stripe.api_key = secret_key
+    stripe.max_network_retries = max_network_retries()
+    default_http_client()
+
+
+def gateway_error(payment, operation, error) -> PaymentError:
+    """gateway_error
+
+    Wrap stripe error, definitely rejected operation gets new idempotency key for the next attempt.
+    Connection and server errors keep the key, operation may have reached Stripe, and are retryable.
+
+    Args:
+        payment (payment): Your payment instance
+        operation (str): Failed operation
+        error (StripeError): Stripe SDK error
+    """
+    if deadline.expired():
+        return PaymentError(f"Deadline exceeded: {error}", code="deadline_exceeded")
+    if isinstance(error, stripe.error.CardError) or is_rejection(getattr(error, "http_status", None)):
+        rotate_idempotency_key(payment, operation)
+        return PaymentError(error)
+    return PaymentError(error, code="gateway_unavailable")
+
+
+def warmup(secret_key):
+    """warmup
+
+    Configure SDK and open keep-alive connection to Stripe API
+
+    Args:
+        secret_key (string): Your stripe secret_key
+    """
+    configure(secret_key)
+    default_http_client().request("get", stripe.api_base, {})
+
+
+#: Event types handled by callback, only these are fetched by catch-up
+WEBHOOK_EVENTS = ["checkout.session.completed", "payment_intent.succeeded", "payment_intent.amount_capturable_updated"]
+
+
+def list_events(secret_key, since):
+    """list_events
+
+    Iterate events created since ``since`` page by page with SDK auto-pagination, newest first
+
+    Args:
+        secret_key (string): Your stripe secret_key
+        since (datetime): Oldest event creation time
+    """
+    configure(secret_key)
+    events = stripe.Event.list(created={"gte": int(since.timestamp())}, types=WEBHOOK_EVENTS, limit=100)
+    for event in events.auto_paging_iter():
+        # * Plain payload, the same as webhook body
+        yield loads(dumps(event))
+
+
+def capture_intent(secret_key, payment, payment_intent, amount=None):
+    """capture_intent
+
+    Capture payment intent confirmed with manual capture method
+
+    Args:
+        secret_key (string): Your stripe secret_key
+        payment (payment): Your payment instance
+        payment_intent (string): Payment intent id
+        amount (decimal, optional): Amount to capture, whole authorized amount by default
+    """
+    if payment.status != PaymentStatus.PREAUTH.name:
+        raise PaymentError("Only pre-authorized payments can be captured")
+    if not payment_intent:
+        raise PaymentError("Can't capture, payment_intent does not exist")
+    configure(secret_key)
+    params = {"amount_to_capture": convert_amount(payment.currency, amount)} if amount is not None else {}
+    try:
+        intent = stripe.PaymentIntent.capture(
+            payment_intent,
+            **params,
+            idempotency_key=idempotency_key(payment, "capture"),
+        )
+    except stripe.error.StripeError as e:
+        raise gateway_error(payment, "capture", e) from e
+    payment.extra_data["payment_intent"] = intent
+    payment.captured_amount = amount if amount is not None else payment.total
+    payment.status = PaymentStatus.CONFIRMED.name
+    payment.save(update_fields=["extra_data", "captured_amount", "status"])
+    remember(payment, "stripe", intent=intent.get("id"), charge=intent.get("latest_charge"))
+
+
 @dataclass
 class StripeProductData:
     name: str
@@ -78,18 +215,29 @@ class StripeCheckoutProvider(BasicProvider):
 
     - Creating a Checkout Session
 
+    - Capturing payment authorized with ``capture=False``
+
     - Refunding payment
 
     - Process payment confirmation with callback
 
     Args:
         secret_key (string): Your stripe secret_key
+        webhook_secret (string, optional): Signing secret of webhook endpoint, events are verified when set
     """
 
-    def __init__(self, secret_key, **kwargs):
+    def __init__(self, secret_key, webhook_secret=None, **kwargs):
         super().__init__(**kwargs)
         self.secret_key = secret_key
+        self.webhook_secret = webhook_secret
+
+    def warmup(self):
+        warmup(self.secret_key)
 
+    def list_events(self, since):
+        return list_events(self.secret_key, since)
+
+    @rate_limited("process_payment")
     def process_payment(self, payment):
         """process_payment
 
@@ -101,7 +249,7 @@ class StripeCheckoutProvider(BasicProvider):
         """
         if payment.transaction_id:
             raise PaymentError("This payment has already been processed.")
-        stripe.api_key = self.secret_key
+        configure(self.secret_key)
         session_data = {
             "line_items": self.get_line_items(payment),
             "mode": "payment",
@@ -109,19 +257,27 @@ class StripeCheckoutProvider(BasicProvider):
             "cancel_url": payment.failure_url,
             "client_reference_id": payment.pk,
         }
+        if not self._capture:
+            # * Funds are only authorized, intent metadata identifies payment in amount_capturable_updated event
+            session_data["payment_intent_data"] = {"capture_method": "manual", "metadata": {"order_no": payment.pk}}
         # Patch session with billing email if exists
         if payment.billing_email:
             session_data["customer_email"] = payment.billing_email
         try:
-            session = stripe.checkout.Session.create(**session_data)
+            session = stripe.checkout.Session.create(
+                **session_data,
+                idempotency_key=idempotency_key(payment, "process_payment"),
+            )
             payment.transaction_id = session.get("id", None)
             payment.extra_data["session"] = session
             payment.save(update_fields=["extra_data", "transaction_id"])
+            remember(payment, "stripe", session=session.get("id"), intent=session.get("payment_intent"))
             return session
 
         except stripe.error.StripeError as e:
-            raise PaymentError(e) from e
+            raise gateway_error(payment, "process_payment", e) from e
 
+    @rate_limited("refund")
     def refund(self, payment, amount=None):
         """refund
 
@@ -134,27 +290,68 @@ class StripeCheckoutProvider(BasicProvider):
         """
         if payment.status == PaymentStatus.CONFIRMED.name:
             to_refund = amount or payment.total
-            payment_intent = payment.extra_data.get("session", {}).get("payment_intent", None)
+            payment_intent = self.get_payment_intent(payment)
             if not payment_intent:
                 raise PaymentError("Can't Refund, payment_intent does not exist")
-            stripe.api_key = self.secret_key
+            configure(self.secret_key)
             try:
                 refund = stripe.Refund.create(
                     payment_intent=payment_intent,
                     amount=convert_amount(payment.currency, to_refund),
                     reason="requested_by_customer",
+                    idempotency_key=idempotency_key(payment, "refund"),
                 )
             except stripe.error.StripeError as e:
-                raise PaymentError(e) from e
+                raise gateway_error(payment, "refund", e) from e
             else:
                 payment.extra_data["refund"] = refund
                 payment.status = PaymentStatus.REFUNDED.name
                 payment.save(update_fields=["extra_data", "status"])
+                remember(payment, "stripe", refund=refund.get("id"))
 
                 return convert_amount(payment.currency, to_refund)
 
         raise PaymentError("Only Confirmed payments can be refunded")
 
+    def get_payment_intent(self, payment):
+        """Id of payment intent of checkout session, intent is known from session or from its own events"""
+        return (
+            lookup(payment, "stripe", INTENT)
+            or payment.extra_data.get("session", {}).get("payment_intent")
+            or payment.extra_data.get("payment_intend", {}).get("id")
+            or payment.extra_data.get("payment_intent", {}).get("id")
+        )
+
+    @rate_limited("capture")
+    def capture(self, payment, amount=None):
+        """capture
+
+        Capture funds of session created with ``capture=False``
+
+        Args:
+            payment (payment): Your payment instance
+            amount (decimal, optional): Amount to capture. Defaults to None.
+        """
+        capture_intent(self.secret_key, payment, self.get_payment_intent(payment), amount)
+
+    @rate_limited("expire")
+    def expire(self, payment):
+        """expire
+
+        Expire open checkout session so customer can't complete abandoned payment
+
+        Args:
+            payment (payment): Your payment instance
+
+        """
+        if not payment.transaction_id:
+            return
+        configure(self.secret_key)
+        try:
+            stripe.checkout.Session.expire(payment.transaction_id)
+        except stripe.error.StripeError as e:
+            raise PaymentError(e) from e
+
     def get_line_items(self, payment):
         """get_line_items
 
@@ -187,6 +384,8 @@ class StripeProvider(BasicProvider):
 
     - Creating a payment intent
 
+    - Capturing payment intent authorized with ``capture=False``
+
     - Refunding payment
 
     - Receiving payment confirmation with callback
@@ -194,13 +393,22 @@ class StripeProvider(BasicProvider):
     Args:
         secret_key (string): Your stripe secret_key
         public_key (string): Your stripe public_key
+        webhook_secret (string, optional): Signing secret of webhook endpoint, events are verified when set
     """
 
-    def __init__(self, secret_key, public_key, **kwargs):
+    def __init__(self, secret_key, public_key, webhook_secret=None, **kwargs):
         super().__init__(**kwargs)
         self.secret_key = secret_key
         self.public_key = public_key
+        self.webhook_secret = webhook_secret
+
+    def warmup(self):
+        warmup(self.secret_key)
+
+    def list_events(self, since):
+        return list_events(self.secret_key, since)
 
+    @rate_limited("process_payment")
     def process_payment(self, payment):
         """process_payment
 
@@ -210,25 +418,31 @@ class StripeProvider(BasicProvider):
         Args:
             payment (payment): Payment instance
         """
-        stripe.api_key = self.secret_key
+        configure(self.secret_key)
         # * Create payment intent with payment method generated on FE
         intent_data = {
             "payment_method": payment.transaction_id,
             "amount": int(payment.total * 100),
             "currency": payment.currency,
             "confirmation_method": "automatic",
+            "capture_method": "automatic" if self._capture else "manual",
             "confirm": True,
             "metadata": {"order_no": payment.pk},
         }
         try:
-            payment_intent = stripe.PaymentIntent.create(**intent_data)
+            payment_intent = stripe.PaymentIntent.create(
+                **intent_data,
+                idempotency_key=idempotency_key(payment, "process_payment"),
+            )
         except stripe.error.StripeError as e:
-            raise PaymentError(e) from e
+            raise gateway_error(payment, "process_payment", e) from e
         payment.extra_data["payment_intent"] = payment_intent
         # * Switching transaction id to payment intent_id
         payment.transaction_id = payment_intent.get("id", None)
         payment.save(update_fields=["extra_data", "transaction_id"])
+        remember(payment, "stripe", intent=payment_intent.get("id"), charge=payment_intent.get("latest_charge"))
 
+    @rate_limited("refund")
     def refund(self, payment, amount=None):
         """refund
 
@@ -244,19 +458,33 @@ class StripeProvider(BasicProvider):
             payment_intent = payment.extra_data.get("payment_intent", None).get("id", None)
             if not payment_intent:
                 raise PaymentError("Can't Refund, payment_intent does not exist")
-            stripe.api_key = self.secret_key
+            configure(self.secret_key)
             try:
                 refund = stripe.Refund.create(
                     payment_intent=payment_intent,
                     amount=convert_amount(payment.currency, to_refund),
                     reason="requested_by_customer",
+                    idempotency_key=idempotency_key(payment, "refund"),
                 )
             except stripe.error.StripeError as e:
-                raise PaymentError(e) from e
+                raise gateway_error(payment, "refund", e) from e
             else:
                 payment.extra_data["refund"] = refund
                 payment.status = PaymentStatus.REFUNDED.name
                 payment.save(update_fields=["extra_data", "status"])
+                remember(payment, "stripe", refund=refund.get("id"))
                 return convert_amount(payment.currency, to_refund)
 
         raise PaymentError("Only Confirmed payments can be refunded")
+
+    @rate_limited("capture")
+    def capture(self, payment, amount=None):
+        """capture
+
+        Capture funds of payment intent confirmed with ``capture=False``
+
+        Args:
+            payment (payment): Your payment instance
+            amount (decimal, optional): Amount to capture. Defaults to None.
+        """
+        capture_intent(self.secret_key, payment, payment.transaction_id, amount)
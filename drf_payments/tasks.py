@@ -0,0 +1,160 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
+from django.utils.module_loading import import_string
+
+from drf_payments import get_payment_model, get_payment_service, jobs
+from drf_payments.constants import PaymentError, PaymentStatus
+
+try:
+    from celery import shared_task
+except ImportError:  # pragma no cover
+    shared_task = None
+
+logger = logging.getLogger(__name__)
+
+
+def run_task(func_path: str, *args):
+    """Import task function by dotted path and call it, entry point of every backend"""
+    try:
+        return import_string(func_path)(*args)
+    finally:
+        connections.close_all()
+
+
+class TaskBackend:
+    """Defines task backend API, backend runs ``run_task(func_path, *args)`` outside of request"""
+
+    def enqueue(self, func_path: str, *args):
+        raise NotImplementedError()
+
+
+class ImmediateBackend(TaskBackend):
+    """Run task inline, useful in tests and management commands. Failed task is logged, not retried"""
+
+    def enqueue(self, func_path: str, *args):
+        try:
+            import_string(func_path)(*args)
+        except Exception:
+            logger.exception("Task %s failed", func_path)
+
+
+class ThreadPoolBackend(TaskBackend):
+    """ThreadPoolBackend
+
+    Run tasks in process local thread pool once transaction commits.
+    Tasks are lost if process dies, use ``JobBackend`` when they must survive restarts.
+    """
+
+    _executor = None
+    _pid = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_executor(cls) -> ThreadPoolExecutor:
+        with cls._lock:
+            if cls._executor is None or cls._pid != os.getpid():
+                cls._executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "PAYMENT_TASK_WORKERS", 4),
+                    thread_name_prefix="drf_payments",
+                )
+                cls._pid = os.getpid()
+        return cls._executor
+
+    def enqueue(self, func_path: str, *args):
+        transaction.on_commit(lambda: self.get_executor().submit(run_task, func_path, *args))
+
+
+class JobBackend(TaskBackend):
+    """JobBackend
+
+    Store task as ``PaymentJob`` in the same transaction as payment (outbox),
+    tasks are executed by ``run_payment_jobs`` workers
+    """
+
+    def enqueue(self, func_path: str, *args):
+        jobs.enqueue("drf_payments.task", payload={"func": func_path, "args": list(args)})
+
+
+class CeleryBackend(TaskBackend):
+    """Send task to celery once transaction commits, requires ``celery`` installed"""
+
+    def enqueue(self, func_path: str, *args):
+        if shared_task is None:
+            raise ImproperlyConfigured("CeleryBackend requires celery to be installed")
+        transaction.on_commit(lambda: celery_run_task.delay(func_path, *args))
+
+
+if shared_task is not None:  # pragma no branch
+    celery_run_task = shared_task(name="drf_payments.run_task")(run_task)
+
+
+@jobs.register("drf_payments.task")
+def run_task_job(job):
+    """Job handler running task stored by ``JobBackend``"""
+    import_string(job.payload["func"])(*job.payload["args"])
+
+
+def get_task_backend() -> TaskBackend:
+    """Returns backend configured in ``PAYMENT_TASK_BACKEND``, ``ThreadPoolBackend`` by default"""
+    return import_string(getattr(settings, "PAYMENT_TASK_BACKEND", "drf_payments.tasks.ThreadPoolBackend"))()
+
+
+def enqueue(func_path: str, *args):
+    """enqueue
+
+    Run function outside of request with configured backend
+
+    Args:
+        func_path (str): Dotted path of the function
+        args: Function arguments, must be json serializable for ``JobBackend`` and ``CeleryBackend``
+    """
+    get_task_backend().enqueue(func_path, *args)
+
+
+def process(payment) -> Optional[Exception]:
+    """process
+
+    Send payment to gateway, failure is stored on payment as ``ERROR`` status with message
+    so client polling status sees it. Successful retry of failed payment returns it to ``WAITING``
+
+    Args:
+        payment (payment): Your payment instance
+
+    Returns:
+        Exception: Error raised by provider, ``None`` on success
+    """
+    try:
+        get_payment_service(payment.variant).process_payment(payment)
+    except Exception as e:
+        logger.exception("Can't process payment %s", payment.pk)
+        payment.status = PaymentStatus.ERROR.name
+        payment.message = str(e)
+        payment.save(update_fields=["status", "message"])
+        return e
+    if payment.status == PaymentStatus.ERROR.name:
+        payment.status = PaymentStatus.WAITING.name
+        payment.message = ""
+        payment.save(update_fields=["status", "message"])
+    return None
+
+
+def process_payment(pk):
+    """process_payment
+
+    Task sending payment created with ``202 Accepted`` to gateway.
+    Retryable error (gateway unavailable, deadline, rate limit) is raised after it is stored on payment,
+    so backend retries the task, e.g. ``JobBackend`` with backoff
+
+    Args:
+        pk: Payment primary key
+    """
+    error = process(get_payment_model().objects.get(pk=pk))
+    if isinstance(error, PaymentError) and error.retryable:
+        raise error
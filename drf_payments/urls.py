@@ -1,12 +1,18 @@
+from django.conf import settings
 from django.urls import path
+from django.utils.module_loading import import_string
 
-from drf_payments import get_payment_service
 from drf_payments.braintree import BraintreeProvider
-from drf_payments.mixins import PaymentCallbackView, PaymentSettingsView
+from drf_payments.mixins import PaymentCallbackView, PaymentSettingsView, PaymentStatusView
 
 urlpatterns = [
     path("callback", PaymentCallbackView.as_view(), name="payment-callback"),
+    path("status/<str:token>", PaymentStatusView.as_view(), name="payment-status"),
 ]
 # TODO: Check if other payments need settings view
-if isinstance(get_payment_service("braintree"), BraintreeProvider):
+# * Provider class is checked without instantiating it, no connections are opened before server forks
+if (braintree := getattr(settings, "PAYMENT_VARIANTS", {}).get("braintree")) and issubclass(
+    import_string(braintree[0]),
+    BraintreeProvider,
+):
     urlpatterns.append(path("settings", PaymentSettingsView().as_view(), name="braintree-settings"))
@@ -0,0 +1,49 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Tuple
+
+from django.db import connections
+
+
+def _call_and_close(func: Callable, item):
+    """Run ``func`` in a worker thread and release the thread database connections afterwards"""
+    try:
+        return func(item)
+    finally:
+        connections.close_all()
+
+
+def map_concurrently(func: Callable, items: Iterable, max_workers: int = 1) -> List[Tuple[object, object, Exception]]:
+    """map_concurrently
+
+    Apply ``func`` to every item with at most ``max_workers`` threads.
+    Single worker runs inline in the calling thread (and its transaction).
+    Worker threads run in copy of the caller context, so request deadline applies to their gateway calls.
+
+    Args:
+        func (callable): Function receiving a single item
+        items (iterable): Items to process
+        max_workers (int, optional): Concurrency limit. Defaults to 1.
+
+    Returns:
+        list: ``(item, result, error)`` tuples in input order
+    """
+    items = list(items)
+    results = []
+    if max_workers <= 1 or len(items) <= 1:
+        for item in items:
+            try:
+                results.append((item, func(item), None))
+            except Exception as e:
+                results.append((item, None, e))
+        return results
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        futures = [
+            (item, executor.submit(contextvars.copy_context().run, _call_and_close, func, item)) for item in items
+        ]
+        for item, future in futures:
+            try:
+                results.append((item, future.result(), None))
+            except Exception as e:
+                results.append((item, None, e))
+    return results
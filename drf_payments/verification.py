@@ -0,0 +1,182 @@
+import base64
+import threading
+import time
+import zlib
+from datetime import datetime
+from datetime import timezone as dt_timezone
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import stripe
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.dateparse import parse_datetime
+
+from drf_payments import get_payment_service
+from drf_payments.constants import PaymentError
+from drf_payments.http import get_session
+
+try:
+    from cryptography import x509
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+except ImportError:  # pragma no cover
+    x509 = None
+
+#: PayPal signing certificates by url, ``(certificate, monotonic expiry)``
+CERT_CACHE: Dict[str, Tuple[object, float]] = {}
+_cert_lock = threading.Lock()
+
+
+def _tolerance() -> int:
+    return getattr(settings, "PAYMENT_WEBHOOK_TOLERANCE", 300)
+
+
+def _invalid(message: str) -> PaymentError:
+    return PaymentError(message, code="invalid_signature")
+
+
+def verify_stripe(payload: bytes, header: Optional[str], secret: str):
+    """verify_stripe
+
+    Check ``Stripe-Signature`` header, HMAC of raw body computed with endpoint signing secret
+
+    Args:
+        payload (bytes): Raw request body
+        header (str): ``Stripe-Signature`` header
+        secret (str): Webhook endpoint signing secret
+    """
+    if not header:
+        raise _invalid("Missing Stripe-Signature header")
+    try:
+        stripe.WebhookSignature.verify_header(payload.decode("utf-8"), header, secret, tolerance=_tolerance())
+    except stripe.error.SignatureVerificationError as e:
+        raise _invalid(str(e)) from e
+
+
+def _check_cert_url(url: str):
+    parsed = urlparse(url or "")
+    hosts = getattr(settings, "PAYMENT_PAYPAL_CERT_HOSTS", ("api.paypal.com", "api.sandbox.paypal.com"))
+    if parsed.scheme != "https" or parsed.hostname not in hosts:
+        raise _invalid(f"Untrusted certificate url {url}")
+
+
+def get_paypal_certificate(url: str):
+    """get_paypal_certificate
+
+    Signing certificate of PayPal webhooks, fetched once and cached until it expires
+    or ``PAYMENT_WEBHOOK_CERT_TTL`` passes
+
+    Args:
+        url (str): ``PAYPAL-CERT-URL`` header, only PayPal hosts are trusted
+    """
+    _check_cert_url(url)
+    if x509 is None:
+        raise ImproperlyConfigured("PayPal webhook verification requires cryptography to be installed")
+    cached = CERT_CACHE.get(url)
+    if cached is not None and cached[1] > time.monotonic():
+        return cached[0]
+    with _cert_lock:
+        cached = CERT_CACHE.get(url)
+        if cached is not None and cached[1] > time.monotonic():
+            return cached[0]
+        response = get_session("paypal").get(url, timeout=10)
+        response.raise_for_status()
+        certificate = x509.load_pem_x509_certificate(response.content)
+        not_after = getattr(certificate, "not_valid_after_utc", None) or certificate.not_valid_after.replace(
+            tzinfo=dt_timezone.utc,
+        )
+        valid_for = (not_after - datetime.now(dt_timezone.utc)).total_seconds()
+        if valid_for <= 0:
+            raise _invalid("PayPal certificate expired")
+        ttl = min(valid_for, getattr(settings, "PAYMENT_WEBHOOK_CERT_TTL", 24 * 60 * 60))
+        CERT_CACHE[url] = (certificate, time.monotonic() + ttl)
+        return certificate
+
+
+def verify_paypal(payload: bytes, headers, webhook_id: str):
+    """verify_paypal
+
+    Check PayPal transmission signature locally, RSA signature of
+    ``<transmission id>|<transmission time>|<webhook id>|<crc32 of body>`` made with PayPal certificate
+
+    Args:
+        payload (bytes): Raw request body
+        headers (dict): Request headers
+        webhook_id (str): Id of webhook the event was sent to
+    """
+    transmission_id = headers.get("Paypal-Transmission-Id")
+    transmission_time = headers.get("Paypal-Transmission-Time")
+    signature = headers.get("Paypal-Transmission-Sig")
+    if not (transmission_id and transmission_time and signature):
+        raise _invalid("Missing PayPal transmission headers")
+    if headers.get("Paypal-Auth-Algo", "SHA256withRSA") != "SHA256withRSA":
+        raise _invalid("Unsupported PayPal signature algorithm")
+    sent = parse_datetime(transmission_time)
+    if sent is None or abs(datetime.now(dt_timezone.utc).timestamp() - sent.timestamp()) > _tolerance():
+        raise _invalid("PayPal transmission time is outside of tolerance")
+    certificate = get_paypal_certificate(headers.get("Paypal-Cert-Url"))
+    message = f"{transmission_id}|{transmission_time}|{webhook_id}|{zlib.crc32(payload)}".encode("utf-8")
+    try:
+        certificate.public_key().verify(base64.b64decode(signature), message, padding.PKCS1v15(), hashes.SHA256())
+    except (InvalidSignature, ValueError) as e:
+        raise _invalid("Invalid PayPal signature") from e
+
+
+def verify_braintree(service, data):
+    """verify_braintree
+
+    Parse notification with SDK, which checks ``bt_signature`` against ``bt_payload``
+
+    Args:
+        service (BraintreeProvider): Braintree provider
+        data (dict): Request data
+
+    Returns:
+        WebhookNotification: Parsed notification
+    """
+    import braintree
+
+    try:
+        return service.service.webhook_notification.parse(data["bt_signature"], data["bt_payload"])
+    except (braintree.exceptions.InvalidSignatureError, KeyError) as e:
+        raise _invalid(f"Invalid Braintree signature {e}") from e
+
+
+def verify_webhook(request):
+    """verify_webhook
+
+    Verify callback request before it's processed, gateway is recognized by its headers and payload
+    in the same order ``events.parse_event`` reads them. Request carrying markers of more than one gateway is rejected,
+    otherwise a forged event could be verified against gateway that doesn't sign it.
+    Gateways without configured secret are not verified unless ``PAYMENT_WEBHOOK_REQUIRE_SIGNATURE`` is set.
+    Parsed Braintree notification is stored in ``request.webhook_notification``.
+
+    Args:
+        request (Request): DRF request
+    """
+    required = getattr(settings, "PAYMENT_WEBHOOK_REQUIRE_SIGNATURE", False)
+    variants = getattr(settings, "PAYMENT_VARIANTS", {})
+    # * Raw body is read before data is parsed, signatures are computed over exact bytes
+    payload = request.body
+    headers = request.headers
+    data = request.data
+    markers = {
+        "stripe": "Stripe-Signature" in headers or "type" in data,
+        "paypal": "Paypal-Transmission-Id" in headers or "event_type" in data,
+        "braintree": "bt_signature" in data or "bt_payload" in data,
+    }
+    if sum(markers.values()) > 1:
+        raise _invalid(f"Webhook matches more than one gateway: {', '.join(k for k, v in markers.items() if v)}")
+    if markers["stripe"]:
+        if "stripe" in variants and (secret := getattr(get_payment_service("stripe"), "webhook_secret", None)):
+            return verify_stripe(payload, headers.get("Stripe-Signature"), secret)
+    elif markers["paypal"]:
+        if "paypal" in variants and (webhook_id := getattr(get_payment_service("paypal"), "webhook_id", None)):
+            return verify_paypal(payload, headers, webhook_id)
+    elif markers["braintree"] and "braintree" in variants:
+        request.webhook_notification = verify_braintree(get_payment_service("braintree"), data)
+        return
+    if required:
+        raise _invalid("Webhook signature can't be verified")
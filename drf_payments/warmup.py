@@ -0,0 +1,58 @@
+import logging
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+
+from drf_payments import deadline, get_payment_service
+from drf_payments.core import PAYMENT_VARIANTS, provider_factory
+
+logger = logging.getLogger(__name__)
+
+
+def _get_provider(variant: str):
+    try:
+        return get_payment_service(variant)
+    except Exception:
+        # * Variants unknown to ``get_payment_service`` are built by provider factory
+        return provider_factory(variant)
+
+
+def warmup(variants: Optional[Iterable[str]] = None) -> List[str]:
+    """warmup
+
+    Instantiate configured providers and let them open connections and fetch credentials,
+    so the first payment handled by fresh worker does not pay for it.
+    Every variant gets ``PAYMENT_WARMUP_TIMEOUT`` seconds, so hanging gateway can't block worker startup.
+    Failures are logged and never prevent worker from starting.
+
+    Args:
+        variants (list, optional): Variants to warm up, all ``PAYMENT_VARIANTS`` by default
+
+    Returns:
+        list: Successfully warmed up variants
+    """
+    if variants is None:
+        variants = getattr(settings, "PAYMENT_VARIANTS", PAYMENT_VARIANTS).keys()
+    warmed = []
+    for variant in variants:
+        try:
+            with deadline.within(getattr(settings, "PAYMENT_WARMUP_TIMEOUT", 5)):
+                _get_provider(variant).warmup()
+        except Exception:
+            logger.warning("Can't warm up payment variant %s", variant, exc_info=True)
+        else:
+            warmed.append(variant)
+    return warmed
+
+
+def post_fork(server=None, worker=None):
+    """post_fork
+
+    Gunicorn ``post_fork`` hook, warms up providers in every worker process
+
+    ```python
+    # gunicorn.conf.py
+    from drf_payments.warmup import post_fork
+    ```
+    """
+    warmup()
@@ -1,11 +1,54 @@
-from unittest.mock import patch
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest.mock import Mock, patch
 
+import requests
+import stripe
+from django.apps import apps as django_apps
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
-from django.test import TestCase, override_settings
+from django.core.management import CommandError, call_command
+from django.db import connection, models
+from django.db.models import ExpressionWrapper, F, Value
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext, isolate_apps
+from django.utils import timezone
+from rest_framework.exceptions import ParseError, ValidationError
 from shop.models import Payment
 
-from drf_payments import get_payment_model, get_payment_service
-from drf_payments.core import BasicProvider, _default_provider_factory
+from drf_payments import (
+    codec,
+    deadline,
+    events,
+    fields,
+    get_payment_model,
+    get_payment_service,
+    http,
+    jobs,
+    notifications,
+    partitioning,
+    paypal,
+    ratelimit,
+    routers,
+)
+from drf_payments import stripe as stripe_provider
+from drf_payments.braintree import BraintreeProvider
+from drf_payments.constants import JobStatus, PaymentError, PaymentStatus
+from drf_payments.core import BasicProvider, _default_provider_factory, _reset_providers
+from drf_payments.expiry import expire_payments
+from drf_payments.idempotency import idempotency_key, rotate_idempotency_key
+from drf_payments.models import PaymentJob
+from drf_payments.signals import rate_limit_waited, status_changed
+from drf_payments.utils import map_concurrently
+from drf_payments.warmup import post_fork, warmup
 
 
 class CoreTest(TestCase):
@@ -57,3 +100,918 @@ class CoreTest(TestCase):
     )
     def test_factory_from_string(self):
         get_payment_service("stripe")
+
+
+class JobsTest(TestCase):
+    def setUp(self):
+        self.payment = Payment.objects.create(variant="stripe", total=200)
+        self.calls = []
+        jobs.register("test.ok")(lambda job: self.calls.append(job.payment_id))
+        jobs.register("test.error")(lambda job: 1 / 0)
+
+    def tearDown(self):
+        jobs.JOB_HANDLERS.pop("test.ok")
+        jobs.JOB_HANDLERS.pop("test.error")
+
+    def test_enqueue_and_run(self):
+        job = jobs.enqueue("test.ok", payment=self.payment)
+        self.assertEqual(jobs.JobWorker().run_once(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.DONE.name)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(self.calls, [str(self.payment.pk)])
+
+    def test_claim_respects_batch_size_and_names(self):
+        for _ in range(3):
+            jobs.enqueue("test.ok")
+        jobs.enqueue("test.error")
+        claimed = jobs.claim("worker-1", 2, 60, names=["test.ok"])
+        self.assertEqual(len(claimed), 2)
+        self.assertTrue(all(job.locked_by == "worker-1" for job in claimed))
+        self.assertEqual(len(jobs.claim("worker-2", 10, 60, names=["test.ok"])), 1)
+
+    def test_claimed_job_is_not_claimed_twice(self):
+        jobs.enqueue("test.ok")
+        self.assertEqual(len(jobs.claim("worker-1", 10, 60)), 1)
+        self.assertEqual(jobs.claim("worker-2", 10, 60), [])
+
+    def test_expired_lease_is_reclaimed(self):
+        job = jobs.enqueue("test.ok")
+        jobs.claim("worker-1", 10, 60)
+        PaymentJob.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        reclaimed = jobs.claim("worker-2", 10, 60)
+        self.assertEqual([j.pk for j in reclaimed], [job.pk])
+        self.assertEqual(reclaimed[0].attempts, 2)
+        # * Stale worker can't complete job anymore
+        job.refresh_from_db()
+        job.locked_by = "worker-1"
+        self.assertFalse(jobs.complete(job))
+
+    def test_heartbeat(self):
+        job = jobs.enqueue("test.ok")
+        jobs.claim("worker-1", 10, 1)
+        self.assertEqual(jobs.heartbeat("worker-1", [job.pk], 60), 1)
+        self.assertEqual(jobs.heartbeat("worker-2", [job.pk], 60), 0)
+        job.refresh_from_db()
+        self.assertGreater(job.locked_until, timezone.now() + timedelta(seconds=30))
+
+    def test_failed_job_is_retried_then_failed(self):
+        job = jobs.enqueue("test.error", max_attempts=2)
+        with self.assertLogs("drf_payments.jobs"):
+            jobs.JobWorker().run_once()
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.PENDING.name)
+        self.assertIn("division by zero", job.last_error)
+        self.assertGreater(job.run_after, timezone.now())
+        PaymentJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        with self.assertLogs("drf_payments.jobs"):
+            jobs.JobWorker().run_once()
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.FAILED.name)
+
+    def test_release(self):
+        job = jobs.enqueue("test.ok")
+        jobs.claim("worker-1", 10, 60)
+        self.assertEqual(jobs.release("worker-1", [job.pk]), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.PENDING.name)
+        self.assertEqual(job.attempts, 0)
+
+    @override_settings(PAYMENT_JOB_HANDLERS={"test.setting": "drf_payments.utils.map_concurrently"})
+    def test_get_handler(self):
+        self.assertIsNotNone(jobs.get_handler("test.setting"))
+        with self.assertRaises(LookupError):
+            jobs.get_handler("test.missing")
+
+    def test_command(self):
+        jobs.enqueue("test.ok")
+        call_command("run_payment_jobs", "--once", stdout=StringIO())
+        self.assertEqual(PaymentJob.objects.get().status, JobStatus.DONE.name)
+
+
+class ExpiryTest(TestCase):
+    def setUp(self):
+        old = timezone.now() - timedelta(days=2)
+        self.stale = [Payment.objects.create(variant="stripe", total=200, transaction_id=f"cs_{i}") for i in range(5)]
+        Payment.objects.filter(pk__in=[p.pk for p in self.stale]).update(created=old)
+        self.fresh = Payment.objects.create(variant="stripe", total=200)
+        self.confirmed = Payment.objects.create(variant="paypal", total=200, status=PaymentStatus.CONFIRMED.name)
+        Payment.objects.filter(pk=self.confirmed.pk).update(created=old)
+
+    def test_expire_in_chunks(self):
+        self.assertEqual(expire_payments(older_than=timedelta(days=1), chunk_size=2), 5)
+        self.assertEqual(Payment.objects.filter(status=PaymentStatus.EXPIRED.name).count(), 5)
+        self.fresh.refresh_from_db()
+        self.confirmed.refresh_from_db()
+        self.assertEqual(self.fresh.status, PaymentStatus.WAITING.name)
+        self.assertEqual(self.confirmed.status, PaymentStatus.CONFIRMED.name)
+        self.assertEqual(expire_payments(older_than=timedelta(days=1)), 0)
+
+    def test_expire_variants(self):
+        self.assertEqual(expire_payments(older_than=timedelta(days=1), variants=["paypal"]), 0)
+
+    @patch("stripe.checkout.Session.expire")
+    def test_expire_on_gateway(self, mock_expire):
+        # * Completed session can't be expired, such payment stays waiting for webhook
+        mock_expire.side_effect = [None, None, stripe.error.StripeError("completed"), None, None]
+        with self.assertLogs("drf_payments.expiry"):
+            expired = expire_payments(older_than=timedelta(days=1), gateway=True)
+        self.assertEqual(expired, 4)
+        self.assertEqual(Payment.objects.filter(status=PaymentStatus.WAITING.name).count(), 2)
+
+    def test_expire_job(self):
+        jobs.enqueue("drf_payments.expire", payload={"older_than": 3600})
+        jobs.JobWorker().run_once()
+        self.assertEqual(Payment.objects.filter(status=PaymentStatus.EXPIRED.name).count(), 5)
+
+    def test_command(self):
+        out = StringIO()
+        call_command("expire_payments", "--older-than", "3600", "--chunk-size", "2", stdout=out)
+        self.assertIn("Expired 5 payment(s)", out.getvalue())
+
+
+@override_settings(
+    PAYMENT_VARIANTS={
+        "stripe": ("drf_payments.stripe.StripeProvider", {"secret_key": "sk", "public_key": "pk"}),
+        "paypal": (
+            "drf_payments.paypal.PaypalProvider",
+            {"client_id": "id", "secret": "secret", "endpoint": "https://paypal.test"},
+        ),
+    },
+)
+class WarmupTest(TestCase):
+    def tearDown(self):
+        paypal.TOKEN_CACHE.clear()
+
+    @patch("requests.Session.post")
+    def test_paypal_token_cached(self, mock_post):
+        mock_post.return_value.json.return_value = {"access_token": "DummyToken", "expires_in": 32400}
+        service = get_payment_service("paypal")
+        service.warmup()
+        self.assertEqual(service._create_token(), "DummyToken")
+        self.assertEqual(mock_post.call_count, 1)
+
+    @patch("requests.Session.post")
+    def test_paypal_token_expired(self, mock_post):
+        mock_post.return_value.json.return_value = {"access_token": "DummyToken", "expires_in": 1}
+        service = get_payment_service("paypal")
+        service._create_token()
+        service._create_token()
+        self.assertEqual(mock_post.call_count, 2)
+
+    @patch("drf_payments.stripe.default_http_client")
+    @patch("requests.Session.post")
+    def test_warmup(self, mock_post, mock_client):
+        mock_post.return_value.json.return_value = {}
+        with self.assertLogs("drf_payments.warmup"):
+            self.assertEqual(warmup(), ["stripe"])
+        mock_client.return_value.request.assert_called_once()
+
+    @patch("drf_payments.warmup.warmup")
+    def test_post_fork(self, mock_warmup):
+        post_fork(None, None)
+        mock_warmup.assert_called_once()
+
+    @override_settings(PAYMENT_WARMUP=True)
+    @patch("drf_payments.warmup.warmup")
+    def test_app_ready(self, mock_warmup):
+        django_apps.get_app_config("drf_payments").ready()
+        mock_warmup.assert_called_once()
+
+
+class ForkSafetyTest(TestCase):
+    def tearDown(self):
+        http.reset()
+
+    def test_session_is_reused(self):
+        self.assertIs(http.get_session("test"), http.get_session("test"))
+        self.assertIsNot(http.get_session("test"), http.get_session("other"))
+
+    def test_session_rebuilt_in_new_process(self):
+        session = http.get_session("test")
+        with patch("os.getpid", return_value=-1):
+            self.assertIsNot(http.get_session("test"), session)
+
+    @unittest.skipUnless(hasattr(os, "fork"), "fork is not available")
+    def test_fork_drops_inherited_sessions(self):
+        http.get_session("test")
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:  # pragma no cover
+            os.write(write, b"1" if not http._SESSIONS else b"0")
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(os.read(read, 1), b"1")
+        self.assertIn("test", http._SESSIONS)
+
+    @patch("braintree.BraintreeGateway")
+    def test_provider_connections_reset(self, mock_gateway):
+        provider = BraintreeProvider(merchant_id="id", public_key="pk", private_key="pk", sandbox=True)
+        _reset_providers()
+        self.assertEqual(mock_gateway.call_count, 2)
+        self.assertEqual(provider.merchant_id, "id")
+
+    def test_stripe_client_reset(self):
+        client = stripe_provider.default_http_client()
+        self.assertIs(stripe_provider.default_http_client(), client)
+        stripe_provider._reset_http_client()
+        self.assertIsNone(stripe.default_http_client)
+        # * Client configured by project is not replaced
+        stripe.default_http_client = custom = object()
+        stripe_provider._reset_http_client()
+        self.assertIs(stripe.default_http_client, custom)
+        stripe.default_http_client = None
+
+
+class IdempotencyKeyTest(TestCase):
+    def setUp(self):
+        self.payment = Payment.objects.create(variant="stripe", total=200, transaction_id="pm_1")
+
+    def tearDown(self):
+        http.reset()
+
+    def test_key_is_deterministic(self):
+        key = idempotency_key(self.payment, "process_payment")
+        self.payment.save()
+        self.payment.refresh_from_db()
+        self.assertEqual(idempotency_key(self.payment, "process_payment"), key)
+        self.assertEqual(self.payment.extra_data["idempotency"]["process_payment"]["key"], key)
+        self.assertNotEqual(idempotency_key(self.payment, "refund"), key)
+
+    def test_rotate(self):
+        key = idempotency_key(self.payment, "process_payment")
+        rotate_idempotency_key(self.payment, "process_payment")
+        self.payment.refresh_from_db()
+        self.assertNotEqual(idempotency_key(self.payment, "process_payment"), key)
+        self.assertEqual(self.payment.extra_data["idempotency"]["process_payment"]["attempt"], 1)
+
+    @override_settings(
+        PAYMENT_VARIANTS={
+            "stripe": ("drf_payments.stripe.StripeProvider", {"secret_key": "sk", "public_key": "pk"}),
+        },
+    )
+    @patch("stripe.PaymentIntent.create")
+    def test_stripe_key_kept_on_connection_error(self, mock_create):
+        mock_create.side_effect = stripe.error.APIConnectionError("timeout")
+        service = get_payment_service("stripe")
+        with self.assertRaises(PaymentError):
+            service.process_payment(self.payment)
+        key = mock_create.call_args.kwargs["idempotency_key"]
+        self.assertEqual(idempotency_key(self.payment, "process_payment"), key)
+        mock_create.side_effect = stripe.error.CardError("declined", None, "card_declined")
+        with self.assertRaises(PaymentError):
+            service.process_payment(self.payment)
+        self.assertEqual(mock_create.call_args.kwargs["idempotency_key"], key)
+        self.assertNotEqual(idempotency_key(self.payment, "process_payment"), key)
+
+    @patch("requests.Session.post")
+    def test_paypal_request_id(self, mock_post):
+        mock_post.return_value.json.return_value = {"access_token": "DummyToken", "id": "ORDER"}
+        payment = Payment.objects.create(variant="paypal", total=200)
+        get_payment_service("paypal").process_payment(payment)
+        headers = mock_post.call_args.kwargs["headers"]
+        self.assertEqual(headers["PayPal-Request-Id"], idempotency_key(payment, "process_payment"))
+
+    @override_settings(
+        PAYMENT_VARIANTS={
+            "stripe": ("drf_payments.stripe.StripeProvider", {"secret_key": "sk", "public_key": "pk"}),
+        },
+    )
+    @patch("stripe.PaymentIntent.create")
+    def test_stripe_key_kept_on_server_error(self, mock_create):
+        mock_create.side_effect = stripe.error.APIError("internal error", http_status=500)
+        service = get_payment_service("stripe")
+        for _ in range(2):
+            with self.assertRaises(PaymentError):
+                service.process_payment(self.payment)
+        first, second = (call.kwargs["idempotency_key"] for call in mock_create.call_args_list)
+        self.assertEqual(first, second)
+
+    @patch("drf_payments.paypal.PaypalProvider._create_token", return_value="DummyToken")
+    @patch("requests.Session.post")
+    def test_paypal_key_rotated_only_on_rejection(self, mock_post, _):
+        payment = Payment.objects.create(variant="paypal", total=200)
+        service = get_payment_service("paypal")
+        mock_post.return_value.status_code = 500
+        mock_post.return_value.json.return_value = {"name": "INTERNAL_SERVER_ERROR"}
+        with self.assertRaises(PaymentError):
+            service.process_payment(payment)
+        key = mock_post.call_args.kwargs["headers"]["PayPal-Request-Id"]
+        self.assertEqual(idempotency_key(payment, "process_payment"), key)
+        mock_post.return_value.status_code = 422
+        mock_post.return_value.json.return_value = {"name": "UNPROCESSABLE_ENTITY"}
+        with self.assertRaises(PaymentError):
+            service.process_payment(payment)
+        self.assertEqual(mock_post.call_args.kwargs["headers"]["PayPal-Request-Id"], key)
+        self.assertNotEqual(idempotency_key(payment, "process_payment"), key)
+
+    @patch("drf_payments.paypal.PaypalProvider._create_token", return_value="DummyToken")
+    @patch("requests.Session.post")
+    def test_paypal_html_error_is_retryable(self, mock_post, _):
+        payment = Payment.objects.create(variant="paypal", total=200)
+        mock_post.return_value.status_code = 502
+        mock_post.return_value.json.side_effect = requests.JSONDecodeError("Expecting value", "<html>", 0)
+        with self.assertRaises(PaymentError) as context:
+            get_payment_service("paypal").process_payment(payment)
+        self.assertTrue(context.exception.retryable)
+        key = mock_post.call_args.kwargs["headers"]["PayPal-Request-Id"]
+        self.assertEqual(idempotency_key(payment, "process_payment"), key)
+
+    @patch("drf_payments.paypal.PaypalProvider._create_token", return_value="DummyToken")
+    @patch("requests.Session.post")
+    def test_paypal_mutations_rotate_key_only_on_rejection(self, mock_post, _):
+        payment = Payment.objects.create(
+            variant="paypal",
+            total=200,
+            transaction_id="ORDER-1",
+            status=PaymentStatus.CONFIRMED.name,
+            extra_data={"capture": {"id": "CAPTURE-1"}},
+        )
+        service = get_payment_service("paypal")
+        for operation, code in (
+            ("capture", "capture_failed"),
+            ("authorize", "authorize_failed"),
+            ("refund", "refund_failed"),
+        ):
+            key = idempotency_key(payment, operation)
+            mock_post.side_effect = requests.exceptions.ConnectionError()
+            with self.assertRaises(PaymentError) as context:
+                getattr(service, operation)(payment)
+            self.assertEqual(context.exception.code, "gateway_unavailable")
+            mock_post.side_effect = None
+            mock_post.return_value.status_code = 503
+            mock_post.return_value.json.return_value = {"name": "SERVICE_UNAVAILABLE"}
+            with self.assertRaises(PaymentError) as context:
+                getattr(service, operation)(payment)
+            self.assertTrue(context.exception.retryable)
+            self.assertEqual(idempotency_key(payment, operation), key)
+            mock_post.return_value.status_code = 422
+            mock_post.return_value.json.return_value = {"name": "UNPROCESSABLE_ENTITY"}
+            with self.assertRaises(PaymentError) as context:
+                getattr(service, operation)(payment)
+            self.assertEqual(context.exception.code, code)
+            self.assertEqual(mock_post.call_args.kwargs["headers"]["PayPal-Request-Id"], key)
+            self.assertNotEqual(idempotency_key(payment, operation), key)
+
+    @override_settings(PAYMENT_MAX_NETWORK_RETRIES=3)
+    def test_session_retries(self):
+        retries = http.get_session("idempotent", retry_post=True).get_adapter("https://").max_retries
+        self.assertEqual(retries.total, 3)
+        self.assertIsNone(retries.allowed_methods)
+        retries = http.get_session("plain").get_adapter("https://").max_retries
+        self.assertNotIn("POST", retries.allowed_methods)
+
+
+@override_settings(PAYMENT_RATE_LIMITS={"stripe": 2, "paypal.refund": 1}, PAYMENT_RATE_LIMIT_MAX_WAIT=0)
+class RateLimitTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_get_limit(self):
+        self.assertEqual(ratelimit.get_limit("stripe", "refund"), ("stripe", 2))
+        self.assertEqual(ratelimit.get_limit("paypal", "refund"), ("paypal.refund", 1))
+        self.assertEqual(ratelimit.get_limit("paypal", "process_payment"), (None, None))
+
+    @patch("time.time", return_value=1000.5)
+    def test_fail_when_limit_exceeded(self, _):
+        self.assertEqual(ratelimit.acquire("stripe", "process_payment"), 0)
+        self.assertEqual(ratelimit.acquire("stripe", "refund"), 0)
+        with self.assertRaises(PaymentError) as e:
+            ratelimit.acquire("stripe", "process_payment")
+        self.assertEqual(e.exception.code, "rate_limited")
+        # * Other buckets are not affected
+        self.assertEqual(ratelimit.acquire("paypal", "process_payment"), 0)
+
+    @override_settings(PAYMENT_RATE_LIMIT_MAX_WAIT=5)
+    @patch("time.sleep")
+    @patch("time.time", return_value=1000.75)
+    def test_wait_for_next_window(self, _, mock_sleep):
+        waits = []
+        rate_limit_waited.connect(lambda **kwargs: waits.append(kwargs["waited"]), weak=False, dispatch_uid="test")
+        try:
+            for _ in range(5):
+                ratelimit.acquire("stripe", "process_payment")
+        finally:
+            rate_limit_waited.disconnect(dispatch_uid="test")
+        self.assertEqual(waits, [0, 0, 0.25, 0.25, 1.25])
+        self.assertEqual(mock_sleep.call_count, 3)
+
+    @patch("drf_payments.ratelimit.acquire")
+    @patch("requests.Session.post")
+    def test_provider_calls_are_limited(self, mock_post, mock_acquire):
+        mock_post.return_value.json.return_value = {"access_token": "DummyToken", "id": "ORDER"}
+        payment = Payment.objects.create(variant="paypal", total=200)
+        get_payment_service("paypal").process_payment(payment)
+        mock_acquire.assert_called_once_with("paypal", "process_payment")
+
+
+class StatusNotificationTest(TestCase):
+    def test_local_notifier(self):
+        notifier = notifications.LocalNotifier()
+        event = notifier.subscribe("token")
+        other = notifier.subscribe("other")
+        notifier.publish("token")
+        self.assertTrue(event.is_set())
+        self.assertFalse(other.is_set())
+        notifier.unsubscribe("other", other)
+        self.assertEqual(dict(notifier._waiters), {})
+
+    def test_status_changed_signal(self):
+        calls = []
+
+        def receiver(sender, payment, previous, **kwargs):
+            calls.append((previous, payment.status))
+
+        status_changed.connect(receiver)
+        self.addCleanup(status_changed.disconnect, receiver)
+        payment = Payment.objects.create(variant="stripe", total=10)
+        payment.extra_data["key"] = "value"
+        payment.save(update_fields=["extra_data"])
+        payment = Payment.objects.get(pk=payment.pk)
+        payment.status = PaymentStatus.CONFIRMED.name
+        payment.save(update_fields=["status"])
+        payment.save()
+        self.assertEqual(calls, [(None, PaymentStatus.WAITING.name), (PaymentStatus.WAITING.name, "CONFIRMED")])
+
+    def test_published_on_commit(self):
+        payment = Payment.objects.create(variant="stripe", total=10)
+        event = notifications.get_notifier().subscribe(payment.token)
+        self.addCleanup(notifications.get_notifier().unsubscribe, payment.token, event)
+        with self.captureOnCommitCallbacks(execute=True):
+            payment.status = PaymentStatus.CONFIRMED.name
+            payment.save()
+            self.assertFalse(event.is_set())
+        self.assertTrue(event.is_set())
+
+    def test_expiry_notifies(self):
+        payment = Payment.objects.create(variant="stripe", total=10)
+        Payment.objects.filter(pk=payment.pk).update(created=timezone.now() - timedelta(days=2))
+        event = notifications.get_notifier().subscribe(payment.token)
+        self.addCleanup(notifications.get_notifier().unsubscribe, payment.token, event)
+        with self.captureOnCommitCallbacks(execute=True):
+            expire_payments()
+        self.assertTrue(event.is_set())
+
+
+@override_settings(PAYMENT_READ_REPLICAS=["replica"])
+class ReplicaRouterTest(TestCase):
+    def setUp(self):
+        self.router = routers.PaymentReplicaRouter()
+        self.factory = RequestFactory()
+
+    def test_reads_outside_replica_block_use_primary(self):
+        self.assertIsNone(self.router.db_for_read(Payment))
+        with routers.replica_reads():
+            self.assertEqual(self.router.db_for_read(Payment), "replica")
+            self.assertIsNone(self.router.db_for_read(PaymentJob))
+        self.assertIsNone(self.router.db_for_read(Payment))
+
+    def test_write_pins_request_and_client(self):
+        def view(request):
+            with routers.replica_reads():
+                before = self.router.db_for_read(Payment)
+                Payment.objects.create(variant="stripe", total=10)
+                after = self.router.db_for_read(Payment)
+            return HttpResponse(f"{before}:{after}")
+
+        middleware = routers.PaymentReplicaMiddleware(view)
+        response = middleware(self.factory.get("/"))
+        self.assertEqual(response.content, b"replica:None")
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+        request = self.factory.get("/")
+        request.COOKIES[routers.PIN_COOKIE] = response.cookies[routers.PIN_COOKIE].value
+        response = routers.PaymentReplicaMiddleware(lambda request: HttpResponse(routers.is_pinned()))(request)
+        self.assertEqual(response.content, b"True")
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+        self.assertFalse(routers.is_pinned())
+
+    def test_replicas_are_not_migrated(self):
+        self.assertFalse(self.router.allow_migrate("replica", "shop"))
+        self.assertIsNone(self.router.allow_migrate("default", "shop"))
+
+
+class PartitioningTest(TestCase):
+    def test_month_ranges(self):
+        self.assertEqual(partitioning.add_months(date(2024, 11, 15), 3), date(2025, 2, 1))
+        self.assertEqual(partitioning.add_months(date(2024, 1, 1), -1), date(2023, 12, 1))
+        self.assertEqual(partitioning.month_range(date(2024, 12, 31)), (date(2024, 12, 1), date(2025, 1, 1)))
+        self.assertEqual(partitioning.partition_name("shop_payment", date(2024, 2, 1)), "shop_payment_p202402")
+
+    def test_operation_is_noop_on_other_databases(self):
+        operation = partitioning.PartitionByCreated("payment")
+        self.assertEqual(operation.deconstruct(), ("PartitionByCreated", ["payment"], {}))
+        editor = Mock(connection=connection)
+        operation.database_forwards("shop", editor, None, None)
+        editor.execute.assert_not_called()
+
+    def test_commands_require_postgresql(self):
+        with self.assertRaises(ImproperlyConfigured):
+            call_command("create_payment_partitions", stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command("detach_payment_partitions", "--keep-months", "0", stdout=StringIO())
+
+    def test_filter_created(self):
+        old = Payment.objects.create(variant="stripe", total=10)
+        Payment.objects.filter(pk=old.pk).update(created=timezone.now() - timedelta(days=40))
+        new = Payment.objects.create(variant="stripe", total=10)
+        since = (timezone.now() - timedelta(days=1)).date().isoformat()
+        self.assertEqual(list(partitioning.filter_created(Payment.objects.all(), {"created_after": since})), [new])
+        with override_settings(PAYMENT_LIST_WINDOW_DAYS=30):
+            self.assertEqual(list(partitioning.filter_created(Payment.objects.all(), {})), [new])
+        with self.assertRaises(ValidationError):
+            partitioning.filter_created(Payment.objects.all(), {"created_before": "yesterday"})
+
+
+class CompressedJSONFieldTest(TestCase):
+    def setUp(self):
+        self.value = {"session": {"id": "cs_test_1", "url": "https://checkout.stripe.com/c/pay/cs_test_1"}}
+
+    def test_round_trip(self):
+        field = fields.CompressedJSONField()
+        stored = field.get_prep_value(self.value)
+        self.assertTrue(fields.is_compressed(stored, "zlib", 0))
+        self.assertEqual(field.from_db_value(stored, None, connection), self.value)
+        self.assertEqual(field.to_python(json.dumps(self.value)), self.value)
+
+    def test_plain_json_is_read(self):
+        field = fields.CompressedJSONField()
+        self.assertEqual(field.from_db_value(json.dumps(self.value).encode(), None, connection), self.value)
+        self.assertEqual(field.from_db_value(json.dumps(self.value), None, connection), self.value)
+        self.assertFalse(fields.is_compressed(json.dumps(self.value).encode()))
+
+    def test_dictionary(self):
+        samples = [json.dumps({**self.value, "pk": i}).encode() for i in range(50)]
+        dictionary = fields.train_dictionary(samples, size=1024)
+        self.assertLessEqual(len(dictionary), 1024)
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(dictionary)
+            f.flush()
+            fields._dictionary.cache_clear()
+            self.addCleanup(fields._dictionary.cache_clear)
+            with override_settings(PAYMENT_COMPRESSION_DICTIONARIES={1: f.name}):
+                with_dictionary = fields.compress(samples[0], dictionary_id=1)
+                self.assertLess(len(with_dictionary), len(fields.compress(samples[0])))
+                self.assertEqual(fields.decompress(with_dictionary), samples[0])
+                field = fields.CompressedJSONField(dictionary_id=1)
+                self.assertTrue(fields.is_compressed(field.get_prep_value(self.value), "zlib", 1))
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ImproperlyConfigured):
+            fields.compress(b"{}", codec="lzma")
+
+    def test_recompress_requires_field(self):
+        with self.assertRaises(CommandError):
+            call_command("recompress_extra_data", stdout=StringIO())
+
+
+@isolate_apps("shop")
+class RecompressTest(TransactionTestCase):
+    def setUp(self):
+        class Document(models.Model):
+            data = fields.CompressedJSONField(default=dict)
+
+            class Meta:
+                app_label = "shop"
+
+        self.model = Document
+        with connection.schema_editor() as editor:
+            editor.create_model(Document)
+        self.addCleanup(self.drop_model)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dictionaries = {}
+        for dictionary_id in (1, 2):
+            samples = [json.dumps({"session": f"cs_{dictionary_id}_{i}", "pk": i}).encode() for i in range(50)]
+            self.dictionaries[dictionary_id] = os.path.join(self.tmp.name, f"{dictionary_id}.dict")
+            with open(self.dictionaries[dictionary_id], "wb") as f:
+                f.write(fields.train_dictionary(samples, size=1024))
+        fields._dictionary.cache_clear()
+        self.addCleanup(fields._dictionary.cache_clear)
+
+    def drop_model(self):
+        with connection.schema_editor() as editor:
+            editor.delete_model(self.model)
+
+    def test_rewrite_with_new_dictionary(self):
+        values = [{"session": f"cs_{i}", "pk": i} for i in range(5)]
+        with override_settings(PAYMENT_COMPRESSION_DICTIONARIES=self.dictionaries):
+            with override_settings(PAYMENT_COMPRESSION_DICTIONARY=1):
+                for value in values[:4]:
+                    self.model.objects.create(data=value)
+            # * Row written before the field was compressed
+            legacy = self.model.objects.create()
+            self.model.objects.filter(pk=legacy.pk).update(
+                data=Value(json.dumps(values[4]).encode(), output_field=models.BinaryField()),
+            )
+            with override_settings(PAYMENT_COMPRESSION_DICTIONARY=2):
+                self.assertEqual(fields.recompress(self.model, "data", chunk_size=2), 5)
+                self.assertEqual(fields.recompress(self.model, "data"), 0)
+                raw = self.model.objects.annotate(
+                    raw=ExpressionWrapper(F("data"), output_field=models.BinaryField()),
+                ).values_list("raw", flat=True)
+                self.assertTrue(all(fields.is_compressed(bytes(value), "zlib", 2) for value in raw))
+            self.assertEqual([row.data for row in self.model.objects.order_by("pk")], values)
+
+
+class CodecTest(TestCase):
+    def setUp(self):
+        self.session = stripe.StripeObject.construct_from(
+            {"id": "cs_test_1", "amount_total": 200, "line_items": [{"price": {"unit_amount": 200}}]},
+            "sk_test",
+        )
+
+    def test_stripe_object_is_stored(self):
+        for name in ("auto", "json"):
+            with self.subTest(codec=name), override_settings(PAYMENT_JSON_CODEC=name):
+                payment = Payment.objects.create(variant="stripe", total=10, extra_data={"session": self.session})
+                payment.refresh_from_db()
+                self.assertEqual(payment.extra_data["session"]["line_items"][0]["price"]["unit_amount"], 200)
+
+    def test_dumps_loads(self):
+        data = {"total": Decimal("10.50"), "session": self.session}
+        for name in ("auto", "json"):
+            with self.subTest(codec=name), override_settings(PAYMENT_JSON_CODEC=name):
+                self.assertEqual(codec.loads(codec.dumps(data))["total"], "10.50")
+                self.assertEqual(
+                    json.loads(json.dumps(data, cls=codec.PaymentJSONEncoder))["session"]["id"],
+                    "cs_test_1",
+                )
+
+    def test_parser(self):
+        parser = codec.FastJSONParser()
+        self.assertEqual(parser.parse(BytesIO(b'{"type": "event"}')), {"type": "event"})
+        with self.assertRaises(ParseError):
+            parser.parse(BytesIO(b"{"))
+
+
+class EventCoalescingTest(TestCase):
+    def setUp(self):
+        self.first = Payment.objects.create(variant="stripe", total=10)
+        self.second = Payment.objects.create(variant="stripe", total=20)
+
+    def event(self, pk, key):
+        return events.PaymentEvent("pk", str(pk), PaymentStatus.CONFIRMED.name, key, {"id": key})
+
+    def test_parse(self):
+        event = events.parse_event(
+            {
+                "type": "payment_intent.succeeded",
+                "data": {"object": {"status": "succeeded", "metadata": {"order_no": 1}}},
+            },
+        )
+        self.assertEqual((event.field, event.value, event.key), ("pk", 1, "payment_intend"))
+        self.assertIsNone(events.parse_event({"type": "payment_intent.created", "data": {"object": {}}}))
+
+    def test_apply_events_single_write(self):
+        batch = [
+            self.event(self.first.pk, "payment_intend"),
+            self.event(self.second.pk, "payment_intend"),
+            self.event(self.first.pk, "session"),
+            self.event(0, "session"),
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            errors = events.apply_events(batch)
+        self.assertEqual(len([query for query in queries.captured_queries if query["sql"].startswith("UPDATE")]), 1)
+        self.assertEqual(errors[:3], [None, None, None])
+        self.assertEqual(errors[3].code, "not_found")
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.status, PaymentStatus.CONFIRMED.name)
+        self.assertEqual(set(self.first.extra_data), {"payment_intend", "session"})
+
+    def test_apply_events_invalid_id(self):
+        errors = events.apply_events([self.event(self.first.pk, "session"), self.event("abc", "session")])
+        self.assertIsNone(errors[0])
+        self.assertEqual(errors[1].code, "not_found")
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.status, PaymentStatus.CONFIRMED.name)
+
+    def test_apply_events_sends_status_changed(self):
+        received = []
+
+        def receiver(sender, payment, previous, **kwargs):
+            received.append((payment.pk, previous))
+
+        status_changed.connect(receiver)
+        try:
+            events.apply_events([self.event(self.first.pk, "session"), self.event(self.first.pk, "payment_intend")])
+        finally:
+            status_changed.disconnect(receiver)
+        self.assertEqual(received, [(self.first.pk, PaymentStatus.WAITING.name)])
+
+    def test_coalescer_groups_window(self):
+        batches = []
+
+        def apply(batch):
+            batches.append(batch)
+            return [None if event.value else PaymentError("missing") for event in batch]
+
+        coalescer = events.Coalescer(apply=apply, window=0.1)
+        errors = []
+
+        def submit(value):
+            if error := coalescer.submit(events.PaymentEvent("pk", value, "CONFIRMED", "session", {})).exception():
+                errors.append(error)
+
+        threads = [threading.Thread(target=submit, args=(value,)) for value in (1, 2, 3, 0)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(len(batches[0]), 4)
+        self.assertEqual(len(errors), 1)
+
+    @patch("time.sleep")
+    def test_coalescer_disabled_by_default(self, mock_sleep):
+        applied = []
+        events.Coalescer(apply=lambda batch: applied.append(batch) or [None]).submit(self.event(self.first.pk, "s"))
+        self.assertEqual(len(applied), 1)
+        mock_sleep.assert_not_called()
+
+    @override_settings(PAYMENT_WEBHOOK_COALESCE_WINDOW=10)
+    def test_submit_inside_transaction(self):
+        events.submit(self.event(self.first.pk, "session"))
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.status, PaymentStatus.CONFIRMED.name)
+
+
+class ShardedProcessingTest(TestCase):
+    def setUp(self):
+        self.payment = Payment.objects.create(variant="stripe", total=10, status=PaymentStatus.REFUNDED.name)
+
+    def event(self, value, status=PaymentStatus.CONFIRMED.name):
+        return events.PaymentEvent("pk", value, status, "session", {"status": status})
+
+    def test_stale_event_skipped(self):
+        self.assertTrue(events.is_stale(PaymentStatus.REFUNDED.name, PaymentStatus.CONFIRMED.name))
+        self.assertTrue(events.is_stale(PaymentStatus.CONFIRMED.name, PaymentStatus.REJECTED.name))
+        self.assertFalse(events.is_stale(PaymentStatus.CONFIRMED.name, PaymentStatus.CONFIRMED.name))
+        self.assertFalse(events.is_stale(PaymentStatus.EXPIRED.name, PaymentStatus.CONFIRMED.name))
+        self.assertTrue(events.is_duplicate(PaymentStatus.CONFIRMED.name, PaymentStatus.CONFIRMED.name))
+        self.assertFalse(events.is_duplicate(PaymentStatus.WAITING.name, PaymentStatus.WAITING.name))
+        self.assertEqual(events.apply_events([self.event(self.payment.pk)]), [None])
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, PaymentStatus.REFUNDED.name)
+        self.assertNotIn("session", self.payment.extra_data)
+
+    def test_out_of_order_batch(self):
+        payment = Payment.objects.create(variant="stripe", total=10)
+        events.apply_events([self.event(payment.pk, PaymentStatus.REFUNDED.name), self.event(payment.pk)])
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, PaymentStatus.REFUNDED.name)
+
+    def test_events_of_payment_applied_in_order(self):
+        applied = []
+        lock = threading.Lock()
+
+        def apply(batch):
+            for event in batch:
+                time.sleep(0.001 * (event.value % 3))
+                with lock:
+                    applied.append((threading.current_thread().name, event.value, event.data["order"]))
+            return [None] * len(batch)
+
+        processor = events.ShardedProcessor(shards=4, apply=apply)
+        futures = [
+            processor.submit(events.PaymentEvent("pk", value, "CONFIRMED", "session", {"order": order}))
+            for order in range(5)
+            for value in range(8)
+        ]
+        for future in futures:
+            future.result(timeout=5)
+        processor.shutdown()
+        for value in range(8):
+            payment_events = [(thread, order) for thread, applied_value, order in applied if applied_value == value]
+            self.assertEqual([order for _, order in payment_events], list(range(5)))
+            self.assertEqual(len({thread for thread, _ in payment_events}), 1)
+        self.assertGreater(len({thread for thread, _, _ in applied}), 1)
+
+    def test_checkout_events_share_shard(self):
+        session = events.parse_event(
+            {
+                "type": "checkout.session.completed",
+                "data": {
+                    "object": {
+                        "id": "cs_1",
+                        "payment_status": "paid",
+                        "client_reference_id": "1",
+                        "payment_intent": "pi_1",
+                    },
+                },
+            },
+        )
+        intents = [
+            events.parse_event(
+                {"type": "payment_intent.succeeded", "data": {"object": {"id": intent, "status": "succeeded"}}},
+            )
+            for intent in ("pi_1", "pi_2")
+        ]
+        self.assertEqual(intents[0].value, None)
+        self.assertEqual(events.shard_key(session), events.shard_key(intents[0]))
+        # * Intents without order number don't collapse into single "pk:None" shard
+        self.assertNotEqual(events.shard_key(intents[0]), events.shard_key(intents[1]))
+        self.assertEqual(events.shard_key(self.event(1)), "pk:1")
+
+
+class DeadlineTest(TestCase):
+    def tearDown(self):
+        http.reset()
+
+    def test_timeout_capped_by_deadline(self):
+        self.assertIsNone(deadline.remaining())
+        self.assertEqual(deadline.timeout(), (5, 30))
+        with deadline.within(10):
+            connect, read = deadline.timeout((5, 30))
+            self.assertEqual(connect, 5)
+            self.assertTrue(9 < read <= 10)
+            # * Nested block can only shorten the deadline
+            with deadline.within(60):
+                self.assertLessEqual(deadline.remaining(), 10)
+            with deadline.within(2):
+                self.assertLessEqual(deadline.timeout(60), 2)
+        self.assertIsNone(deadline.remaining())
+
+    def test_exceeded(self):
+        with deadline.within(0):
+            self.assertTrue(deadline.expired())
+            with self.assertRaises(PaymentError) as e:
+                deadline.timeout()
+        self.assertEqual(e.exception.code, "deadline_exceeded")
+
+    @patch("requests.adapters.HTTPAdapter.send")
+    def test_session(self, mock_send):
+        mock_send.return_value = response = requests.Response()
+        response.status_code, response.url = 200, "https://example.com"
+        session = http.get_session("test")
+        with deadline.within(1):
+            session.get("https://example.com")
+        connect, read = mock_send.call_args.kwargs["timeout"]
+        self.assertLessEqual(connect, 1)
+        self.assertLessEqual(read, 1)
+        # * Gateway isn't called once deadline passed
+        mock_send.reset_mock()
+        with deadline.within(0), self.assertRaises(PaymentError) as e:
+            session.get("https://example.com")
+        self.assertEqual(e.exception.code, "deadline_exceeded")
+        mock_send.assert_not_called()
+
+    @patch("requests.adapters.HTTPAdapter.send")
+    def test_timeout_after_deadline(self, mock_send):
+        def send(*args, **kwargs):
+            time.sleep(0.02)
+            raise requests.exceptions.ReadTimeout()
+
+        mock_send.side_effect = send
+        with deadline.within(0.01), self.assertRaises(PaymentError) as e:
+            http.get_session("test").get("https://example.com")
+        self.assertEqual(e.exception.code, "deadline_exceeded")
+        self.assertIsInstance(e.exception.__cause__, requests.exceptions.ReadTimeout)
+
+    def test_retry_stops_before_deadline(self):
+        retry = http.DeadlineRetry(total=3, backoff_factor=0.5).increment(method="GET", url="/")
+        retry = retry.increment(method="GET", url="/")
+        self.assertFalse(retry.is_exhausted())
+        with deadline.within(0.5):
+            self.assertTrue(retry.is_exhausted())
+
+    def test_braintree_timeout(self):
+        provider = BraintreeProvider(merchant_id="id", public_key="pk", private_key="pk", sandbox=True)
+        self.assertEqual(provider.service.config.timeout, (5, 30))
+        with deadline.within(1):
+            self.assertLessEqual(max(provider.service.config.timeout), 1)
+
+    def test_stripe_client(self):
+        stripe.default_http_client = None
+        stripe_provider.configure("sk_test")
+        self.assertIsInstance(stripe.default_http_client._session, http.DeadlineSession)
+        stripe_provider._reset_http_client()
+
+    def test_middleware(self):
+        seen = []
+
+        def view(request):
+            seen.append(deadline.remaining())
+            return HttpResponse()
+
+        with override_settings(PAYMENT_REQUEST_DEADLINE=3):
+            deadline.PaymentDeadlineMiddleware(view)(RequestFactory().get("/"))
+        self.assertTrue(0 < seen[0] <= 3)
+        self.assertIsNone(deadline.remaining())
+
+    def test_worker_threads_inherit_deadline(self):
+        with deadline.within(5):
+            results = map_concurrently(lambda _: deadline.remaining(), range(2), 2)
+        self.assertTrue(all(0 < left <= 5 for _, left, _ in results))
+
+
+class WarmupTimeoutTest(TestCase):
+    def tearDown(self):
+        http.reset()
+
+    @override_settings(PAYMENT_WARMUP_TIMEOUT=0.5)
+    @patch("requests.Session.request")
+    def test_warmup_call_is_bounded(self, mock_request):
+        mock_request.side_effect = requests.exceptions.ConnectTimeout()
+        with self.assertLogs("drf_payments.warmup", "WARNING"):
+            self.assertEqual(warmup(["authorizenet"]), [])
+        self.assertLessEqual(max(mock_request.call_args.kwargs["timeout"]), 0.5)
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.30 on 2026-10-19 07:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="payment",
+            name="currency",
+            field=models.CharField(
+                choices=[
+                    ("CAD", "cad"),
+                    ("USD", "usd"),
+                    ("EUR", "eur"),
+                    ("GBP", "gbp"),
+                    ("AUD", "aud"),
+                    ("JPY", "jpy"),
+                    ("CHF", "chf"),
+                    ("HKD", "hkd"),
+                    ("NZD", "nzd"),
+                    ("SGD", "sgd"),
+                    ("SEK", "sek"),
+                    ("DKK", "dkk"),
+                    ("NOK", "nok"),
+                    ("MXN", "mxn"),
+                    ("BRL", "brl"),
+                    ("MYR", "myr"),
+                    ("PHP", "php"),
+                    ("THB", "thb"),
+                    ("IDR", "idr"),
+                    ("TRY", "try"),
+                    ("INR", "inr"),
+                    ("RUB", "rub"),
+                    ("ILS", "ils"),
+                    ("SAR", "sar"),
+                ],
+                default="USD",
+                max_length=10,
+                verbose_name="Currency",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="payment",
+            name="status",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("WAITING", "waiting"),
+                    ("PREAUTH", "preauth"),
+                    ("CONFIRMED", "confirmed"),
+                    ("REJECTED", "rejected"),
+                    ("REFUNDED", "refunded"),
+                    ("ERROR", "error"),
+                    ("INPUT", "input"),
+                    ("EXPIRED", "expired"),
+                ],
+                db_index=True,
+                default="WAITING",
+                max_length=255,
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-19 07:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0002_payment_status_index"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="payment",
+            name="token",
+            field=models.CharField(blank=True, db_index=True, default="", max_length=36),
+        ),
+        migrations.AlterField(
+            model_name="payment",
+            name="transaction_id",
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+    ]
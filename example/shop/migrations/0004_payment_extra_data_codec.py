@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-19 07:41
+
+from django.db import migrations, models
+import drf_payments.codec
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0003_payment_lookup_indexes"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="payment",
+            name="extra_data",
+            field=models.JSONField(
+                decoder=drf_payments.codec.PaymentJSONDecoder,
+                default=dict,
+                encoder=drf_payments.codec.PaymentJSONEncoder,
+            ),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-19 08:28
+
+from django.db import migrations, models
+import drf_payments.models
+
+
+def fill_tokens(apps, schema_editor):
+    Payment = apps.get_model("shop", "Payment")
+    for payment in Payment.objects.filter(token="").only("pk"):
+        Payment.objects.filter(pk=payment.pk).update(token=drf_payments.models.generate_token())
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shop", "0004_payment_extra_data_codec"),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_tokens, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="payment",
+            name="token",
+            field=models.CharField(blank=True, default=drf_payments.models.generate_token, max_length=36, unique=True),
+        ),
+    ]
@@ -1,13 +1,44 @@
+import base64
+import hashlib
+import hmac
+import json
 import os
-from unittest.mock import patch
-
+import threading
+import time
+import unittest
+import zlib
+from datetime import timedelta
+from functools import partial
+from io import StringIO
+from unittest.mock import Mock, patch
+
+import braintree
 import requests
 import stripe
-from django.test import TestCase, override_settings
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
-
-from drf_payments import get_payment_service
-from drf_payments.constants import PaymentError, PaymentStatus
+from django.utils import timezone
+
+from drf_payments import deadletter, get_payment_service, jobs, references, tasks, verification
+from drf_payments.capture import schedule_capture
+from drf_payments.catchup import catch_up
+from drf_payments.constants import JobStatus, PaymentError, PaymentStatus
+from drf_payments.events import ShardedProcessor, apply_events
+from drf_payments.mixins import PaymentViewMixin
+from drf_payments.models import (
+    IdempotencyRecord,
+    PaymentJob,
+    PaymentReference,
+    WebhookCheckpoint,
+    WebhookDeadLetter,
+)
+from drf_payments.status import invalidate
+from drf_payments.utils import map_concurrently
 
 from .models import Payment
 
@@ -425,6 +456,17 @@ class StripeCheckoutPaymentTestCase(TestCase):
         resp = self.client.post(f"{self.list_url}{self.payment.id}/refund/")
         self.assertEqual(resp.status_code, 400)
 
+    @patch("stripe.checkout.Session.expire")
+    def test_expire_session(self, mock_expire):
+        get_payment_service("stripe").expire(self.payment)
+        mock_expire.assert_called_once_with(self.payment.transaction_id)
+
+    @patch("stripe.checkout.Session.expire")
+    def test_expire_session_error(self, mock_expire):
+        mock_expire.side_effect = stripe.error.StripeError
+        with self.assertRaises(PaymentError):
+            get_payment_service("stripe").expire(self.payment)
+
     def test_already_processed(self):
         with self.assertRaises(PaymentError):
             get_payment_service("stripe").process_payment(self.payment)
@@ -935,7 +977,7 @@ class PaypalCheckoutPaymentTestCase(TestCase):
             ],
         }
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_create_payment(self, mock_payment):
         response = self.successful_checkout_session
         response["access_token"] = "DummyToken"
@@ -946,7 +988,7 @@ class PaypalCheckoutPaymentTestCase(TestCase):
         self.assertEqual(payment.status, PaymentStatus.WAITING.name)
         self.assertEqual(payment.extra_data["order"], response)
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_create_payment_timeout(self, mock_payment):
         response = self.successful_checkout_session
         response["access_token"] = "DummyToken"
@@ -958,13 +1000,13 @@ class PaypalCheckoutPaymentTestCase(TestCase):
             self.assertEqual(payment.status, PaymentStatus.WAITING.name)
             self.assertEqual(payment.extra_data["order"], self.successful_checkout_session)
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_token_error(self, mock_payment):
         mock_payment.return_value.json.return_value = self.successful_checkout_session
         with self.assertRaises(PaymentError):
             self.client.post(self.list_url, self.data)
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_success_callback(self, mock_token):
         mock_token.return_value.json.return_value = {"access_token": "DummyToken"}
         self.payment.transaction_id = self.success_checkout_event["resource"]["id"]
@@ -979,8 +1021,92 @@ class PaypalCheckoutPaymentTestCase(TestCase):
         self.assertEqual(self.payment.status, PaymentStatus.CONFIRMED.name)
         # Updates session data in DB
         self.assertEqual(resp.status_code, 201)
+        # * Capture is deferred to job, redelivered event doesn't schedule another one
+        mock_token.assert_not_called()
+        self.client.post(reverse("payment-callback"), data=self.success_checkout_event, content_type="application/json")
+        job = PaymentJob.objects.get(name="drf_payments.capture")
+        self.assertEqual(job.payment_id, str(self.payment.pk))
+
+    @patch("requests.Session.post")
+    def test_capture_job(self, mock_post):
+        mock_post.return_value.status_code = 500
+        mock_post.return_value.json.side_effect = [
+            {"access_token": "DummyToken"},
+            {"name": "INTERNAL_SERVER_ERROR", "message": "An internal server error occurred"},
+            {"access_token": "DummyToken"},
+            self.capture_event,
+        ]
+        self.payment.transaction_id = self.success_checkout_event["resource"]["id"]
+        self.payment.save()
+        job = jobs.enqueue("drf_payments.capture", payment=self.payment)
+        jobs.JobWorker().run_once()
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.PENDING.name)
+        self.assertEqual(job.last_error, "Can't capture payment")
+        self.assertGreater(job.run_after, timezone.now())
+        PaymentJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        jobs.JobWorker().run_once()
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.DONE.name)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.extra_data["order"]["status"], "COMPLETED")
+        # * Both attempts share idempotency key
+        keys = {call.kwargs["headers"].get("PayPal-Request-Id") for call in mock_post.call_args_list[1::2]}
+        self.assertEqual(len(keys), 1)
+
+    @patch("requests.Session.post")
+    def test_approval_redelivered_after_capture(self, mock_post):
+        mock_post.return_value.json.side_effect = [{"access_token": "DummyToken"}, self.capture_event]
+        self.payment.transaction_id = self.success_checkout_event["resource"]["id"]
+        self.payment.save()
+        url = reverse("payment-callback")
+        self.client.post(url, data=self.success_checkout_event, content_type="application/json")
+        jobs.JobWorker().run_once()
+        resp = self.client.post(url, data=self.success_checkout_event, content_type="application/json")
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(PaymentJob.objects.filter(name="drf_payments.capture").count(), 1)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, PaymentStatus.CONFIRMED.name)
+        self.assertEqual(self.payment.extra_data["order"]["status"], "COMPLETED")
+
+    @patch("requests.Session.get")
+    @patch("requests.Session.post")
+    def test_capture_already_captured(self, mock_post, mock_get):
+        mock_post.return_value.json.side_effect = [
+            {"access_token": "DummyToken"},
+            {"name": "UNPROCESSABLE_ENTITY", "details": [{"issue": "ORDER_ALREADY_CAPTURED"}]},
+        ]
+        mock_get.return_value.json.return_value = self.capture_event
+        self.payment.transaction_id = self.capture_event["id"]
+        self.payment.save()
+        get_payment_service("paypal").capture(self.payment)
+        order_url = f"https://api.sandbox.paypal.com/v2/checkout/orders/{self.capture_event['id']}"
+        self.assertEqual(mock_get.call_args.args[0], order_url)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.extra_data["order"]["status"], "COMPLETED")
+        self.assertEqual(self.payment.captured_amount, self.payment.total)
+        self.assertEqual(references.lookup(self.payment, "paypal", references.CAPTURE), "7D906882J3054405C")
+
+    @patch("requests.Session.post")
+    def test_capture_job_exhausted(self, mock_post):
+        mock_post.return_value.status_code = 422
+        mock_post.return_value.json.side_effect = [
+            {"access_token": "DummyToken"},
+            {"name": "UNPROCESSABLE_ENTITY", "message": "The requested action could not be performed"},
+        ]
+        self.payment.transaction_id = self.success_checkout_event["resource"]["id"]
+        self.payment.status = PaymentStatus.CONFIRMED.name
+        self.payment.save()
+        job = jobs.enqueue("drf_payments.capture", payment=self.payment, max_attempts=1)
+        with self.assertLogs("drf_payments.jobs", "ERROR"):
+            jobs.JobWorker().run_once()
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.FAILED.name)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, PaymentStatus.ERROR.name)
+        self.assertIn("Can't capture payment", self.payment.message)
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_failed_callback(self, mock_token):
         mock_token.return_value.json.return_value = {"access_token": "DummyToken"}
         self.payment.transaction_id = self.success_checkout_event["resource"]["id"]
@@ -998,7 +1124,7 @@ class PaypalCheckoutPaymentTestCase(TestCase):
         # Updates session data in DB
         self.assertEqual(resp.status_code, 201)
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_callback_wrong_id(self, mock_token):
         mock_token.return_value.json.return_value = {"access_token": "DummyToken"}
         self.payment.transaction_id = 0
@@ -1015,7 +1141,7 @@ class PaypalCheckoutPaymentTestCase(TestCase):
         # Updates session data in DB
         self.assertEqual(resp.status_code, 400)
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_refund_confirmed(self, mock_refund):
         response = self.refund_create
         response["access_token"] = "DummyToken"
@@ -1026,7 +1152,7 @@ class PaypalCheckoutPaymentTestCase(TestCase):
         resp = self.client.post(f"{self.list_url}{self.payment.id}/refund/")
         self.assertEqual(resp.status_code, 200)
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_refund_missing_data(self, mock_refund):
         response = self.refund_create
         response["access_token"] = "DummyToken"
@@ -1064,7 +1190,7 @@ class AuthorizeNetTestCase(TestCase):
             + "|auth_capture|||||,||||||||||||||||||||||||||||||||||XXXX0015|MasterCard|||||||||||||||||2|"
         )
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_create_payment(self, mock_post):
         mock_post.return_value.text.split.return_value = self.successful_transaction.split("|")
         resp = self.client.post(self.list_url, self.data)
@@ -1073,7 +1199,7 @@ class AuthorizeNetTestCase(TestCase):
         self.assertEqual(resp.status_code, 201)
         self.assertTrue("card" in payment.extra_data)
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_create_payment_failed(self, mock_post):
         failed_data = self.successful_transaction.split("|")
         failed_data[0] = "2"
@@ -1085,16 +1211,948 @@ class AuthorizeNetTestCase(TestCase):
         self.assertEqual(resp.status_code, 201)
         self.assertTrue("card" in payment.extra_data)
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_create_payment_failed_request(self, mock_post):
         mock_post.return_value.text = ""
         with self.assertRaises(PaymentError):
             self.client.post(self.list_url, self.data)
 
-    @patch("requests.post")
+    @patch("requests.Session.post")
     def test_create_payment_response_nok(self, mock_post):
         failed_data = self.successful_transaction.split("|")
         failed_data[0] = False
         mock_post.ok = False
         mock_post.return_value.text.split.return_value = failed_data
         self.client.post(self.list_url, self.data)
+
+
+class IdempotencyKeyTestCase(TestCase):
+    def setUp(self):
+        self.list_url = reverse("shop:payment-list")
+        self.data = {"variant": "stripe", "total": 200, "billing_email": "customer@example.com"}
+        self.session = {"id": "cs_test_1", "url": "https://checkout.stripe.com/c/pay/cs_test_1"}
+
+    @patch("stripe.checkout.Session.create")
+    def test_repeated_request_is_replayed(self, mock_session):
+        mock_session.return_value = self.session
+        first = self.client.post(self.list_url, self.data, HTTP_IDEMPOTENCY_KEY="key-1")
+        second = self.client.post(self.list_url, self.data, HTTP_IDEMPOTENCY_KEY="key-1")
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(PAYMENT_MODEL.objects.count(), 1)
+        self.assertEqual(mock_session.call_count, 1)
+
+    @patch("stripe.checkout.Session.create")
+    def test_different_keys(self, mock_session):
+        mock_session.return_value = self.session
+        self.client.post(self.list_url, self.data, HTTP_IDEMPOTENCY_KEY="key-1")
+        self.client.post(self.list_url, self.data, HTTP_IDEMPOTENCY_KEY="key-2")
+        self.client.post(self.list_url, self.data)
+        self.assertEqual(PAYMENT_MODEL.objects.count(), 3)
+
+    @patch("stripe.checkout.Session.create")
+    def test_key_reused_with_different_body(self, mock_session):
+        mock_session.return_value = self.session
+        self.client.post(self.list_url, self.data, HTTP_IDEMPOTENCY_KEY="key-1")
+        resp = self.client.post(self.list_url, {**self.data, "total": 300}, HTTP_IDEMPOTENCY_KEY="key-1")
+        self.assertEqual(resp.status_code, 422)
+
+    @patch("stripe.checkout.Session.create")
+    def test_key_too_long(self, mock_session):
+        resp = self.client.post(self.list_url, self.data, HTTP_IDEMPOTENCY_KEY="k" * 256)
+        self.assertEqual(resp.status_code, 400)
+        self.assertFalse(mock_session.called)
+        self.assertFalse(PAYMENT_MODEL.objects.exists())
+
+    @patch("stripe.checkout.Session.create")
+    def test_concurrent_duplicate(self, mock_session):
+        mock_session.return_value = self.session
+        self.client.post(self.list_url, self.data, HTTP_IDEMPOTENCY_KEY="key-1")
+        # * Original request is still processed
+        IdempotencyRecord.objects.update(
+            response_status=None,
+            response_body=None,
+            locked_until=timezone.now() + timedelta(seconds=30),
+        )
+        resp = self.client.post(self.list_url, self.data, HTTP_IDEMPOTENCY_KEY="key-1")
+        self.assertEqual(resp.status_code, 409)
+        # * Lock of crashed request expired, retry takes the key over
+        IdempotencyRecord.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        resp = self.client.post(self.list_url, self.data, HTTP_IDEMPOTENCY_KEY="key-1")
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(IdempotencyRecord.objects.get().response_status, 201)
+
+    @patch("stripe.checkout.Session.create")
+    def test_failed_request_can_be_retried(self, mock_session):
+        mock_session.side_effect = stripe.error.StripeError("test error")
+        with self.assertRaises(PaymentError):
+            self.client.post(self.list_url, self.data, HTTP_IDEMPOTENCY_KEY="key-1")
+        self.assertFalse(IdempotencyRecord.objects.exists())
+
+    @patch("stripe.checkout.Session.create")
+    def test_purge(self, mock_session):
+        mock_session.return_value = self.session
+        self.client.post(self.list_url, self.data, HTTP_IDEMPOTENCY_KEY="key-1")
+        IdempotencyRecord.objects.update(created=timezone.now() - timedelta(days=2))
+        out = StringIO()
+        call_command("purge_idempotency_keys", stdout=out)
+        self.assertIn("Deleted 1 record(s)", out.getvalue())
+
+
+@override_settings(PAYMENT_ASYNC_CREATE=True)
+class AsyncCreateTestCase(TestCase):
+    def setUp(self):
+        self.list_url = reverse("shop:payment-list")
+        self.data = {"variant": "stripe", "total": 200, "billing_email": "customer@example.com"}
+        self.session = {"id": "cs_test_1", "url": "https://checkout.stripe.com/c/pay/cs_test_1"}
+
+    @patch("stripe.checkout.Session.create")
+    def test_accepted_and_processed_on_commit(self, mock_session):
+        mock_session.return_value = self.session
+        with self.captureOnCommitCallbacks() as callbacks:
+            resp = self.client.post(self.list_url, self.data)
+        self.assertEqual(resp.status_code, 202)
+        self.assertIsNone(resp.json()["url"])
+        detail_url = reverse("shop:payment-detail", args=[resp.json()["id"]])
+        self.assertEqual(resp.headers["Location"], f"http://testserver{detail_url}")
+        mock_session.assert_not_called()
+        with patch("drf_payments.tasks.ThreadPoolBackend.get_executor") as mock_executor:
+            mock_executor.return_value.submit.side_effect = lambda func, *args: func(*args)
+            for callback in callbacks:
+                callback()
+        mock_session.assert_called_once()
+        status = self.client.get(detail_url)
+        self.assertEqual(status.json()["url"], self.session["url"])
+
+    @override_settings(PAYMENT_TASK_BACKEND="drf_payments.tasks.JobBackend")
+    @patch("stripe.checkout.Session.create")
+    def test_job_backend(self, mock_session):
+        mock_session.return_value = self.session
+        resp = self.client.post(self.list_url, self.data)
+        self.assertEqual(resp.status_code, 202)
+        mock_session.assert_not_called()
+        call_command("run_payment_jobs", "--once", stdout=StringIO())
+        mock_session.assert_called_once()
+        self.assertEqual(PAYMENT_MODEL.objects.get().transaction_id, "cs_test_1")
+
+    @override_settings(PAYMENT_TASK_BACKEND="drf_payments.tasks.JobBackend")
+    @patch("stripe.checkout.Session.create")
+    def test_job_backend_retries_gateway_error(self, mock_session):
+        mock_session.side_effect = stripe.error.APIConnectionError("Gateway is down")
+        self.client.post(self.list_url, self.data)
+        with self.assertLogs("drf_payments", "ERROR"):
+            call_command("run_payment_jobs", "--once", stdout=StringIO())
+        payment = PAYMENT_MODEL.objects.get()
+        self.assertEqual(payment.status, PaymentStatus.ERROR.name)
+        job = PaymentJob.objects.get()
+        self.assertEqual(job.status, JobStatus.PENDING.name)
+        mock_session.side_effect = None
+        mock_session.return_value = self.session
+        PaymentJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        call_command("run_payment_jobs", "--once", stdout=StringIO())
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, PaymentStatus.WAITING.name)
+        self.assertEqual(payment.transaction_id, "cs_test_1")
+        self.assertEqual(PaymentJob.objects.get().status, JobStatus.DONE.name)
+
+    @override_settings(PAYMENT_TASK_BACKEND="drf_payments.tasks.JobBackend")
+    @patch("stripe.checkout.Session.create")
+    def test_job_backend_does_not_retry_rejection(self, mock_session):
+        mock_session.side_effect = stripe.error.InvalidRequestError("Invalid currency", "currency", http_status=400)
+        self.client.post(self.list_url, self.data)
+        with self.assertLogs("drf_payments.tasks", "ERROR"):
+            call_command("run_payment_jobs", "--once", stdout=StringIO())
+        self.assertEqual(PAYMENT_MODEL.objects.get().status, PaymentStatus.ERROR.name)
+        self.assertEqual(PaymentJob.objects.get().status, JobStatus.DONE.name)
+
+    @override_settings(PAYMENT_TASK_BACKEND="drf_payments.tasks.ImmediateBackend")
+    @patch("stripe.checkout.Session.create")
+    def test_gateway_error_is_stored(self, mock_session):
+        mock_session.side_effect = stripe.error.APIConnectionError("Gateway is down")
+        with self.assertLogs("drf_payments.tasks", "ERROR"):
+            resp = self.client.post(self.list_url, self.data)
+        self.assertEqual(resp.status_code, 202)
+        payment = PAYMENT_MODEL.objects.get()
+        self.assertEqual(payment.status, PaymentStatus.ERROR.name)
+        self.assertIn("Gateway is down", payment.message)
+
+
+class PaymentStatusTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.payment = PAYMENT_MODEL.objects.create(variant="stripe", total=200)
+        self.url = reverse("payment-status", args=[self.payment.token])
+
+    def test_token_is_generated(self):
+        self.assertEqual(len(self.payment.token), 36)
+
+    @patch("stripe.checkout.Session.create")
+    def test_token_is_read_only(self, mock_session):
+        mock_session.return_value = {"id": "cs_test_1", "url": "https://checkout.stripe.com/c/pay/cs_test_1"}
+        data = {"variant": "stripe", "total": 200, "token": self.payment.token}
+        resp = self.client.post(reverse("shop:payment-list"), data)
+        self.assertEqual(resp.status_code, 201)
+        self.assertNotEqual(PAYMENT_MODEL.objects.get(pk=resp.json()["id"]).token, self.payment.token)
+
+    def test_status_fields_only(self):
+        resp = self.client.get(self.url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(set(resp.json()), {"token", "status", "fraud_status", "captured_amount", "url", "modified"})
+        self.assertEqual(resp.json()["status"], PaymentStatus.WAITING.name)
+
+    def test_unknown_token(self):
+        resp = self.client.get(reverse("payment-status", args=["unknown"]))
+        self.assertEqual(resp.status_code, 404)
+
+    def test_long_poll_returns_changed_status_at_once(self):
+        self.payment.status = PaymentStatus.CONFIRMED.name
+        self.payment.save()
+        with patch("drf_payments.notifications.LocalNotifier.subscribe") as mock_subscribe:
+            resp = self.client.get(self.url, {"status": PaymentStatus.WAITING.name, "wait": 10})
+        self.assertEqual(resp.json()["status"], PaymentStatus.CONFIRMED.name)
+        mock_subscribe.assert_not_called()
+
+    def test_long_poll_timeout(self):
+        resp = self.client.get(self.url, {"status": PaymentStatus.WAITING.name, "wait": 0.01})
+        self.assertEqual(resp.json()["status"], PaymentStatus.WAITING.name)
+
+    def test_long_poll_woken_by_status_change(self):
+        def confirm(timeout):
+            PAYMENT_MODEL.objects.filter(pk=self.payment.pk).update(status=PaymentStatus.CONFIRMED.name)
+            invalidate(tokens=[self.payment.token])
+            return True
+
+        with patch("threading.Event.wait", side_effect=confirm) as mock_wait:
+            resp = self.client.get(self.url, {"status": PaymentStatus.WAITING.name, "wait": 10})
+        self.assertEqual(resp.json()["status"], PaymentStatus.CONFIRMED.name)
+        mock_wait.assert_called_once_with(10)
+
+    def test_event_stream(self):
+        self.payment.status = PaymentStatus.CONFIRMED.name
+        self.payment.save()
+        resp = self.client.get(self.url, HTTP_ACCEPT="text/event-stream")
+        self.assertEqual(resp["Content-Type"], "text/event-stream")
+        events = b"".join(resp.streaming_content).decode()
+        self.assertEqual(events.count("data: "), 1)
+        self.assertIn(PaymentStatus.CONFIRMED.name, events)
+
+    def test_cached_projection(self):
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+            self.client.get(self.url)
+
+    @patch("stripe.checkout.Session.create")
+    def test_invalidated_on_transition(self, mock_session):
+        mock_session.return_value = {"id": "cs_test_1", "url": "https://checkout.stripe.com/c/pay/cs_test_1"}
+        self.assertIsNone(self.client.get(self.url).json()["url"])
+        get_payment_service("stripe").process_payment(self.payment)
+        self.assertEqual(self.client.get(self.url).json()["url"], "https://checkout.stripe.com/c/pay/cs_test_1")
+        self.payment.status = PaymentStatus.CONFIRMED.name
+        self.payment.save(update_fields=["status"])
+        self.assertEqual(self.client.get(self.url).json()["status"], PaymentStatus.CONFIRMED.name)
+
+    def test_status_by_pk(self):
+        resp = self.client.get(reverse("shop:payment-payment-status", args=[self.payment.pk]))
+        self.assertEqual(resp.json()["token"], self.payment.token)
+        resp = self.client.get(reverse("shop:payment-payment-status", args=[0]))
+        self.assertEqual(resp.status_code, 404)
+        resp = self.client.get(reverse("shop:payment-payment-status", args=["abc"]))
+        self.assertEqual(resp.status_code, 404)
+
+    def test_status_by_pk_is_scoped(self):
+        url = reverse("shop:payment-payment-status", args=[self.payment.pk])
+        with patch.object(PaymentViewMixin, "get_queryset", return_value=PAYMENT_MODEL.objects.none()):
+            resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 404)
+
+
+@override_settings(PAYMENT_BATCH_CONCURRENCY=1)
+class BatchCreateTestCase(TestCase):
+    def setUp(self):
+        self.url = reverse("shop:payment-batch-create")
+        self.data = [{"variant": "stripe", "total": 100 + i, "billing_email": "seller@example.com"} for i in range(3)]
+
+    @patch("stripe.checkout.Session.create")
+    def test_batch_create(self, mock_session):
+        mock_session.side_effect = [
+            {"id": "cs_1", "url": "https://checkout.stripe.com/c/pay/cs_1"},
+            stripe.error.InvalidRequestError("Invalid amount", "amount"),
+            {"id": "cs_3", "url": "https://checkout.stripe.com/c/pay/cs_3"},
+        ]
+        with self.assertLogs("drf_payments.tasks", "ERROR"):
+            resp = self.client.post(self.url, self.data, content_type="application/json")
+        self.assertEqual(resp.status_code, 207)
+        results = resp.json()
+        self.assertEqual([item["error"] is None for item in results], [True, False, True])
+        self.assertEqual(results[0]["payment"]["url"], "https://checkout.stripe.com/c/pay/cs_1")
+        self.assertEqual(PAYMENT_MODEL.objects.count(), 3)
+        self.assertEqual(PAYMENT_MODEL.objects.get(total=101).status, PaymentStatus.ERROR.name)
+        self.assertEqual(len({payment.token for payment in PAYMENT_MODEL.objects.all()}), 3)
+
+    def test_invalid_item(self):
+        resp = self.client.post(self.url, [*self.data, {"total": 100}], content_type="application/json")
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(PAYMENT_MODEL.objects.count(), 0)
+
+    @override_settings(PAYMENT_BATCH_MAX_SIZE=2)
+    def test_too_many_items(self):
+        resp = self.client.post(self.url, self.data, content_type="application/json")
+        self.assertEqual(resp.status_code, 400)
+
+    @override_settings(PAYMENT_ASYNC_CREATE=True, PAYMENT_TASK_BACKEND="drf_payments.tasks.JobBackend")
+    def test_async(self):
+        resp = self.client.post(self.url, self.data, content_type="application/json")
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(PaymentJob.objects.count(), 3)
+
+    @override_settings(PAYMENT_BATCH_CONCURRENCY=8)
+    @patch("stripe.checkout.Session.create")
+    def test_inline_in_transaction(self, mock_session):
+        mock_session.side_effect = lambda **kwargs: {"id": f"cs_{kwargs['client_reference_id']}", "url": "url"}
+        with patch("drf_payments.mixins.map_concurrently", wraps=map_concurrently) as mock_map:
+            resp = self.client.post(self.url, self.data, content_type="application/json")
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(mock_map.call_args.args[2], 1)
+
+
+@override_settings(PAYMENT_BATCH_CONCURRENCY=3)
+class ConcurrentBatchCreateTestCase(TransactionTestCase):
+    def setUp(self):
+        self.url = reverse("shop:payment-batch-create")
+        self.data = [{"variant": "stripe", "total": 100 + i, "billing_email": "seller@example.com"} for i in range(3)]
+
+    @patch("stripe.checkout.Session.create")
+    def test_batch_create(self, mock_session):
+        threads = set()
+
+        def create(**kwargs):
+            threads.add(threading.current_thread().name)
+            return {"id": f"cs_{kwargs['client_reference_id']}", "url": "https://checkout.stripe.com/c/pay/cs"}
+
+        lock, original = threading.Lock(), tasks.process
+
+        def process(payment):
+            # * SQLite allows one writer at a time
+            with lock:
+                return original(payment)
+
+        mock_session.side_effect = create
+        with patch("drf_payments.tasks.process", process):
+            resp = self.client.post(self.url, self.data, content_type="application/json")
+        self.assertEqual(resp.status_code, 201)
+        self.assertTrue(threads)
+        self.assertNotIn(threading.current_thread().name, threads)
+        for payment in PAYMENT_MODEL.objects.all():
+            self.assertEqual(payment.transaction_id, f"cs_{payment.pk}")
+
+
+class BatchStatusTestCase(TestCase):
+    def setUp(self):
+        self.url = reverse("shop:payment-batch-status")
+        self.payments = [
+            PAYMENT_MODEL.objects.create(variant="stripe", total=100, transaction_id=f"cs_{i}") for i in range(4)
+        ]
+
+    def test_lookup(self):
+        data = {
+            "ids": [self.payments[0].pk],
+            "tokens": [self.payments[1].token],
+            "transaction_ids": ["cs_2", "cs_unknown"],
+        }
+        with self.assertNumQueries(1):
+            resp = self.client.post(self.url, data, content_type="application/json")
+        self.assertEqual(resp.status_code, 200)
+        results = resp.json()["results"]
+        self.assertEqual(list(results), [str(payment.pk) for payment in self.payments[:3]])
+        self.assertEqual(results[str(self.payments[2].pk)]["transaction_id"], "cs_2")
+        self.assertNotIn("extra_data", results[str(self.payments[0].pk)])
+        self.assertIsNone(resp.json()["next"])
+
+    @override_settings(PAYMENT_BATCH_STATUS_PAGE_SIZE=3)
+    def test_pagination(self):
+        data = {"transaction_ids": [f"cs_{i}" for i in range(4)]}
+        first = self.client.post(self.url, data, content_type="application/json").json()
+        self.assertEqual(len(first["results"]), 3)
+        second = self.client.post(self.url, {**data, "after": first["next"]}, content_type="application/json").json()
+        self.assertEqual(list(second["results"]), [str(self.payments[3].pk)])
+        self.assertIsNone(second["next"])
+
+    @override_settings(PAYMENT_BATCH_STATUS_MAX_SIZE=2)
+    def test_bounded(self):
+        resp = self.client.post(self.url, {"tokens": ["a", "b", "c"]}, content_type="application/json")
+        self.assertEqual(resp.status_code, 400)
+
+    def test_invalid(self):
+        resp = self.client.post(self.url, {}, content_type="application/json")
+        self.assertEqual(resp.status_code, 400)
+        resp = self.client.post(self.url, {"ids": ["abc"]}, content_type="application/json")
+        self.assertEqual(resp.status_code, 400)
+
+
+class WebhookVerificationTestCase(TestCase):
+    def setUp(self):
+        self.url = reverse("payment-callback")
+        self.payment = PAYMENT_MODEL.objects.create(variant="stripe", total=200)
+        self.event = {
+            "type": "payment_intent.succeeded",
+            "data": {"object": {"status": "succeeded", "metadata": {"order_no": self.payment.pk}}},
+        }
+        verification.CERT_CACHE.clear()
+
+    def stripe_signature(self, payload, secret="whsec_test", timestamp=None):
+        timestamp = timestamp or int(time.time())
+        signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+        return f"t={timestamp},v1={signature}"
+
+    @override_settings(
+        PAYMENT_VARIANTS={
+            "stripe": (
+                "drf_payments.stripe.StripeProvider",
+                {"secret_key": "sk_test", "public_key": "pk_test", "webhook_secret": "whsec_test"},
+            ),
+        },
+    )
+    def test_stripe_signature(self):
+        payload = json.dumps(self.event)
+        resp = self.client.post(
+            self.url,
+            payload,
+            content_type="application/json",
+            HTTP_STRIPE_SIGNATURE=self.stripe_signature(payload),
+        )
+        self.assertEqual(resp.status_code, 201)
+        forged = self.stripe_signature(payload, secret="whsec_forged")
+        resp = self.client.post(self.url, payload, content_type="application/json", HTTP_STRIPE_SIGNATURE=forged)
+        self.assertEqual(resp.status_code, 403)
+        resp = self.client.post(self.url, payload, content_type="application/json")
+        self.assertEqual(resp.status_code, 403)
+        stale = self.stripe_signature(payload, timestamp=int(time.time()) - 3600)
+        resp = self.client.post(self.url, payload, content_type="application/json", HTTP_STRIPE_SIGNATURE=stale)
+        self.assertEqual(resp.status_code, 403)
+
+    @override_settings(PAYMENT_WEBHOOK_REQUIRE_SIGNATURE=True)
+    def test_signature_required(self):
+        resp = self.client.post(self.url, self.event, content_type="application/json")
+        self.assertEqual(resp.status_code, 403)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, PaymentStatus.WAITING.name)
+
+    @override_settings(
+        PAYMENT_VARIANTS={
+            "stripe": (
+                "drf_payments.stripe.StripeProvider",
+                {"secret_key": "sk_test", "public_key": "pk_test", "webhook_secret": "whsec_test"},
+            ),
+            "paypal": (
+                "drf_payments.paypal.PaypalProvider",
+                {"client_id": "client", "secret_key": "secret", "endpoint": "https://api.sandbox.paypal.com"},
+            ),
+        },
+    )
+    def test_unsigned_stripe_event_disguised_as_paypal(self):
+        # * PayPal without webhook id is not verified, forged Stripe event must not skip Stripe verification
+        resp = self.client.post(self.url, {**self.event, "event_type": "PING"}, content_type="application/json")
+        self.assertEqual(resp.status_code, 403)
+        resp = self.client.post(
+            self.url,
+            self.event,
+            content_type="application/json",
+            HTTP_PAYPAL_TRANSMISSION_ID="transmission-1",
+        )
+        self.assertEqual(resp.status_code, 403)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, PaymentStatus.WAITING.name)
+
+    @unittest.skipIf(verification.x509 is None, "cryptography is not installed")
+    @patch("drf_payments.verification.get_paypal_certificate")
+    def test_paypal_signature(self, mock_certificate):
+        payload = json.dumps({"event_type": "PAYMENT.CAPTURE.COMPLETED", "resource": {}}).encode()
+        headers = {
+            "Paypal-Transmission-Id": "transmission-1",
+            "Paypal-Transmission-Time": timezone.now().isoformat(),
+            "Paypal-Transmission-Sig": base64.b64encode(b"signature").decode(),
+            "Paypal-Cert-Url": "https://api.paypal.com/v1/notifications/certs/CERT-1",
+        }
+        verification.verify_paypal(payload, headers, "WH-1")
+        signature, message = mock_certificate.return_value.public_key.return_value.verify.call_args[0][:2]
+        self.assertEqual(signature, b"signature")
+        self.assertEqual(
+            message,
+            f"transmission-1|{headers['Paypal-Transmission-Time']}|WH-1|{zlib.crc32(payload)}".encode(),
+        )
+        mock_certificate.return_value.public_key.return_value.verify.side_effect = ValueError()
+        with self.assertRaises(PaymentError):
+            verification.verify_paypal(payload, headers, "WH-1")
+        with self.assertRaises(PaymentError):
+            verification.verify_paypal(payload, {**headers, "Paypal-Transmission-Time": "2020-01-01T00:00:00Z"}, "WH-1")
+
+    def test_paypal_certificate_host(self):
+        with self.assertRaises(PaymentError):
+            verification.get_paypal_certificate("https://attacker.example.com/cert.pem")
+
+    @patch("braintree.BraintreeGateway")
+    def test_braintree_invalid_signature(self, mock):
+        mock.return_value.webhook_notification.parse.side_effect = braintree.exceptions.InvalidSignatureError()
+        payload = {"bt_signature": "DummySignature", "bt_payload": "DummyPayload"}
+        resp = self.client.post(self.url, payload, content_type="application/json")
+        self.assertEqual(resp.status_code, 403)
+
+
+@override_settings(PAYMENT_DEAD_LETTER_CONCURRENCY=1)
+class WebhookDeadLetterTestCase(TestCase):
+    def setUp(self):
+        self.url = reverse("payment-callback")
+        self.event = {
+            "id": "evt_1",
+            "type": "payment_intent.succeeded",
+            "data": {"object": {"status": "succeeded", "metadata": {"order_no": 999}}},
+        }
+
+    def test_failed_event_stored(self):
+        for _ in range(2):
+            resp = self.client.post(self.url, data=self.event, content_type="application/json")
+            self.assertEqual(resp.status_code, 400)
+        letter = WebhookDeadLetter.objects.get()
+        self.assertEqual(
+            (letter.event_id, letter.gateway, letter.event_type, letter.error_code, letter.failures),
+            ("stripe:evt_1", "stripe", "payment_intent.succeeded", "not_found", 2),
+        )
+
+    def test_replay_command(self):
+        self.client.post(self.url, data=self.event, content_type="application/json")
+        out = StringIO()
+        call_command("replay_webhooks", "--concurrency", "1", "--gateway", "paypal", stdout=out)
+        self.assertIn("Resolved 0 event(s), 0 still failing", out.getvalue())
+        call_command("replay_webhooks", "--concurrency", "1", stdout=out)
+        self.assertIn("Resolved 0 event(s), 1 still failing", out.getvalue())
+        self.assertEqual(WebhookDeadLetter.objects.get().failures, 2)
+        payment = PAYMENT_MODEL.objects.create(pk=999, variant="stripe", total=200)
+        call_command("replay_webhooks", "--concurrency", "1", "--error-code", "not_found", stdout=out)
+        self.assertIn("Resolved 1 event(s), 0 still failing", out.getvalue())
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, PaymentStatus.CONFIRMED.name)
+        self.assertIsNotNone(WebhookDeadLetter.objects.get().resolved_at)
+
+    def test_admin_replay(self):
+        self.client.post(self.url, data=self.event, content_type="application/json")
+        PAYMENT_MODEL.objects.create(pk=999, variant="stripe", total=200)
+        self.client.force_login(get_user_model().objects.create_superuser("admin", "admin@example.com", "admin"))
+        resp = self.client.post(
+            reverse("admin:drf_payments_webhookdeadletter_changelist"),
+            {"action": "replay_events", "_selected_action": WebhookDeadLetter.objects.values_list("pk", flat=True)},
+        )
+        self.assertEqual(resp.status_code, 302)
+        self.assertIsNotNone(WebhookDeadLetter.objects.get().resolved_at)
+
+
+class AtomicRequestsDeadLetterTestCase(TransactionTestCase):
+    def test_failed_event_stored(self):
+        event = {
+            "id": "evt_1",
+            "type": "payment_intent.succeeded",
+            "data": {"object": {"status": "succeeded", "metadata": {"order_no": 999}}},
+        }
+        with patch.dict(connections["default"].settings_dict, {"ATOMIC_REQUESTS": True}):
+            resp = self.client.post(reverse("payment-callback"), data=event, content_type="application/json")
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(WebhookDeadLetter.objects.get().event_id, "stripe:evt_1")
+
+
+class ParallelReplayTestCase(TransactionTestCase):
+    def event(self, event_id, order_no):
+        return {
+            "id": event_id,
+            "type": "payment_intent.succeeded",
+            "data": {"object": {"status": "succeeded", "metadata": {"order_no": order_no}}},
+        }
+
+    def test_replay(self):
+        payments = [PAYMENT_MODEL.objects.create(variant="stripe", total=100 + i) for i in range(4)]
+        with self.assertLogs("drf_payments.deadletter", "WARNING"):
+            for payment in payments:
+                deadletter.store(self.event(f"evt_{payment.pk}", payment.pk), PaymentError("test", code="not_found"))
+            deadletter.store(self.event("evt_missing", 999), PaymentError("test", code="not_found"))
+        lock, threads = threading.Lock(), set()
+
+        def apply(batch):
+            # * SQLite allows one writer at a time
+            with lock:
+                threads.add(threading.current_thread().name)
+                return apply_events(batch)
+
+        with patch("drf_payments.deadletter.ShardedProcessor", partial(ShardedProcessor, apply=apply)):
+            self.assertEqual(deadletter.replay(concurrency=4, chunk_size=2), (4, 1))
+        self.assertNotIn(threading.current_thread().name, threads)
+        self.assertEqual(
+            PAYMENT_MODEL.objects.filter(status=PaymentStatus.CONFIRMED.name).count(),
+            len(payments),
+        )
+        self.assertEqual(WebhookDeadLetter.objects.get(resolved_at=None).event_id, "stripe:evt_missing")
+
+
+class CatchUpTestCase(TestCase):
+    def setUp(self):
+        self.payment = PAYMENT_MODEL.objects.create(variant="stripe", total=200, transaction_id="txn_1")
+
+    def stripe_event(self, event_id, order_no):
+        return stripe.StripeObject.construct_from(
+            {
+                "id": event_id,
+                "type": "payment_intent.succeeded",
+                "data": {"object": {"status": "succeeded", "metadata": {"order_no": order_no}}},
+            },
+            "sk_test",
+        )
+
+    @patch("stripe.Event.list")
+    def test_stripe(self, mock_list):
+        events = [self.stripe_event("evt_1", self.payment.pk), self.stripe_event("evt_2", 999)]
+        mock_list.return_value.auto_paging_iter.return_value = iter(events + events[:1])
+        out = StringIO()
+        call_command("catch_up_webhooks", "--variant", "stripe", "--concurrency", "1", stdout=out)
+        self.assertIn("stripe: applied 1 event(s), 1 duplicate(s), 1 failed", out.getvalue())
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, PaymentStatus.CONFIRMED.name)
+        self.assertEqual(self.payment.extra_data["payment_intend"]["status"], "succeeded")
+        self.assertEqual(WebhookDeadLetter.objects.get().event_id, "stripe:evt_2")
+        checkpoint = WebhookCheckpoint.objects.get(variant="stripe")
+        self.assertIsNotNone(checkpoint.synced_until)
+        # * The next run starts from checkpoint
+        mock_list.return_value.auto_paging_iter.return_value = iter([])
+        call_command("catch_up_webhooks", "--variant", "stripe", "--concurrency", "1", stdout=out)
+        since = mock_list.call_args.kwargs["created"]["gte"]
+        self.assertEqual(since, int((checkpoint.synced_until - timedelta(seconds=300)).timestamp()))
+
+    @patch("requests.Session.get")
+    @patch("requests.Session.post")
+    def test_paypal(self, mock_token, mock_get):
+        mock_token.return_value.json.return_value = {"access_token": "DummyToken"}
+        event = {"id": "WH-1", "event_type": "CHECKOUT.ORDER.APPROVED", "resource": {"id": "txn_1", "status": "FAILED"}}
+        mock_get.return_value.json.side_effect = [
+            {"events": [event], "links": [{"rel": "next", "href": "https://api.sandbox.paypal.com/next"}]},
+            {"events": [event], "links": []},
+        ]
+        out = StringIO()
+        call_command("catch_up_webhooks", "--variant", "paypal", "--since", "2024-01-01T00:00:00Z", stdout=out)
+        self.assertIn("paypal: applied 0 event(s), 1 duplicate(s), 0 failed", out.getvalue())
+        self.assertEqual(mock_get.call_args_list[0].kwargs["params"]["start_time"], "2024-01-01T00:00:00Z")
+        self.assertEqual(mock_get.call_args_list[1].args[0], "https://api.sandbox.paypal.com/next")
+
+    @patch("drf_payments.BraintreeProvider._serialize")
+    @patch("braintree.BraintreeGateway")
+    def test_braintree(self, mock, serialize):
+        serialize.return_value = {"id": "txn_1", "status": "submitted_for_settlement"}
+        mock.return_value.transaction.search.return_value.items = [Mock()]
+        out = StringIO()
+        call_command("catch_up_webhooks", "--variant", "braintree", "--concurrency", "1", stdout=out)
+        self.assertIn("braintree: applied 1 event(s), 0 duplicate(s), 0 failed", out.getvalue())
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.extra_data["transaction"]["status"], "submitted_for_settlement")
+
+    @patch("drf_payments.BraintreeProvider._serialize")
+    @patch("braintree.BraintreeGateway")
+    def test_braintree_status(self, mock, serialize):
+        serialize.side_effect = [{"id": "txn_1", "status": "voided"}, {"id": "txn_2", "status": "authorizing"}]
+        mock.return_value.transaction.search.return_value.items = [Mock(), Mock()]
+        out = StringIO()
+        call_command("catch_up_webhooks", "--variant", "braintree", "--concurrency", "1", stdout=out)
+        self.assertIn("braintree: applied 1 event(s), 0 duplicate(s), 0 failed", out.getvalue())
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, PaymentStatus.REJECTED.name)
+
+    @patch("drf_payments.BraintreeProvider._serialize")
+    @patch("braintree.BraintreeGateway")
+    def test_braintree_voided(self, mock, serialize):
+        authorized_payment = PAYMENT_MODEL.objects.create(variant="braintree", total=100, transaction_id="txn_2")
+        voided, authorized = Mock(id="txn_1"), Mock(id="txn_2")
+        found = {"authorized_at": [voided, authorized], "voided_at": [voided]}
+        mock.return_value.transaction.search.side_effect = lambda node: Mock(items=found.get(node.name, []))
+        serialize.side_effect = [{"id": "txn_1", "status": "voided"}, {"id": "txn_2", "status": "authorized"}]
+        out = StringIO()
+        call_command("catch_up_webhooks", "--variant", "braintree", "--concurrency", "1", stdout=out)
+        # * Transaction found by both authorization and void is applied once
+        self.assertIn("braintree: applied 2 event(s), 0 duplicate(s), 0 failed", out.getvalue())
+        self.assertEqual(serialize.call_count, 2)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, PaymentStatus.REJECTED.name)
+        authorized_payment.refresh_from_db()
+        self.assertEqual(authorized_payment.status, PaymentStatus.PREAUTH.name)
+
+    def test_transaction_payload_is_not_webhook(self):
+        payload = {"bt_transaction": {"id": "txn_1", "status": "settled"}}
+        resp = self.client.post(reverse("payment-callback"), payload, content_type="application/json")
+        self.assertEqual(resp.status_code, 400)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, PaymentStatus.WAITING.name)
+        self.assertFalse(WebhookDeadLetter.objects.exists())
+
+    def test_unsupported_variant(self):
+        out = StringIO()
+        call_command("catch_up_webhooks", "--variant", "authorizenet", stdout=out)
+        self.assertIn("authorizenet: gateway events can't be listed, skipped", out.getvalue())
+
+
+class ParallelCatchUpTestCase(TransactionTestCase):
+    def stripe_event(self, event_id, order_no):
+        return stripe.StripeObject.construct_from(
+            {
+                "id": event_id,
+                "type": "payment_intent.succeeded",
+                "data": {"object": {"status": "succeeded", "metadata": {"order_no": order_no}}},
+            },
+            "sk_test",
+        )
+
+    @patch("stripe.Event.list")
+    def test_stripe(self, mock_list):
+        payments = [PAYMENT_MODEL.objects.create(variant="stripe", total=100 + i) for i in range(4)]
+        events = [self.stripe_event(f"evt_{payment.pk}", payment.pk) for payment in payments]
+        mock_list.return_value.auto_paging_iter.return_value = iter([*events, self.stripe_event("evt_missing", 999)])
+        lock, threads = threading.Lock(), set()
+
+        def apply(batch):
+            # * SQLite allows one writer at a time
+            with lock:
+                threads.add(threading.current_thread().name)
+                return apply_events(batch)
+
+        with patch("drf_payments.catchup.ShardedProcessor", partial(ShardedProcessor, apply=apply)):
+            with self.assertLogs("drf_payments.deadletter", "WARNING"):
+                result = catch_up("stripe", concurrency=4, max_pending=2)
+        self.assertEqual(result, (4, 0, 1))
+        self.assertNotIn(threading.current_thread().name, threads)
+        self.assertEqual(
+            PAYMENT_MODEL.objects.filter(status=PaymentStatus.CONFIRMED.name).count(),
+            len(payments),
+        )
+        self.assertEqual(WebhookDeadLetter.objects.get().event_id, "stripe:evt_missing")
+
+
+def authorize_only(variant):
+    """Settings override switching ``variant`` to authorize-only mode"""
+    path, config = settings.PAYMENT_VARIANTS[variant]
+    return override_settings(
+        PAYMENT_VARIANTS={**settings.PAYMENT_VARIANTS, variant: (path, {**config, "capture": False})},
+    )
+
+
+@override_settings(PAYMENT_CAPTURE_CONCURRENCY=1)
+class AuthorizeCaptureTestCase(TestCase):
+    def setUp(self):
+        self.list_url = reverse("shop:payment-list")
+
+    @patch("stripe.PaymentIntent.capture")
+    @patch("stripe.checkout.Session.create")
+    def test_stripe_checkout(self, mock_session, mock_capture):
+        mock_session.return_value = {"id": "cs_1", "url": "https://checkout.stripe.com/cs_1"}
+        with authorize_only("stripe"):
+            resp = self.client.post(self.list_url, {"variant": "stripe", "total": 200})
+            payment = PAYMENT_MODEL.objects.get(pk=resp.data["id"])
+            intent_data = mock_session.call_args.kwargs["payment_intent_data"]
+            self.assertEqual(intent_data["capture_method"], "manual")
+            self.assertEqual(intent_data["metadata"], {"order_no": payment.pk})
+            event = {
+                "id": "evt_1",
+                "type": "payment_intent.amount_capturable_updated",
+                "data": {"object": {"id": "pi_1", "status": "requires_capture", "metadata": {"order_no": payment.pk}}},
+            }
+            self.client.post(reverse("payment-callback"), data=event, content_type="application/json")
+            payment.refresh_from_db()
+            self.assertEqual(payment.status, PaymentStatus.PREAUTH.name)
+            mock_capture.return_value = {"id": "pi_1", "status": "succeeded"}
+            resp = self.client.post(f"{self.list_url}{payment.pk}/capture/", {"amount": "150.00"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(mock_capture.call_args.args[0], "pi_1")
+        self.assertEqual(mock_capture.call_args.kwargs["amount_to_capture"], 15000)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, PaymentStatus.CONFIRMED.name)
+        self.assertEqual(payment.captured_amount, 150)
+
+    @patch("drf_payments.BraintreeProvider._serialize")
+    @patch("braintree.BraintreeGateway")
+    def test_braintree(self, mock, serialize):
+        mock.return_value.transaction.sale.return_value.transaction.id = "txn_1"
+        serialize.return_value = {"id": "txn_1"}
+        data = {"variant": "braintree", "total": 200, "transaction_id": "fake-valid-nonce"}
+        with authorize_only("braintree"):
+            self.client.post(self.list_url, data)
+            self.client.post(self.list_url, data)
+            self.assertFalse(mock.return_value.transaction.sale.call_args.args[0]["options"]["submit_for_settlement"])
+            self.assertEqual(PAYMENT_MODEL.objects.filter(status=PaymentStatus.PREAUTH.name).count(), 2)
+            mock.return_value.transaction.submit_for_settlement.return_value.is_success = True
+            out = StringIO()
+            call_command("capture_payments", "--variant", "braintree", "--chunk-size", "1", stdout=out)
+        self.assertIn("Captured 2 payment(s), 0 failed", out.getvalue())
+        self.assertEqual(mock.return_value.transaction.submit_for_settlement.call_count, 2)
+        self.assertEqual(
+            PAYMENT_MODEL.objects.filter(status=PaymentStatus.CONFIRMED.name, captured_amount=200).count(),
+            2,
+        )
+
+    @patch("braintree.BraintreeGateway")
+    def test_braintree_declined(self, mock):
+        mock.return_value.transaction.sale.return_value.is_success = False
+        mock.return_value.transaction.sale.return_value.message = "Do Not Honor"
+        payment = PAYMENT_MODEL.objects.create(variant="braintree", total=200, transaction_id="fake-valid-nonce")
+        with authorize_only("braintree"), self.assertRaises(PaymentError) as context:
+            get_payment_service("braintree").process_payment(payment)
+        self.assertEqual(context.exception.code, "process_failed")
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, PaymentStatus.WAITING.name)
+        self.assertNotIn("transaction", payment.extra_data)
+
+    @patch("requests.Session.post")
+    def test_authorizenet(self, mock_post):
+        response = "1|1|1|This transaction has been approved.|000000|P|7|||200.00|CC|auth_only"
+        mock_post.return_value.text = response
+        data = {
+            "variant": "authorizenet",
+            "total": 200,
+            "card": 5424000000000015,
+            "card_expiration": "2025-12",
+            "card_cvv": 123,
+        }
+        with authorize_only("authorizenet"):
+            self.client.post(self.list_url, data)
+            self.assertEqual(mock_post.call_args.kwargs["data"]["x_type"], "AUTH_ONLY")
+            payment = PAYMENT_MODEL.objects.get(variant="authorizenet")
+            self.assertEqual(payment.status, PaymentStatus.PREAUTH.name)
+            resp = self.client.post(f"{self.list_url}{payment.pk}/capture/", {"amount": "50"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(mock_post.call_args.kwargs["data"]["x_type"], "PRIOR_AUTH_CAPTURE")
+        self.assertEqual(mock_post.call_args.kwargs["data"]["x_trans_id"], "7")
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, PaymentStatus.CONFIRMED.name)
+        self.assertEqual(payment.captured_amount, 50)
+
+    def test_capture_requires_preauth(self):
+        payment = PAYMENT_MODEL.objects.create(variant="authorizenet", total=200, transaction_id="7")
+        resp = self.client.post(f"{self.list_url}{payment.pk}/capture/")
+        self.assertEqual(resp.status_code, 400)
+
+    def test_capture_is_scoped(self):
+        payment = PAYMENT_MODEL.objects.create(variant="authorizenet", total=200, status=PaymentStatus.PREAUTH.name)
+        with patch.object(PaymentViewMixin, "get_queryset", return_value=PAYMENT_MODEL.objects.none()):
+            resp = self.client.post(f"{self.list_url}{payment.pk}/capture/")
+        self.assertEqual(resp.status_code, 404)
+
+    @patch("requests.Session.get")
+    @patch("requests.Session.post")
+    def test_paypal_already_authorized(self, mock_post, mock_get):
+        payment = PAYMENT_MODEL.objects.create(variant="paypal", total=200, transaction_id="ORDER-1")
+        mock_post.return_value.json.side_effect = [
+            {"access_token": "DummyToken"},
+            {"name": "UNPROCESSABLE_ENTITY", "details": [{"issue": "ORDER_ALREADY_AUTHORIZED"}]},
+        ]
+        mock_get.return_value.json.return_value = {
+            "id": "ORDER-1",
+            "status": "COMPLETED",
+            "purchase_units": [{"payments": {"authorizations": [{"id": "AUTH-1", "status": "CREATED"}]}}],
+        }
+        with authorize_only("paypal"):
+            get_payment_service("paypal").authorize(payment)
+        self.assertTrue(mock_get.call_args.args[0].endswith("/v2/checkout/orders/ORDER-1"))
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, PaymentStatus.PREAUTH.name)
+        self.assertEqual(payment.extra_data["order"]["id"], "ORDER-1")
+        self.assertEqual(references.lookup(payment, "paypal", references.AUTHORIZATION), "AUTH-1")
+
+    @patch("braintree.BraintreeGateway")
+    def test_batch_job_retries_failed(self, mock):
+        ok, failing = [
+            PAYMENT_MODEL.objects.create(
+                variant="braintree",
+                total=100,
+                transaction_id=txn,
+                status=PaymentStatus.PREAUTH.name,
+            )
+            for txn in ("txn_ok", "txn_failing")
+        ]
+
+        def settle(transaction_id, *args):
+            return Mock(is_success=transaction_id == "txn_ok", message="Declined", transaction=Mock())
+
+        mock.return_value.transaction.submit_for_settlement.side_effect = settle
+        with patch("drf_payments.BraintreeProvider._serialize", return_value={}):
+            job = schedule_capture([ok.pk, failing.pk], amounts={ok.pk: "60"})
+            jobs.JobWorker().run_once()
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.PENDING.name)
+        self.assertIn(str(failing.pk), job.last_error)
+        ok.refresh_from_db()
+        self.assertEqual((ok.status, ok.captured_amount), (PaymentStatus.CONFIRMED.name, 60))
+        self.assertEqual(mock.return_value.transaction.submit_for_settlement.call_args_list[0].args, ("txn_ok", "60"))
+
+
+class PaymentReferenceTestCase(TestCase):
+    def setUp(self):
+        self.list_url = reverse("shop:payment-list")
+
+    def post_event(self, event):
+        return self.client.post(reverse("payment-callback"), data=event, content_type="application/json")
+
+    @patch("stripe.Refund.create")
+    @patch("stripe.checkout.Session.create")
+    def test_stripe_checkout(self, mock_session, mock_refund):
+        mock_session.return_value = {"id": "cs_1", "url": "https://checkout.stripe.com/cs_1", "payment_intent": None}
+        resp = self.client.post(self.list_url, {"variant": "stripe", "total": 200})
+        payment = PAYMENT_MODEL.objects.get(pk=resp.data["id"])
+        session = {
+            "id": "cs_1",
+            "url": None,
+            "payment_status": "paid",
+            "client_reference_id": None,
+            "payment_intent": "pi_1",
+        }
+        # * Session is resolved by its id even without client_reference_id
+        self.post_event({"id": "evt_1", "type": "checkout.session.completed", "data": {"object": session}})
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, PaymentStatus.CONFIRMED.name)
+        self.assertEqual(references.lookup(payment, "stripe", references.INTENT), "pi_1")
+        # * Intent created by checkout has no order_no, it's known from session event
+        intent = {"id": "pi_1", "status": "succeeded", "latest_charge": "ch_1", "metadata": {}}
+        resp = self.post_event({"id": "evt_2", "type": "payment_intent.succeeded", "data": {"object": intent}})
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(
+            references.resolve([("stripe", "ch_1"), ("stripe", "cs_1"), ("paypal", "pi_1")]),
+            {("stripe", "ch_1"): str(payment.pk), ("stripe", "cs_1"): str(payment.pk)},
+        )
+        mock_refund.return_value = {"id": "re_1"}
+        self.client.post(f"{self.list_url}{payment.pk}/refund/")
+        self.assertEqual(mock_refund.call_args.kwargs["payment_intent"], "pi_1")
+        self.assertEqual(references.lookup(payment, "stripe", references.REFUND), "re_1")
+
+    @patch("requests.Session.post")
+    def test_paypal(self, mock_post):
+        payment = PAYMENT_MODEL.objects.create(
+            variant="paypal",
+            total=200,
+            transaction_id="ORDER-1",
+            status=PaymentStatus.CONFIRMED.name,
+        )
+        references.remember(payment, "paypal", order="ORDER-1", capture="CAPTURE-1")
+        mock_post.return_value.json.side_effect = [
+            {"access_token": "DummyToken"},
+            {"id": "REFUND-1", "links": [{}, {"href": ""}]},
+        ]
+        self.client.post(f"{self.list_url}{payment.pk}/refund/")
+        self.assertTrue(mock_post.call_args.args[0].endswith("/v2/payments/captures/CAPTURE-1/refund"))
+        self.assertEqual(references.lookup(payment, "paypal", references.REFUND), "REFUND-1")
+
+    def test_one_lookup(self):
+        payments = [
+            PAYMENT_MODEL.objects.create(variant="paypal", total=200, transaction_id=f"ORDER-{i}") for i in "12"
+        ]
+        for payment in payments:
+            references.remember(payment, "paypal", order=payment.transaction_id)
+        # * Known identifier is kept
+        references.remember(payments[1], "paypal", order="ORDER-1")
+        self.assertEqual(PaymentReference.objects.get(reference="ORDER-1").payment_id, str(payments[0].pk))
+        with self.assertNumQueries(1):
+            resolved = references.resolve([("paypal", "ORDER-1"), ("paypal", "ORDER-2"), ("stripe", None)])
+        self.assertEqual(
+            resolved,
+            {("paypal", "ORDER-1"): str(payments[0].pk), ("paypal", "ORDER-2"): str(payments[1].pk)},
+        )